@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Import time benchmark for the q2_itsxpress plugin.
+
+QIIME 2 imports every plugin on each command, so the time taken to import
+q2_itsxpress.plugin_setup is added to `qiime --help`, `qiime tools` and every other
+command. Each measurement runs in a fresh interpreter. qiime2 and q2_types are imported
+first, as QIIME 2 has always loaded them before a plugin, so only the plugin's own
+cost is timed. The lazy mode imports the plugin as QIIME 2 does, the eager mode also
+imports the trimming module, as every command did before the actions were deferred.
+
+Usage:
+    python benchmarks/bench_startup.py --repeat 20
+    python benchmarks/bench_startup.py --repeat 20 --cli
+
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["itsxpress", "Bio", "q2_itsxpress._itsxpress"]
+
+_MEASURE = """
+import json, sys, time
+import qiime2.plugin
+import q2_types.per_sample_sequences
+t0 = time.perf_counter()
+import q2_itsxpress.plugin_setup
+if {eager}:
+    import q2_itsxpress._itsxpress
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"seconds": elapsed,
+                  "loaded": [m for m in {heavy} if m in sys.modules]}}))
+"""
+
+
+def measure(eager, repeat):
+    """Imports the plugin in fresh interpreters.
+
+    Args:
+        eager (bool): Also import the trimming module.
+        repeat (int): The number of interpreters to time.
+
+    Returns:
+        (dict): The median and minimum import time in seconds and the heavy modules loaded.
+
+    """
+    code = _MEASURE.format(eager=eager, heavy=HEAVY_MODULES)
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        p = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True)
+        result = json.loads(p.stdout.decode('utf-8').splitlines()[-1])
+        times.append(result["seconds"])
+        loaded = result["loaded"]
+    return {"median": statistics.median(times), "min": min(times), "loaded": loaded}
+
+
+def measure_cli(repeat):
+    """Times `qiime --help` end to end.
+
+    Args:
+        repeat (int): The number of runs.
+
+    Returns:
+        (dict): The median and minimum wall time in seconds.
+
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(["qiime", "--help"], stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - t0)
+    return {"median": statistics.median(times), "min": min(times)}
+
+
+def myparser():
+    parser = argparse.ArgumentParser(description='Import time benchmark for the q2_itsxpress plugin.')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--cli', action='store_true', help='Also time `qiime --help`.')
+    return parser
+
+
+def main(args=None):
+    args = myparser().parse_args(args)
+    result = {"lazy": measure(False, args.repeat),
+              "eager": measure(True, args.repeat)}
+    result["saved"] = result["eager"]["median"] - result["lazy"]["median"]
+    if args.cli:
+        result["qiime_help"] = measure_cli(args.repeat)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
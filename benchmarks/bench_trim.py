@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""Throughput benchmarks for the q2_itsxpress trim actions.
+
+Synthetic ITS amplicon libraries are generated from the read pairs in the test data,
+each of the three trim actions is run against them in a fresh process, and the wall
+time, per-stage time, reads per second and peak memory are written as JSON. A stored
+result can be used as a baseline so that a slower release is caught.
+
+Usage:
+    python benchmarks/bench_trim.py generate --out bench_data --samples 8 --depth 20000
+    python benchmarks/bench_trim.py run --data bench_data --threads 4 --output bench.json
+    python benchmarks/bench_trim.py compare bench.json --baseline baseline.json
+
+"""
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BENCH_DIR, "..", "tests", "test_data", "paired",
+                            "445cf54a-bf06-4852-8010-13a60fa1598c", "data")
+TEMPLATE_R1 = os.path.join(TEMPLATE_DIR, "4774-1-MSITS3_0_L001_R1_001.fastq.gz")
+TEMPLATE_R2 = os.path.join(TEMPLATE_DIR, "4774-1-MSITS3_1_L001_R2_001.fastq.gz")
+
+ACTIONS = ["trim_single", "trim_pair", "trim_pair_output_unmerged"]
+
+
+def _read_pairs(r1, r2):
+    """Reads the template read pairs as (seq1, qual1, seq2, qual2) tuples."""
+    with gzip.open(r1, 'rt') as f, gzip.open(r2, 'rt') as g:
+        lines1 = f.read().splitlines()
+        lines2 = g.read().splitlines()
+    return [(lines1[i + 1], lines1[i + 3], lines2[i + 1], lines2[i + 3])
+            for i in range(0, len(lines1), 4)]
+
+
+def _mutate(seq, rng, n):
+    """Introduces n substitutions away from the conserved ends of a read."""
+    seq = list(seq)
+    for _ in range(n):
+        i = rng.randrange(60, max(61, len(seq) - 60))
+        seq[i] = rng.choice("ACGT".replace(seq[i], ""))
+    return "".join(seq)
+
+
+def generate(out, samples, depth, unique_ratio, seed=0):
+    """Writes a synthetic paired-end library in the Casava 1.8 per-sample layout.
+
+    The variants are shared between samples, like the dominant ITS variants of a
+    real study, so pooling and caching are exercised as well.
+
+    Args:
+        out (str): The directory to write the FASTQ files, MANIFEST and metadata.yml to.
+        samples (int): The number of samples.
+        depth (int): The number of read pairs per sample.
+        unique_ratio (float): The number of distinct variants per read, between 0 and 1.
+        seed (int): The random seed.
+
+    """
+    rng = random.Random(seed)
+    templates = _read_pairs(TEMPLATE_R1, TEMPLATE_R2)
+    n_variants = max(1, int(depth * unique_ratio))
+    variants = []
+    for i in range(n_variants):
+        seq1, qual1, seq2, qual2 = templates[i % len(templates)]
+        if i >= len(templates):
+            seq1 = _mutate(seq1, rng, 1 + i // len(templates) % 3)
+        variants.append((seq1, qual1, seq2, qual2))
+    os.makedirs(out, exist_ok=True)
+    manifest = ["sample-id,filename,direction"]
+    for s in range(samples):
+        sample_id = "synthetic{}".format(s)
+        names = ["{}_{}_L001_R{}_001.fastq.gz".format(sample_id, s * 2 + r, r + 1) for r in (0, 1)]
+        with gzip.open(os.path.join(out, names[0]), 'wt', compresslevel=1) as f, \
+                gzip.open(os.path.join(out, names[1]), 'wt', compresslevel=1) as g:
+            for n in range(depth):
+                seq1, qual1, seq2, qual2 = variants[rng.randrange(n_variants)]
+                f.write("@SYN:{}:{} 1:N:0:1\n{}\n+\n{}\n".format(s, n, seq1, qual1))
+                g.write("@SYN:{}:{} 2:N:0:1\n{}\n+\n{}\n".format(s, n, seq2, qual2))
+        manifest.append("{},{},forward".format(sample_id, names[0]))
+        manifest.append("{},{},reverse".format(sample_id, names[1]))
+    with open(os.path.join(out, "MANIFEST"), 'w') as f:
+        f.write("\n".join(manifest) + "\n")
+    with open(os.path.join(out, "metadata.yml"), 'w') as f:
+        f.write("{phred-offset: 33}\n")
+    with open(os.path.join(out, "synthetic.json"), 'w') as f:
+        json.dump({"samples": samples, "depth": depth,
+                   "unique_ratio": unique_ratio, "seed": seed}, f)
+
+
+def _single_end_copy(data):
+    """Writes a single-end copy of a paired library, holding the forward reads only."""
+    single = os.path.join(data, "single")
+    if os.path.exists(os.path.join(single, "MANIFEST")):
+        return single
+    os.makedirs(single, exist_ok=True)
+    with open(os.path.join(data, "MANIFEST")) as f:
+        lines = [line for line in f if not line.rstrip().endswith(",reverse")]
+    for line in lines[1:]:
+        name = line.split(",")[1]
+        os.link(os.path.join(data, name), os.path.join(single, name))
+    with open(os.path.join(single, "MANIFEST"), 'w') as f:
+        f.writelines(lines)
+    with open(os.path.join(single, "metadata.yml"), 'w') as f:
+        f.write("{phred-offset: 33}\n")
+    return single
+
+
+def _measure(action, data, region, taxa, threads, options):
+    """Runs one trim action in the current process and returns its measurements."""
+    from q2_types.per_sample_sequences import (SingleLanePerSampleSingleEndFastqDirFmt,
+                                               SingleLanePerSamplePairedEndFastqDirFmt)
+    import q2_itsxpress._itsxpress as _itsxpress
+
+    # Stage times come from the per-stage profile, summed over the samples.
+    profile_file = os.path.join(tempfile.mkdtemp(prefix="bench_"), "profile.json")
+    options = dict(options, profile_file=profile_file)
+    if action == "trim_single":
+        seqs = SingleLanePerSampleSingleEndFastqDirFmt(_single_end_copy(data), "r")
+    else:
+        seqs = SingleLanePerSamplePairedEndFastqDirFmt(data, "r")
+    with open(os.path.join(data, "synthetic.json")) as f:
+        synthetic = json.load(f)
+    t0 = time.perf_counter()
+    getattr(_itsxpress, action)(per_sample_sequences=seqs, region=region, taxa=taxa,
+                                threads=threads, **options)
+    wall = time.perf_counter() - t0
+    reads = synthetic["samples"] * synthetic["depth"]
+    with open(profile_file) as f:
+        records = json.load(f)
+    shutil.rmtree(os.path.dirname(profile_file))
+    stage_times = {}
+    for record in records:
+        stage_times[record["stage"]] = stage_times.get(record["stage"], 0.0) + record["wall_time"]
+    return {"action": action,
+            "wall_time": wall,
+            "reads": reads,
+            "reads_per_sec": reads / wall if wall else None,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "tools_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            "stages": stage_times}
+
+
+def run(data, actions, region, taxa, threads, options):
+    """Runs each action in a fresh interpreter so peak memory is measured per action."""
+    results = []
+    for action in actions:
+        cmd = [sys.executable, os.path.abspath(__file__), "_measure", action,
+               "--data", data, "--region", region, "--taxa", taxa,
+               "--threads", str(threads), "--options", json.dumps(options)]
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+        results.append(json.loads(p.stdout.decode('utf-8').splitlines()[-1]))
+    with open(os.path.join(data, "synthetic.json")) as f:
+        synthetic = json.load(f)
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "synthetic": synthetic,
+            "region": region,
+            "taxa": taxa,
+            "threads": threads,
+            "options": options,
+            "results": results}
+
+
+def compare(current, baseline, tolerance):
+    """Compares reads per second against a baseline.
+
+    Args:
+        current (dict): The benchmark results.
+        baseline (dict): The baseline benchmark results.
+        tolerance (float): The fraction by which throughput may drop before it is a regression.
+
+    Returns:
+        (list): (action, baseline reads/sec, current reads/sec, relative change, regressed)
+
+    """
+    base = {r["action"]: r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        if result["action"] not in base:
+            continue
+        old = base[result["action"]]["reads_per_sec"]
+        new = result["reads_per_sec"]
+        change = (new - old) / old
+        rows.append((result["action"], old, new, change, change < -tolerance))
+    return rows
+
+
+def myparser():
+    parser = argparse.ArgumentParser(description='Benchmarks for the q2_itsxpress trim actions.')
+    sub = parser.add_subparsers(dest='command')
+    gen = sub.add_parser('generate', help='Generate a synthetic paired-end library.')
+    gen.add_argument('--out', required=True)
+    gen.add_argument('--samples', type=int, default=8)
+    gen.add_argument('--depth', type=int, default=10000, help='Read pairs per sample.')
+    gen.add_argument('--unique_ratio', type=float, default=0.1)
+    gen.add_argument('--seed', type=int, default=0)
+    for name in ('run', '_measure'):
+        p = sub.add_parser(name)
+        if name == '_measure':
+            p.add_argument('action', choices=ACTIONS)
+        else:
+            p.add_argument('--actions', nargs='+', choices=ACTIONS, default=ACTIONS)
+            p.add_argument('--output', default=None, help='Write the JSON results here.')
+            p.add_argument('--baseline', default=None, help='Compare against this JSON result.')
+            p.add_argument('--tolerance', type=float, default=0.1)
+        p.add_argument('--data', required=True)
+        p.add_argument('--region', default='ITS2', choices=['ITS1', 'ITS2', 'ALL'])
+        p.add_argument('--taxa', default='F')
+        p.add_argument('--threads', type=int, default=1)
+        p.add_argument('--options', default='{"sample_parallelism": 1}',
+                       help='Extra trim action parameters as JSON.')
+    cmp = sub.add_parser('compare', help='Compare a result with a baseline.')
+    cmp.add_argument('result')
+    cmp.add_argument('--baseline', required=True)
+    cmp.add_argument('--tolerance', type=float, default=0.1)
+    return parser
+
+
+def _report(rows):
+    regressed = False
+    for action, old, new, change, slower in rows:
+        print("{:<28} {:>12.1f} -> {:>12.1f} reads/s {:+7.1%}{}".format(
+            action, old, new, change, "  REGRESSION" if slower else ""))
+        regressed = regressed or slower
+    return 1 if regressed else 0
+
+
+def main(args=None):
+    args = myparser().parse_args(args)
+    if args.command == 'generate':
+        generate(args.out, args.samples, args.depth, args.unique_ratio, args.seed)
+        return 0
+    if args.command == '_measure':
+        print(json.dumps(_measure(args.action, args.data, args.region, args.taxa,
+                                  args.threads, json.loads(args.options))))
+        return 0
+    if args.command == 'run':
+        result = run(args.data, args.actions, args.region, args.taxa, args.threads,
+                     json.loads(args.options))
+        text = json.dumps(result, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+        if args.baseline:
+            with open(args.baseline) as f:
+                return _report(compare(result, json.load(f), args.tolerance))
+        return 0
+    if args.command == 'compare':
+        with open(args.result) as f, open(args.baseline) as g:
+            return _report(compare(json.load(f), json.load(g), args.tolerance))
+    myparser().print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
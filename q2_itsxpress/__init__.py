@@ -1,2 +1 @@
-import q2_itsxpress._itsxpress
 import q2_itsxpress.plugin_setup
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""The trim actions of the q2_itsxpress plugin.
+
+QIIME 2 imports every installed plugin on each command, including commands that never
+trim anything. The actions registered in plugin_setup are defined here with only the
+formats and pandas their annotations need, and the default values kept in _defaults.
+The itsxpress, Biopython, numpy and helper module imports of _itsxpress happen the first
+time an action runs.
+
+QIIME 2 reads the parameters of an action from its signature, so each action spells
+them out, but passes them on to main as they are. The parameters and descriptions the
+actions share are kept once in plugin_setup.
+
+"""
+import pandas as pd
+from q2_types.per_sample_sequences import (SingleLanePerSamplePairedEndFastqDirFmt,
+                                           SingleLanePerSampleSingleEndFastqDirFmt,
+                                           CasavaOneEightSingleLanePerSampleDirFmt)
+from q2_types.feature_data import DNAFASTAFormat
+
+from q2_itsxpress._defaults import (default_cluster_id,
+                                    default_cache_size,
+                                    default_compression_level,
+                                    default_min_overlap,
+                                    default_max_mismatch_rate,
+                                    default_chunk_reads)
+from q2_itsxpress._format import ITSPositionIndexDirFmt
+
+
+# First command Trim for SingleLanePerSampleSingleEndFastqDirFmt
+def trim_single(per_sample_sequences: SingleLanePerSampleSingleEndFastqDirFmt,
+                region: str,
+                taxa: str = "F",
+                threads: int = 1,
+                cluster_id: float = default_cluster_id,
+                sample_parallelism: int = 0,
+                pool_samples: bool = False,
+                cache_dir: str = None,
+                cache_size: int = default_cache_size,
+                stream: bool = False,
+                profile_file: str = None,
+                compression_level: int = default_compression_level,
+                compression_threads: int = 0,
+                checkpoint_dir: str = None,
+                memory_limit: int = 0,
+                collapse_duplicates: bool = False,
+                scratch_dir: str = None,
+                auto_threads: bool = False,
+                tuning_profile: str = None,
+                chunk_threshold: int = 0,
+                chunk_reads: int = default_chunk_reads,
+                pipeline: bool = False,
+                stage_workers: str = None,
+                position_index: ITSPositionIndexDirFmt = None) -> (CasavaOneEightSingleLanePerSampleDirFmt, pd.DataFrame):
+    kwargs = dict(locals())
+    from q2_itsxpress._itsxpress import main
+    results, stats = main(paired_in=False,
+                          paired_out=False,
+                          reversed_primers=False,
+                          **kwargs)
+    return results, stats
+
+
+# Second command Trim for SingleLanePerSamplePairedEndFastqDirFmt
+def trim_pair(per_sample_sequences: SingleLanePerSamplePairedEndFastqDirFmt,
+              region: str,
+              taxa: str = "F",
+              threads: int = 1,
+              reversed_primers: bool = False,
+              cluster_id: float = default_cluster_id,
+              sample_parallelism: int = 0,
+              pool_samples: bool = False,
+              cache_dir: str = None,
+              cache_size: int = default_cache_size,
+              stream: bool = False,
+              profile_file: str = None,
+              compression_level: int = default_compression_level,
+              compression_threads: int = 0,
+              checkpoint_dir: str = None,
+              memory_limit: int = 0,
+              collapse_duplicates: bool = False,
+              native_merge: bool = False,
+              merge_min_overlap: int = default_min_overlap,
+              merge_max_mismatch_rate: float = default_max_mismatch_rate,
+              scratch_dir: str = None,
+              auto_threads: bool = False,
+              tuning_profile: str = None,
+              chunk_threshold: int = 0,
+              chunk_reads: int = default_chunk_reads,
+              pipeline: bool = False,
+              stage_workers: str = None,
+              position_index: ITSPositionIndexDirFmt = None) -> (CasavaOneEightSingleLanePerSampleDirFmt, pd.DataFrame):
+    kwargs = dict(locals())
+    from q2_itsxpress._itsxpress import main
+    results, stats = main(paired_in=True,
+                          paired_out=False,
+                          **kwargs)
+    return results, stats
+
+# Second command Trim for SingleLanePerSamplePairedEndFastqDirFmt
+def trim_pair_output_unmerged(per_sample_sequences: SingleLanePerSamplePairedEndFastqDirFmt,
+              region: str,
+              taxa: str = "F",
+              threads: int = 1,
+              reversed_primers: bool = False,
+              cluster_id: float = default_cluster_id,
+              sample_parallelism: int = 0,
+              pool_samples: bool = False,
+              cache_dir: str = None,
+              cache_size: int = default_cache_size,
+              stream: bool = False,
+              profile_file: str = None,
+              compression_level: int = default_compression_level,
+              compression_threads: int = 0,
+              checkpoint_dir: str = None,
+              memory_limit: int = 0,
+              collapse_duplicates: bool = False,
+              native_merge: bool = False,
+              merge_min_overlap: int = default_min_overlap,
+              merge_max_mismatch_rate: float = default_max_mismatch_rate,
+              scratch_dir: str = None,
+              auto_threads: bool = False,
+              tuning_profile: str = None,
+              index_reads: bool = False,
+              chunk_threshold: int = 0,
+              chunk_reads: int = default_chunk_reads,
+              pipeline: bool = False,
+              stage_workers: str = None,
+              position_index: ITSPositionIndexDirFmt = None) -> (CasavaOneEightSingleLanePerSampleDirFmt, pd.DataFrame):
+    kwargs = dict(locals())
+    from q2_itsxpress._itsxpress import main
+    results, stats = main(paired_in=True,
+                          paired_out=True,
+                          **kwargs)
+    return results, stats
+
+
+# Builds an ITS position index for the trim commands
+def build_position_index(reference_sequences: DNAFASTAFormat = None,
+                         previous_index: ITSPositionIndexDirFmt = None,
+                         taxa: str = "F",
+                         threads: int = 1,
+                         cache_dir: str = None,
+                         scratch_dir: str = None) -> ITSPositionIndexDirFmt:
+    from q2_itsxpress._itsxpress import build_index
+    return build_index(reference_sequences=reference_sequences,
+                       previous_index=previous_index,
+                       taxa=taxa,
+                       threads=threads,
+                       cache_dir=cache_dir,
+                       scratch_dir=scratch_dir)
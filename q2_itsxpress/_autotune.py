@@ -0,0 +1,167 @@
+"""Per-stage thread planning for the q2_itsxpress plugin.
+
+The thread budget of a sample is normally handed unchanged to BBMerge, Vsearch and
+HMMSearch, but they scale very differently: Vsearch keeps gaining from more threads
+while HMMSearch flattens out after a few. Here each of the merge, dereplicate and
+search stages is described by Amdahl's law, its single thread time and the fraction of
+it that runs in parallel. Both are estimated from stage records, the CPU time a stage
+used over its wall time being its speedup on the threads it was given. The records
+come from a first sample trimmed with every thread, or from the profile of an earlier
+run.
+
+The planner then picks the number of samples to run at once and the threads of each
+stage that trim the most samples per second, while the threads the samples hold,
+averaged over a sample's stages, stay within the budget. A stage that gains little
+from more threads gets few of them, and the cores it leaves are used by more samples.
+
+"""
+# Stages whose tools take a thread count.
+TUNED_STAGES = ("merge", "dereplicate", "search")
+# Stages that run on a single thread whatever the budget.
+SERIAL_STAGES = ("check", "write")
+# The parallel fraction of each stage when the records cannot tell, as when they ran on one thread.
+default_parallel_fractions = {"merge": 0.8, "dereplicate": 0.9, "search": 0.5}
+
+
+def stage_time(single_time: float, parallel_fraction: float, threads: int) -> float:
+    """Returns the time of a stage on a number of threads, by Amdahl's law."""
+    return single_time * ((1 - parallel_fraction) + parallel_fraction / threads)
+
+
+def calibrate(records: list) -> dict:
+    """Estimates the scaling of each stage from stage records.
+
+    Args:
+        records (list): Stage records, as from Profiler or read_profile. Records without
+            threads are taken to have run on one thread. Pipelined records are skipped,
+            as their CPU times include the other samples in flight.
+
+    Returns:
+        (dict): {stage: (single thread seconds summed over the records, parallel fraction)}
+            for the tuned and serial stages found in the records.
+
+    """
+    records = [record for record in records if not record.get("pipelined")]
+    fractions = {}
+    for stage in TUNED_STAGES:
+        weighted = 0.0
+        weight = 0.0
+        for record in records:
+            threads = record.get("threads") or 1
+            wall = record.get("wall_time") or 0
+            if record["stage"] != stage or threads <= 1 or wall <= 0:
+                continue
+            cpu = (record.get("cpu_time") or 0) + (record.get("child_cpu_time") or 0)
+            speedup = min(max(cpu / wall, 1.0), threads)
+            weighted += wall * (1 - 1 / speedup) / (1 - 1 / threads)
+            weight += wall
+        fractions[stage] = weighted / weight if weight else default_parallel_fractions[stage]
+    model = {}
+    for record in records:
+        stage = record["stage"]
+        if stage not in TUNED_STAGES and stage not in SERIAL_STAGES:
+            continue
+        fraction = fractions.get(stage, 0.0)
+        threads = record.get("threads") or 1
+        single = (record.get("wall_time") or 0) / stage_time(1.0, fraction, threads)
+        total = model.get(stage, (0.0, fraction))[0]
+        model[stage] = (total + single, fraction)
+    return model
+
+
+def _sample_time(model: dict, stage_threads: dict) -> float:
+    return sum(stage_time(single, fraction, stage_threads.get(stage, 1))
+               for stage, (single, fraction) in model.items())
+
+
+def _held_threads(model: dict, stage_threads: dict) -> float:
+    """Returns the threads a sample holds on average over its stages."""
+    wall = _sample_time(model, stage_threads)
+    if wall <= 0:
+        return 1.0
+    return sum(stage_threads.get(stage, 1) * stage_time(single, fraction, stage_threads.get(stage, 1))
+               for stage, (single, fraction) in model.items()) / wall
+
+
+class ThreadPlan:
+    """The samples run at once and the threads of each stage.
+
+    Args:
+        threads (int): The total number of processor threads available to the run.
+        workers (int): The number of samples running at once.
+        stage_threads (dict): {stage: threads} for a sample with an even share of the threads.
+
+    """
+    def __init__(self, threads: int, workers: int, stage_threads: dict):
+        self.threads = threads
+        self.workers = workers
+        self.stage_threads = stage_threads
+
+    def for_job(self, job_threads: int) -> dict:
+        """Returns the stage threads of a job given more or fewer threads than an even share.
+
+        Args:
+            job_threads (int): The threads of the job, as from plan_jobs.
+
+        Returns:
+            (dict): {stage: threads}
+
+        """
+        share = max(1, self.threads // self.workers)
+        return {stage: min(self.threads, max(1, int(round(threads * job_threads / share))))
+                for stage, threads in self.stage_threads.items()}
+
+    def describe(self) -> str:
+        """Returns the plan as a line for the run log."""
+        return "{} samples at once, threads per stage: {}".format(
+            self.workers,
+            ", ".join("{} {}".format(stage, self.stage_threads[stage])
+                      for stage in TUNED_STAGES if stage in self.stage_threads))
+
+
+def plan_stages(model: dict, threads: int, n_samples: int) -> ThreadPlan:
+    """Picks the samples run at once and the threads of each stage for the most samples per second.
+
+    For each number of concurrent samples the stage threads start at one and the stage
+    whose extra thread saves the most time is given one, for as long as the samples
+    hold no more threads than the budget on average. No stage gets more than twice an
+    even share of the threads, which bounds how far the stages of concurrent samples
+    can oversubscribe the cores when they line up.
+
+    Args:
+        model (dict): The stage scaling, as from calibrate.
+        threads (int): The total number of processor threads available to the run.
+        n_samples (int): The number of samples to be trimmed.
+
+    Returns:
+        (ThreadPlan): The plan with the highest estimated throughput, the one with more
+            concurrent samples on a tie.
+
+    """
+    threads = max(1, threads)
+    tuned = [stage for stage in TUNED_STAGES if stage in model]
+    best = None
+    best_rate = 0.0
+    for workers in range(1, max(1, min(threads, n_samples)) + 1):
+        stage_threads = {stage: 1 for stage in tuned}
+        while True:
+            current = _sample_time(model, stage_threads)
+            choice = None
+            for stage in tuned:
+                if stage_threads[stage] >= min(threads, 2 * (threads // workers)):
+                    continue
+                trial = dict(stage_threads, **{stage: stage_threads[stage] + 1})
+                if workers * _held_threads(model, trial) > threads:
+                    continue
+                saved = current - _sample_time(model, trial)
+                if saved > 0 and (choice is None or saved > choice[1]):
+                    choice = (stage, saved)
+            if choice is None:
+                break
+            stage_threads[choice[0]] += 1
+        wall = _sample_time(model, stage_threads)
+        rate = workers / wall if wall > 0 else float(workers)
+        if best is None or rate >= best_rate * (1 - 1e-9):
+            best = ThreadPlan(threads, workers, stage_threads)
+            best_rate = rate
+    return best
@@ -0,0 +1,163 @@
+"""A persistent cache of ITS positions for the q2_itsxpress plugin.
+
+The ITS start and stop sites of a sequence only depend on the sequence itself, the
+taxa, the region and the HMM models used. They are stored in a SQLite database keyed
+by those four values so that reruns, or projects with overlapping amplicons, only send
+sequences that have not been seen before to HMMSearch. The cache is bounded in size and
+the least recently used positions are evicted first.
+
+"""
+import hashlib
+import os
+import sqlite3
+import time
+
+from q2_itsxpress._defaults import default_cache_size
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS positions (
+                 digest BLOB NOT NULL,
+                 taxa TEXT NOT NULL,
+                 region TEXT NOT NULL,
+                 hmm TEXT NOT NULL,
+                 found INTEGER NOT NULL,
+                 start INTEGER,
+                 stop INTEGER,
+                 tlen INTEGER,
+                 last_used REAL NOT NULL,
+                 PRIMARY KEY (digest, taxa, region, hmm))"""
+
+_checksums = {}
+
+
+def hmm_checksum(hmmfile: str) -> str:
+    """Returns the SHA-1 checksum of an HMM file, computed once per process.
+
+    Args:
+        hmmfile (str): The path to the HMM file.
+
+    Returns:
+        (str): The hexadecimal checksum.
+
+    """
+    if hmmfile not in _checksums:
+        sha = hashlib.sha1()
+        with open(hmmfile, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        _checksums[hmmfile] = sha.hexdigest()
+    return _checksums[hmmfile]
+
+
+class PositionCache:
+    """An on-disk, least recently used cache of ITS positions.
+
+    Args:
+        cache_dir (str): The directory holding the cache database, created if needed.
+        taxa (str): The taxa used for the search.
+        region (str): The region of the ITS being trimmed.
+        hmmfile (str): The HMM file used for the search.
+        max_entries (int): The number of positions kept before the oldest are evicted.
+
+    Attributes:
+        hits (int): The number of sequences found in the cache.
+        misses (int): The number of sequences not found in the cache.
+
+    """
+    def __init__(self, cache_dir: str, taxa: str, region: str, hmmfile: str,
+                 max_entries: int = default_cache_size):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "its_positions.sqlite")
+        self.key = (taxa, region, hmm_checksum(hmmfile))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Several samples may use the cache at once, so wait on locks rather than fail.
+        self.conn = sqlite3.connect(self.path, timeout=600)
+        self.conn.execute(_SCHEMA)
+        self.conn.commit()
+
+    def lookup(self, digests: set) -> dict:
+        """Looks up the positions of sequences and marks them as recently used.
+
+        Args:
+            digests (set): The sequence digests to look up.
+
+        Returns:
+            (dict): {digest: (start, stop, tlen)} for each sequence in the cache. The
+                value is None for sequences where HMMSearch found no ITS sites.
+
+        """
+        found = {}
+        digests = list(digests)
+        now = time.time()
+        # Stay well below SQLite's limit on bound parameters.
+        for i in range(0, len(digests), 500):
+            chunk = digests[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                "SELECT digest, found, start, stop, tlen FROM positions "
+                "WHERE taxa=? AND region=? AND hmm=? AND digest IN ({})".format(marks),
+                self.key + tuple(chunk)).fetchall()
+            for digest, hit, start, stop, tlen in rows:
+                found[bytes(digest)] = (start, stop, tlen) if hit else None
+            self.conn.executemany(
+                "UPDATE positions SET last_used=? "
+                "WHERE taxa=? AND region=? AND hmm=? AND digest=?",
+                [(now,) + self.key + (digest,) for digest, *_ in rows])
+        self.conn.commit()
+        self.hits += len(found)
+        self.misses += len(digests) - len(found)
+        return found
+
+    def store(self, positions: dict) -> None:
+        """Adds new positions to the cache and evicts the least recently used ones.
+
+        Args:
+            positions (dict): {digest: (start, stop, tlen) or None}
+
+        """
+        now = time.time()
+        rows = []
+        for digest, pos in positions.items():
+            if pos is None:
+                rows.append(self.key + (digest, 0, None, None, None, now))
+            else:
+                rows.append(self.key + (digest, 1) + tuple(pos) + (now,))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO positions "
+            "(taxa, region, hmm, digest, found, start, stop, tlen, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        count, = self.conn.execute("SELECT COUNT(*) FROM positions").fetchone()
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM positions WHERE rowid IN "
+                "(SELECT rowid FROM positions ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,))
+        self.conn.commit()
+
+    def close(self) -> None:
+        """Closes the cache database."""
+        self.conn.close()
+
+
+def read_cache(cache_dir: str) -> dict:
+    """Reads every position held by a cache directory, such as one shared by earlier runs.
+
+    Args:
+        cache_dir (str): The cache directory.
+
+    Returns:
+        (dict): {(digest, taxa, region, hmm): (start, stop, tlen) or None}, empty if the
+            directory holds no cache.
+
+    """
+    path = os.path.join(cache_dir, "its_positions.sqlite")
+    if not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(path, timeout=600)
+    try:
+        rows = conn.execute("SELECT digest, taxa, region, hmm, found, start, stop, tlen FROM positions").fetchall()
+    finally:
+        conn.close()
+    return {(bytes(digest), taxa, region, hmm): (start, stop, tlen) if found else None
+            for digest, taxa, region, hmm, found, start, stop, tlen in rows}
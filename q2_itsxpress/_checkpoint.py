@@ -0,0 +1,154 @@
+"""Resumable runs for the q2_itsxpress plugin.
+
+The trimmed reads of each finished sample are kept in a checkpoint directory under a
+key made from the checksums of the sample's input files and every parameter that
+changes the trimmed reads. When a run is repeated after a crash or a time out, the
+samples found in the checkpoint directory are copied into the results and only the
+other samples are trimmed.
+
+A checkpoint is assembled in a staging directory and renamed into place once all of
+its files are complete, so an interrupted run never leaves a partial checkpoint
+behind, and files are moved into the results directory under their final names only
+once they are fully written.
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+_ROLES = ("forward", "reverse")
+
+
+def file_checksum(path: str) -> str:
+    """Returns the SHA-1 checksum of a file.
+
+    Args:
+        path (str): The file to read.
+
+    Returns:
+        (str): The hexadecimal checksum.
+
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def place_file(source: str, dest: str) -> None:
+    """Puts a file at dest under a temporary name first, then renames it into place.
+
+    The file is hard linked when possible and copied otherwise.
+
+    Args:
+        source (str): The file to place.
+        dest (str): The final path.
+
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".tmp_")
+    os.close(fd)
+    try:
+        os.remove(tmp)
+        try:
+            os.link(source, tmp)
+        except OSError:
+            shutil.copyfile(source, tmp)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class CheckpointStore:
+    """Trimmed reads of finished samples, reused when a run is repeated.
+
+    Args:
+        checkpoint_dir (str): The directory holding the checkpoints, created if needed.
+        params (dict): The parameters that change the trimmed reads.
+
+    Attributes:
+        keys (dict): {Sample ID: checkpoint key} for the samples of the run, set by main.
+
+    """
+    def __init__(self, checkpoint_dir: str, params: dict):
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.checkpoint_dir = checkpoint_dir
+        self.params = json.dumps(params, sort_keys=True)
+        self.keys = {}
+
+    def key(self, sample: tuple) -> str:
+        """Returns the checkpoint key of a sample.
+
+        Args:
+            sample (tuple): (sample id, forward reads path, reverse reads path or None).
+
+        Returns:
+            (str): A checksum of the parameters and the contents of the input files.
+
+        """
+        sha = hashlib.sha1(self.params.encode('utf-8'))
+        for path in sample[1:]:
+            sha.update((file_checksum(path) if path else "-").encode('ascii'))
+        return sha.hexdigest()
+
+    def restore(self, sample: tuple, results_dir: str, paired_out: bool) -> tuple:
+        """Copies the trimmed reads of a sample from its checkpoint into the results, if there is one.
+
+        Args:
+            sample (tuple): (sample id, forward reads path, reverse reads path or None).
+            results_dir (str): The directory of the CasavaOneEightSingleLanePerSampleDirFmt result.
+            paired_out (bool): Declares if output files should be paired.
+
+        Returns:
+            (tuple): (checkpoint key, True if the sample was restored)
+
+        """
+        key = self.key(sample)
+        path = os.path.join(self.checkpoint_dir, key)
+        if not os.path.isdir(path):
+            return key, False
+        sample_id, forward, reverse = sample
+        outputs = [forward, reverse] if paired_out else [forward]
+        for role, output in zip(_ROLES, outputs):
+            place_file(os.path.join(path, role + ".fastq.gz"),
+                       os.path.join(results_dir, os.path.basename(output)))
+        return key, True
+
+    def metadata(self, sample_id: str) -> dict:
+        """Returns the metadata saved with the checkpoint of a sample, empty if there is none."""
+        try:
+            with open(os.path.join(self.checkpoint_dir, self.keys[sample_id], "checkpoint.json")) as f:
+                return json.load(f)
+        except (KeyError, OSError, ValueError):
+            return {}
+
+    def save(self, sample_id: str, outputs: list, metadata: dict = None) -> None:
+        """Keeps the trimmed reads of a finished sample.
+
+        Args:
+            sample_id (str): The Sample ID.
+            outputs (list): The forward, and for unmerged output reverse, trimmed read files.
+            metadata (dict): Written with the checkpoint for reference, optional.
+
+        """
+        path = os.path.join(self.checkpoint_dir, self.keys[sample_id])
+        if os.path.isdir(path):
+            return
+        staging = tempfile.mkdtemp(dir=self.checkpoint_dir, prefix=".staging_")
+        try:
+            for role, output in zip(_ROLES, outputs):
+                place_file(output, os.path.join(staging, role + ".fastq.gz"))
+            with open(os.path.join(staging, "checkpoint.json"), 'w') as f:
+                json.dump(dict(metadata or {}, sample_id=sample_id), f)
+            try:
+                os.rename(staging, path)
+            except OSError:
+                # Another run saved the same sample first.
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            if os.path.isdir(staging):
+                shutil.rmtree(staging)
@@ -0,0 +1,95 @@
+"""Splitting of very large samples into chunks for the q2_itsxpress plugin.
+
+Samples are the unit of parallelism, so a run where one sample holds most of the reads,
+such as a pooled library or a resequenced control, ends with that sample running on
+alone. Here such a sample is split into chunks of a fixed number of reads, or read
+pairs, which are merged and dereplicated in parallel like separate samples. The unique
+sequences of the chunks are pooled so HMMSearch runs once on the unique sequences of
+the whole sample, each chunk is trimmed with the positions of its own representatives,
+and the trimmed chunks are joined in chunk order into the sample's output files.
+
+"""
+import os
+import shutil
+from contextlib import ExitStack
+
+from q2_itsxpress._fastq import open_fastq
+from q2_itsxpress._trim import BlockReader
+from q2_itsxpress._defaults import default_chunk_reads
+
+
+def chunk_id(sample_id: str, index: int) -> str:
+    """Returns the id of a chunk of a sample, used for its stage records."""
+    return "{}.chunk{}".format(sample_id, index)
+
+
+def split_sample(sample: tuple, directory: str, chunk_reads: int = default_chunk_reads) -> list:
+    """Splits the read files of a sample into chunks of uncompressed reads.
+
+    The forward and reverse files are split at the same records, so read pairs stay
+    together. A sample without reads gives a single empty chunk.
+
+    Args:
+        sample (tuple): (sample id, forward reads path, reverse reads path or None).
+        directory (str): The directory to write the chunks to.
+        chunk_reads (int): The number of reads, or read pairs, in each chunk.
+
+    Returns:
+        (list): A sample tuple for each chunk, in read order.
+
+    """
+    sample_id, forward, reverse = sample
+    paths = [path for path in (forward, reverse) if path]
+    chunks = []
+    with ExitStack() as stack:
+        readers = [BlockReader(stack.enter_context(open_fastq(path, 'rb'))) for path in paths]
+        while True:
+            blocks = [reader.take(max(1, chunk_reads)) for reader in readers]
+            if chunks and not any(len(block) for block in blocks):
+                break
+            index = len(chunks)
+            outputs = []
+            for role, block in zip(("R1", "R2"), blocks):
+                output = os.path.join(directory, "chunk{}_{}.fastq".format(index, role))
+                with open(output, 'wb') as out:
+                    out.write(block.data)
+                outputs.append(output)
+            chunks.append((chunk_id(sample_id, index), outputs[0], outputs[1] if reverse else None))
+            if not any(len(block) for block in blocks):
+                break
+    return chunks
+
+
+def join_files(paths: list, output: str) -> int:
+    """Joins files end to end, such as the gzipped trimmed reads of the chunks of a sample.
+
+    Args:
+        paths (list): The files to join, in order.
+        output (str): The file to write.
+
+    Returns:
+        (int): The number of bytes written.
+
+    """
+    with open(output, 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, out)
+        return out.tell()
+
+
+def combine_counts(counts: list) -> dict:
+    """Adds up the read counts of the chunks of a sample.
+
+    Args:
+        counts (list): The Profiler.counts of each chunk.
+
+    Returns:
+        (dict): The sum of each count, None where a chunk did not set it.
+
+    """
+    combined = {}
+    for key in set().union(*counts) if counts else ():
+        values = [chunk.get(key) for chunk in counts]
+        combined[key] = None if any(value is None for value in values) else sum(values)
+    return combined
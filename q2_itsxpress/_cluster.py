@@ -0,0 +1,162 @@
+"""Two tier dereplication for the q2_itsxpress plugin.
+
+When cluster_id is below 1, Vsearch used to cluster every read, although most reads of
+an amplicon library are exact copies of a few thousand sequences. Here identical reads
+are first collapsed in one streaming pass that counts their abundance, and only the
+unique sequences, with their abundances, are clustered by Vsearch. The two mappings,
+read to unique sequence and unique sequence to centroid, are then composed into a uc
+file of the same form Vsearch writes, so itsxpress.Dedup reads it as before.
+
+Because the abundances are passed to Vsearch, the most abundant sequences become the
+centroids, as they do when Vsearch clusters dereplicated amplicons.
+
+"""
+import logging
+import os
+import re
+import subprocess
+
+from q2_itsxpress._fastq import open_fastq, read_fastq, read_id
+from q2_itsxpress._pool import sequence_digest
+
+_SIZE = re.compile(r";size=\d+;?$")
+
+
+def write_uniques(uniques: list, uniques_file: str) -> None:
+    """Writes unique sequences with their abundances, most abundant first.
+
+    Args:
+        uniques (list): (sequence id, sequence, abundance) tuples.
+        uniques_file (str): The FASTA file to write.
+
+    """
+    with open(uniques_file, 'w') as f:
+        for seq_id, seq, size in sorted(uniques, key=lambda unique: -unique[2]):
+            f.write(">{};size={}\n{}\n".format(seq_id, size, seq))
+
+
+def collapse_duplicates(seq_file: str, uniques_file: str, mapping_file: str) -> int:
+    """Collapses identical reads, keeping the first read of each sequence as its unique.
+
+    Args:
+        seq_file (str): The FASTQ reads to collapse.
+        uniques_file (str): The FASTA file for the unique sequences and their abundances.
+        mapping_file (str): A file for the unique of each read, one "read id<TAB>unique id" per line.
+
+    Returns:
+        (int): The number of unique sequences.
+
+    """
+    uniques = {}
+    with open_fastq(seq_file) as f, open(mapping_file, 'w') as mapping:
+        for title, seq, qual in read_fastq(f):
+            seq_id = read_id(title)
+            digest = sequence_digest(seq)
+            unique = uniques.get(digest)
+            if unique is None:
+                unique = uniques[digest] = [seq_id, seq, 0]
+            unique[2] += 1
+            mapping.write("{}\t{}\n".format(seq_id, unique[0]))
+    write_uniques(uniques.values(), uniques_file)
+    return len(uniques)
+
+
+def cluster_uniques(uniques_file: str, rep_file: str, uc_file: str,
+                    cluster_id: float, threads: int) -> None:
+    """Clusters unique sequences weighted by abundance with Vsearch.
+
+    Args:
+        uniques_file (str): The unique sequences with ;size= abundances.
+        rep_file (str): The FASTA file for the centroids.
+        uc_file (str): The uc file for the unique to centroid mapping.
+        cluster_id (float): The percent identity for clustering.
+        threads (int): The number of threads for Vsearch.
+
+    Raises:
+        FileNotFoundError: Vsearch was not found.
+        subprocess.CalledProcessError: Vsearch failed.
+
+    """
+    parameters = ["vsearch",
+                  "--cluster_size", uniques_file,
+                  "--sizein",
+                  "--xsize",
+                  "--centroids", rep_file,
+                  "--uc", uc_file,
+                  "--strand", "both",
+                  "--id", str(cluster_id),
+                  "--threads", str(threads)]
+    try:
+        p = subprocess.run(parameters, stderr=subprocess.PIPE)
+        p.check_returncode()
+    except subprocess.CalledProcessError as e:
+        logging.exception("Could not perform clustering with Vsearch. Error from Vsearch was:\n {}".format(
+            p.stderr.decode('utf-8')))
+        raise e
+    except FileNotFoundError as f:
+        logging.error("Vsearch was not found, make sure Vsearch is installed and executable")
+        raise f
+
+
+def read_centroids(uc_file: str) -> dict:
+    """Reads the centroid of each sequence from a Vsearch uc file.
+
+    Args:
+        uc_file (str): The uc file.
+
+    Returns:
+        (dict): {sequence id: centroid id} with abundance annotations removed.
+
+    """
+    centroids = {}
+    with open(uc_file, 'r') as f:
+        for line in f:
+            ll = line.split()
+            if ll[0] == 'S':
+                seq_id = _SIZE.sub("", ll[8])
+                centroids[seq_id] = seq_id
+            elif ll[0] == 'H':
+                centroids[_SIZE.sub("", ll[8])] = _SIZE.sub("", ll[9])
+    return centroids
+
+
+def compose_uc(mapping_file: str, centroids: dict, uc_file: str) -> None:
+    """Writes the centroid of every read as a uc file that itsxpress.Dedup can read.
+
+    Args:
+        mapping_file (str): The read to unique mapping written by collapse_duplicates.
+        centroids (dict): The unique to centroid mapping from read_centroids.
+        uc_file (str): The uc file to write.
+
+    """
+    with open(mapping_file, 'r') as f, open(uc_file, 'w') as uc:
+        for line in f:
+            seq_id, unique = line.rstrip("\n").split("\t")
+            centroid = centroids[unique]
+            if seq_id == centroid:
+                uc.write("S\t0\t0\t*\t*\t*\t*\t*\t{}\t*\n".format(seq_id))
+            else:
+                uc.write("H\t0\t0\t*\t*\t*\t*\t*\t{}\t{}\n".format(seq_id, centroid))
+
+
+def collapse_and_cluster(sobj: object, threads: int, cluster_id: float) -> None:
+    """Clusters the reads of an itsxpress SeqSample object in two tiers, in place of sobj.cluster.
+
+    Sets the rep_file and uc_file attributes of sobj as sobj.cluster does.
+
+    Args:
+        sobj (object): An itsxpress SeqSample object with its seq_file set.
+        threads (int): The number of threads for Vsearch.
+        cluster_id (float): The percent identity for clustering.
+
+    """
+    uniques_file = os.path.join(sobj.tempdir, 'uniques.fa')
+    mapping_file = os.path.join(sobj.tempdir, 'uniques.tsv')
+    unique_uc = os.path.join(sobj.tempdir, 'uniques.uc')
+    sobj.rep_file = os.path.join(sobj.tempdir, 'rep.fa')
+    sobj.uc_file = os.path.join(sobj.tempdir, 'uc.txt')
+    collapse_duplicates(sobj.seq_file, uniques_file, mapping_file)
+    cluster_uniques(uniques_file, sobj.rep_file, unique_uc, cluster_id=cluster_id, threads=threads)
+    compose_uc(mapping_file, read_centroids(unique_uc), sobj.uc_file)
+    for path in (uniques_file, mapping_file, unique_uc):
+        os.remove(path)
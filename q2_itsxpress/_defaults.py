@@ -0,0 +1,17 @@
+"""Default parameter values of the q2_itsxpress plugin.
+
+The trim actions in _actions need these defaults for their signatures when the plugin
+is loaded, long before anything is trimmed. They are kept here, without imports, so
+loading the plugin does not import numpy or the helper modules that use them.
+
+"""
+default_cluster_id = 0.995
+# The sequences kept in the ITS position cache, see _cache.
+default_cache_size = 1000000
+# The gzip compression level of the trimmed reads, see _gzip.
+default_compression_level = 9
+# The shortest overlap and highest mismatch rate of the in-process merger, see _pairmerge.
+default_min_overlap = 12
+default_max_mismatch_rate = 0.1
+# The reads in each chunk of a split sample, see _chunk.
+default_chunk_reads = 500000
@@ -0,0 +1,265 @@
+"""Bounded memory read to representative mapping for the q2_itsxpress plugin.
+
+Trimming needs to know the representative sequence of every read. itsxpress.Dedup
+keeps a dictionary with a string key and value per read, which for libraries of
+millions of reads takes gigabytes. ReadMap keeps the same mapping as a 12 byte hash
+of the read id and a 4 byte representative number per read, in sorted numpy runs.
+When the runs reach the memory ceiling they are written to disk and memory mapped,
+so memory use stays flat as the depth of a sample grows. Once every read is added the
+spilled runs are merged into one, a key range at a time within the same ceiling, so a
+deep sample is not looked up in each of its runs. Reads are trimmed in blocks by
+_trim, looking up a whole block of read ids at once.
+
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from q2_itsxpress._gzip import open_gzip, default_compression_level
+from q2_itsxpress._trim import RepPositions, trim_fastq, trim_fastq_pairs
+from q2_itsxpress._readindex import trim_indexed_pairs
+
+# Bytes held per read while a run is sorted: the key, the value, the sort order and copies.
+_BYTES_PER_READ = 48
+_KEY_DTYPE = 'S12'
+chunk_size = 65536
+
+
+def read_key(read_id: str) -> bytes:
+    """Returns the 12 byte hash that stands in for a read id."""
+    return hashlib.blake2b(read_id.encode('utf-8'), digest_size=12).digest()
+
+
+def _last_of_each(keys: np.ndarray, values: np.ndarray) -> tuple:
+    """Sorts keys and their values, keeping the last value of each key as a dictionary would."""
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    values = values[order]
+    last = np.append(keys[1:] != keys[:-1], True)
+    return keys[last], values[last]
+
+
+class ReadMap:
+    """A mapping of read ids to representative ids with a memory ceiling.
+
+    Args:
+        memory_limit (int): The bytes the runs may take in memory before they are spilled
+            to disk, None for no limit.
+        tempdir (str): The directory for spilled runs.
+
+    Attributes:
+        spilled (int): The number of runs spilled to disk.
+
+    """
+    def __init__(self, memory_limit: int = None, tempdir: str = None):
+        self.tempdir = tempdir
+        self.capacity = max(chunk_size, memory_limit // _BYTES_PER_READ) if memory_limit else None
+        self.rep_names = []
+        self._rep_index = {}
+        self._keys = []
+        self._values = []
+        self._chunks = []
+        self._held = 0
+        self._runs = []
+        self._run_files = []
+        self._count = 0
+        self.spilled = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, read_id: str, rep_id: str) -> None:
+        """Maps a read id to a representative id, later additions win."""
+        index = self._rep_index.get(rep_id)
+        if index is None:
+            index = self._rep_index[rep_id] = len(self.rep_names)
+            self.rep_names.append(rep_id)
+        self._keys.append(read_key(read_id))
+        self._values.append(index)
+        self._count += 1
+        if len(self._keys) >= chunk_size:
+            self._flush_chunk()
+
+    def rename(self, names: dict) -> None:
+        """Replaces representative ids, such as unique sequences by the centroids they cluster to.
+
+        Args:
+            names (dict): {current representative id: new representative id}
+
+        """
+        self.rep_names = [names[name] for name in self.rep_names]
+        self._rep_index = {}
+        for index, name in enumerate(self.rep_names):
+            self._rep_index.setdefault(name, index)
+
+    def _flush_chunk(self) -> None:
+        if self._keys:
+            self._chunks.append((np.array(self._keys, dtype=_KEY_DTYPE),
+                                 np.array(self._values, dtype=np.int32)))
+            self._held += len(self._keys)
+            self._keys = []
+            self._values = []
+        if self.capacity is not None and self._held >= self.capacity:
+            self._spill()
+
+    def _sorted_run(self) -> tuple:
+        keys = np.concatenate([chunk[0] for chunk in self._chunks])
+        values = np.concatenate([chunk[1] for chunk in self._chunks])
+        self._chunks = []
+        self._held = 0
+        return _last_of_each(keys, values)
+
+    def _spill(self) -> None:
+        keys, values = self._sorted_run()
+        prefix = os.path.join(self.tempdir, "readmap{}".format(len(self._runs)))
+        np.save(prefix + "_keys.npy", keys)
+        np.save(prefix + "_values.npy", values)
+        del keys, values
+        self._runs.append((np.load(prefix + "_keys.npy", mmap_mode='r'),
+                           np.load(prefix + "_values.npy", mmap_mode='r')))
+        self._run_files += [prefix + "_keys.npy", prefix + "_values.npy"]
+        self.spilled += 1
+
+    def _merge_runs(self) -> None:
+        """Merges the runs into one run on disk, holding about capacity reads at a time."""
+        total = sum(len(keys) for keys, _ in self._runs)
+        parts = max(1, -(-total // self.capacity))
+        # Read ids are hashed, so each range of leading key bytes holds about as many reads.
+        bounds = ([None] +
+                  [np.array((part * (1 << 32) // parts).to_bytes(4, 'big'), dtype=_KEY_DTYPE)
+                   for part in range(1, parts)] +
+                  [None])
+        prefix = os.path.join(self.tempdir, "readmap_merged")
+        count = 0
+        with open(prefix + "_keys.bin", 'wb') as key_file, open(prefix + "_values.bin", 'wb') as value_file:
+            for low, high in zip(bounds[:-1], bounds[1:]):
+                key_parts = []
+                value_parts = []
+                # Runs are taken in the order they were added, so later additions win.
+                for run_keys, run_values in self._runs:
+                    start = 0 if low is None else np.searchsorted(run_keys, low)
+                    stop = len(run_keys) if high is None else np.searchsorted(run_keys, high)
+                    key_parts.append(run_keys[start:stop])
+                    value_parts.append(run_values[start:stop])
+                keys = np.concatenate(key_parts)
+                if not len(keys):
+                    continue
+                keys, values = _last_of_each(keys, np.concatenate(value_parts))
+                keys.tofile(key_file)
+                values.tofile(value_file)
+                count += len(keys)
+        self._runs = [(np.memmap(prefix + "_keys.bin", dtype=_KEY_DTYPE, mode='r', shape=(count,)),
+                       np.memmap(prefix + "_values.bin", dtype=np.int32, mode='r', shape=(count,)))
+                      if count else (np.array([], dtype=_KEY_DTYPE), np.array([], dtype=np.int32))]
+        for path in self._run_files:
+            os.remove(path)
+        self._run_files = [prefix + "_keys.bin", prefix + "_values.bin"]
+
+    def close(self) -> None:
+        """Sorts the reads added last and merges the runs, call once all reads are added."""
+        self._flush_chunk()
+        if self._chunks:
+            self._runs.append(self._sorted_run())
+        if len(self._runs) > 1:
+            self._merge_runs()
+
+    def lookup(self, read_ids: list) -> np.ndarray:
+        """Returns the representative number of each read id, -1 for unknown reads.
+
+        Args:
+            read_ids (list): The read ids to look up.
+
+        Returns:
+            (np.ndarray): Indices into rep_names.
+
+        """
+        keys = np.array([read_key(read_id) for read_id in read_ids], dtype=_KEY_DTYPE)
+        result = np.full(len(keys), -1, dtype=np.int64)
+        # Later runs hold later additions, so they are searched first. After close there is one run.
+        for run_keys, run_values in reversed(self._runs):
+            if not len(run_keys):
+                continue
+            index = np.minimum(np.searchsorted(run_keys, keys), len(run_keys) - 1)
+            hit = (result < 0) & (run_keys[index] == keys)
+            result[hit] = run_values[index[hit]]
+        return result
+
+
+def read_uc(uc_file: str, memory_limit: int = None, tempdir: str = None) -> ReadMap:
+    """Reads the read to representative mapping of a Vsearch uc file, as itsxpress.Dedup does.
+
+    Args:
+        uc_file (str): The uc file written by Vsearch.
+        memory_limit (int): The memory ceiling of the ReadMap in bytes, None for no limit.
+        tempdir (str): The directory for spilled runs.
+
+    Returns:
+        (ReadMap): The mapping of every read to its representative.
+
+    """
+    readmap = ReadMap(memory_limit=memory_limit, tempdir=tempdir)
+    with open(uc_file, 'r') as f:
+        for line in f:
+            ll = line.split()
+            if ll[0] == 'S':
+                readmap.add(ll[8], ll[8])
+            elif ll[0] == 'H':
+                readmap.add(ll[8], ll[9])
+    readmap.close()
+    return readmap
+
+
+class BoundedDedup:
+    """A stand-in for itsxpress.Dedup that keeps its read mapping within a memory ceiling.
+
+    Args:
+        uc_file (str): The uc file written by Vsearch.
+        seq_file (str): The reads that are trimmed for merged output.
+        fastq (str): The forward reads for unmerged output.
+        fastq2 (str): The reverse reads for unmerged output.
+        memory_limit (int): The memory ceiling of the read mapping in bytes.
+        tempdir (str): The directory for spilled runs.
+        read_index (tuple): (forward ReadIndex, reverse ReadIndex) of fastq and fastq2, to write
+            unmerged output from instead of the files, optional.
+
+    Attributes:
+        readmap (ReadMap): The representative of each read.
+
+    """
+    def __init__(self, uc_file, seq_file, fastq=None, fastq2=None, memory_limit=None, tempdir=None,
+                 read_index=None):
+        self.seq_file = seq_file
+        self.fastq = fastq
+        self.fastq2 = fastq2
+        self.read_index = read_index
+        self.readmap = read_uc(uc_file, memory_limit=memory_limit, tempdir=tempdir)
+
+    def create_trimmed_seqs(self, outfile: str, gzipped: bool, itspos,
+                            compresslevel: int = default_compression_level, threads: int = 1) -> int:
+        """Writes the reads trimmed to the selected region, see itsxpress.Dedup.
+
+        Returns:
+            (int): The number of reads written.
+
+        """
+        out = open_gzip(outfile, compresslevel, threads, binary=True) if gzipped else open(outfile, 'wb')
+        with out:
+            return trim_fastq(self.seq_file, self.readmap, RepPositions(self.readmap.rep_names, itspos), out)
+
+    def create_paired_trimmed_seqs(self, outfile1: str, outfile2: str, gzipped: bool, itspos,
+                                   compresslevel: int = default_compression_level, threads: int = 1) -> int:
+        """Writes unmerged read pairs trimmed to the selected region, see itsxpress.Dedup.
+
+        Returns:
+            (int): The number of read pairs written.
+
+        """
+        def _open(outfile):
+            return open_gzip(outfile, compresslevel, threads, binary=True) if gzipped else open(outfile, 'wb')
+
+        positions = RepPositions(self.readmap.rep_names, itspos)
+        with _open(outfile1) as out1, _open(outfile2) as out2:
+            if self.read_index is not None:
+                return trim_indexed_pairs(*self.read_index, self.readmap, positions, out1, out2)
+            return trim_fastq_pairs(self.fastq, self.fastq2, self.readmap, positions, out1, out2)
@@ -0,0 +1,60 @@
+"""FASTQ reading and writing helpers for the q2_itsxpress plugin.
+
+Plain string based FASTQ handling, used where reads are streamed rather than parsed
+into Biopython records. Records are written in the same layout as Biopython writes them.
+
+"""
+import gzip
+
+
+def open_fastq(fastq: str, mode: str = 'rt'):
+    """Opens a FASTQ file, gzipped or not.
+
+    Args:
+        fastq (str): The path to a .fastq or .fastq.gz file.
+        mode (str): The file mode.
+
+    Returns:
+        (object): A file object.
+
+    """
+    if fastq.endswith(".gz"):
+        return gzip.open(fastq, mode)
+    return open(fastq, mode)
+
+
+def read_fastq(handle):
+    """Reads FASTQ records from an open file.
+
+    Args:
+        handle (object): A text file object.
+
+    Yields:
+        (tuple): (title line without the @, sequence, quality)
+
+    """
+    for title in handle:
+        if not title.strip():
+            continue
+        seq = next(handle).rstrip("\n")
+        next(handle)
+        qual = next(handle).rstrip("\n")
+        yield title[1:].rstrip("\n"), seq, qual
+
+
+def write_fastq(handle, title: str, seq: str, qual: str) -> None:
+    """Writes a FASTQ record in the same layout as Biopython.
+
+    Args:
+        handle (object): A text file object.
+        title (str): The title line without the @.
+        seq (str): The sequence.
+        qual (str): The quality string.
+
+    """
+    handle.write("@{}\n{}\n+\n{}\n".format(title, seq, qual))
+
+
+def read_id(title: str) -> str:
+    """Returns the read id of a title line, the text up to the first whitespace."""
+    return title.split(None, 1)[0]
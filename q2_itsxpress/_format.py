@@ -0,0 +1,40 @@
+"""The file formats of the q2_itsxpress plugin."""
+import qiime2
+import qiime2.plugin.model as model
+from qiime2.plugin import ValidationError
+
+from q2_itsxpress._posindex import INDEX_COLUMNS, parse_row
+
+
+class ITSxpressStatsFormat(model.TextFileFormat):
+    """The trimming statistics table, a QIIME 2 metadata file with a row for each sample."""
+    def _validate_(self, level):
+        try:
+            qiime2.Metadata.load(str(self))
+        except qiime2.metadata.MetadataFileError as md_exc:
+            raise ValidationError(md_exc) from md_exc
+
+
+ITSxpressStatsDirFmt = model.SingleFileDirectoryFormat(
+    'ITSxpressStatsDirFmt', 'stats.tsv', ITSxpressStatsFormat)
+
+
+class ITSPositionIndexFormat(model.TextFileFormat):
+    """The ITS position index, a tab separated table with the columns of _posindex.INDEX_COLUMNS."""
+    def _validate_(self, level):
+        rows = {'min': 1000, 'max': None}[level]
+        with self.open() as f:
+            header = f.readline().rstrip("\n").split("\t")
+            if tuple(header) != INDEX_COLUMNS:
+                raise ValidationError("The header should be {}".format("\t".join(INDEX_COLUMNS)))
+            for n, line in enumerate(f, 2):
+                if rows is not None and n > rows + 1:
+                    break
+                try:
+                    parse_row(line.rstrip("\n").split("\t"))
+                except ValueError as e:
+                    raise ValidationError("Line {}: {}".format(n, e)) from e
+
+
+ITSPositionIndexDirFmt = model.SingleFileDirectoryFormat(
+    'ITSPositionIndexDirFmt', 'positions.tsv', ITSPositionIndexFormat)
@@ -0,0 +1,97 @@
+"""Multi-threaded gzip output for the q2_itsxpress plugin.
+
+Trimmed reads used to be written through gzip.open, compressing at level 9 on the
+thread doing the trimming. The writer here collects output into blocks and
+compresses each block as its own gzip member on a pool of threads, in the same way
+as pigz and BGZF, while the trimming carries on. zlib releases the GIL while it
+compresses, so the threads run in parallel. Concatenated gzip members are a valid
+gzip file, and the output reads back with gzip, zcat and Biopython like any other
+.fastq.gz file.
+
+"""
+import collections
+import gzip
+import io
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from q2_itsxpress._defaults import default_compression_level
+
+block_size = 1 << 20
+
+
+def _compress_member(data: bytes, level: int) -> bytes:
+    """Compresses a block into a complete gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """A binary file object writing gzip members compressed on several threads.
+
+    Args:
+        path (str): The file to write.
+        level (int): The compression level, from 1 (fastest) to 9 (smallest).
+        threads (int): The number of compression threads.
+
+    """
+    def __init__(self, path: str, level: int = default_compression_level, threads: int = 2):
+        super().__init__()
+        self.level = level
+        self._file = open(path, 'wb')
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        # Two blocks in flight per thread keeps the threads busy without holding the whole file.
+        self._max_pending = 2 * threads
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._members = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= block_size:
+            self._submit(bytes(self._buffer[:block_size]))
+            del self._buffer[:block_size]
+        return len(data)
+
+    def _submit(self, block: bytes) -> None:
+        self._pending.append(self._executor.submit(_compress_member, block, self.level))
+        self._members += 1
+        while len(self._pending) >= self._max_pending or (self._pending and self._pending[0].done()):
+            self._file.write(self._pending.popleft().result())
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self._buffer or not self._members:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._file.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown()
+            self._file.close()
+            super().close()
+
+
+def open_gzip(path: str, level: int = default_compression_level, threads: int = 1, binary: bool = False):
+    """Opens a gzip file for writing text.
+
+    Args:
+        path (str): The file to write.
+        level (int): The compression level, from 1 (fastest) to 9 (smallest).
+        threads (int): The number of compression threads, 1 compresses on the calling thread.
+        binary (bool): Open the file for writing bytes instead.
+
+    Returns:
+        (object): A text file object, or a binary one.
+
+    """
+    if threads <= 1:
+        return gzip.open(path, 'wb' if binary else 'wt', compresslevel=level)
+    writer = io.BufferedWriter(ParallelGzipWriter(path, level=level, threads=threads),
+                               buffer_size=block_size)
+    return writer if binary else io.TextIOWrapper(writer)
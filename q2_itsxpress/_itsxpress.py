@@ -20,20 +20,56 @@ ITSxpress is also available as a stand-alone software package. See
 https://github.com/USDA-ARS-GBRU/itsxpress for details.
 
 """
+import contextlib
+import logging
 import os
 import pathlib
 import shutil
 import math
+import tempfile
+from functools import partial
 
 import pandas as pd
-from q2_types.per_sample_sequences import (SingleLanePerSamplePairedEndFastqDirFmt,
-                                           SingleLanePerSampleSingleEndFastqDirFmt,
-                                           CasavaOneEightSingleLanePerSampleDirFmt)
+from q2_types.per_sample_sequences import CasavaOneEightSingleLanePerSampleDirFmt
 from itsxpress import main as itsxpress
 from itsxpress.definitions import (taxa_dict,
                    ROOT_DIR)
 
-default_cluster_id=0.995
+from q2_itsxpress._scheduler import plan_threads, run_samples, sample_size, plan_jobs
+from q2_itsxpress._pool import (count_fasta,
+                                read_fasta,
+                                sequence_digest,
+                                pool_representatives,
+                                split_positions,
+                                count_usable,
+                                PositionTable)
+from q2_itsxpress._cache import PositionCache, default_cache_size, hmm_checksum, read_cache
+from q2_itsxpress._posindex import REGIONS, index_positions, read_index, write_index
+from q2_itsxpress._format import ITSPositionIndexDirFmt
+from q2_itsxpress._stream import StreamSample
+from q2_itsxpress._derep import BoundedDedup
+from q2_itsxpress._trim import DictLookup, RepPositions, trim_fastq, trim_fastq_pairs
+from q2_itsxpress._readindex import PairIndexer, trim_indexed_pairs
+from q2_itsxpress._chunk import split_sample, join_files, combine_counts, default_chunk_reads
+from q2_itsxpress._cluster import collapse_and_cluster
+from q2_itsxpress._merge import merge_samples, run_bbmerge
+from q2_itsxpress._pairmerge import PairMerger, default_min_overlap, default_max_mismatch_rate
+from q2_itsxpress._gzip import open_gzip, default_compression_level
+from q2_itsxpress._profile import Profiler, write_profile, read_profile
+from q2_itsxpress._autotune import ThreadPlan, calibrate, plan_stages, TUNED_STAGES
+from q2_itsxpress._pipeline import (Pipeline, Stage, Budget, PIPELINE_STAGES, available_memory,
+                                    parse_stage_workers, sample_memory)
+from q2_itsxpress._stats import stats_table
+from q2_itsxpress._shard import plan_shards, sharded_search
+from q2_itsxpress._models import prepare_models
+from q2_itsxpress._checkpoint import CheckpointStore
+from q2_itsxpress._validate import check_sample
+from q2_itsxpress._workspace import Workspace, scratch_needed
+# The trim actions are defined without the imports above, see _actions.
+from q2_itsxpress._actions import (trim_single,
+                                   trim_pair,
+                                   trim_pair_output_unmerged,
+                                   default_cluster_id)
 
 
 def _set_fastqs_and_check(fastq: str,
@@ -41,7 +77,17 @@ def _set_fastqs_and_check(fastq: str,
                           sample_id: str,
                           single_end: bool,
                           reversed_primers: bool,
-                          threads: int) -> object:
+                          threads: int,
+                          stream: bool = False,
+                          paired_out: bool = False,
+                          profiler: Profiler = None,
+                          memory_limit: int = None,
+                          merge: bool = True,
+                          merger: PairMerger = None,
+                          validated: bool = False,
+                          workdir: str = None,
+                          stage_threads: dict = None,
+                          index_reads: bool = False) -> object:
     """Checks and writes the fastqs as well as if they are paired end and single end.
 
         Args:
@@ -50,6 +96,18 @@ def _set_fastqs_and_check(fastq: str,
             sample_id (str): The Sample ID.
             single_end (bool): If the sequences are singled ended or not
             threads (int): The amount of threads to use
+            stream (bool): Return a StreamSample that merges reads as they are dereplicated.
+            paired_out (bool): Declares if output files should be paired.
+            profiler (Profiler): Records the check and merge stages, optional.
+            memory_limit (int): The bytes a streamed sample may hold per read in memory, None for no limit.
+            merge (bool): Merge paired reads, False leaves them to be merged with other samples.
+            merger (PairMerger): Merges paired reads in process instead of BBMerge, optional.
+            validated (bool): The reads were checked up front, skip the per-sample check.
+            workdir (str): The directory for temporary files, None for the system temporary directory.
+            stage_threads (dict): {stage: threads} for the merge, dereplicate and search stages,
+                in place of threads, optional.
+            index_reads (bool): Index the read files while they are merged, to write paired output
+                from the index, see _readindex.
 
         Returns:
             (object): The sobj object
@@ -58,9 +116,14 @@ def _set_fastqs_and_check(fastq: str,
             ValueError1: for FASTQ format issue.
 
         """
+    if profiler is None:
+        profiler = Profiler(sample_id)
+    merge_threads = (stage_threads or {}).get("merge", threads)
     # checking fastqs
     try:
-        itsxpress._check_fastqs(fastq=fastq, fastq2=fastq2)
+        if not validated:
+            with profiler.stage("check"):
+                itsxpress._check_fastqs(fastq=fastq, fastq2=fastq2)
         # Parse input types
         paired_end, interleaved = itsxpress._is_paired(fastq=fastq,
                                                        fastq2=fastq2,
@@ -72,17 +135,44 @@ def _set_fastqs_and_check(fastq: str,
         # Create SeqSample objects and merge if needed.
 
 
+    if stream:
+        return StreamSample(fastq=fastq,
+                            fastq2=fastq2 if paired_end else None,
+                            tempdir=workdir,
+                            reversed_primers=reversed_primers,
+                            keep_merged=not paired_out,
+                            memory_limit=memory_limit,
+                            merger=merger,
+                            index_reads=index_reads)
+
     if paired_end:
         sobj = itsxpress.SeqSamplePairedNotInterleaved(fastq=fastq,
                                                        fastq2=fastq2,
-                                                       tempdir=None,
+                                                       tempdir=workdir,
                                                        reversed_primers=reversed_primers)
-        sobj._merge_reads(threads=threads)
+        # Batched samples are indexed while their batch is merged, see _trim_batch.
+        indexer = PairIndexer(sobj.r1, sobj.fastq2, sobj.tempdir) if merge and index_reads and paired_out else None
+        with indexer or contextlib.nullcontext():
+            if merge and merger is not None:
+                with profiler.stage("merge", threads=merge_threads) as record:
+                    sobj.seq_file = os.path.join(sobj.tempdir, 'seq.fq')
+                    record["reads_in"], record["reads_out"] = merger.merge_files(sobj.r1, sobj.fastq2, sobj.seq_file,
+                                                                                 threads=merge_threads)
+            elif merge:
+                with profiler.stage("merge", threads=merge_threads) as record:
+                    # As sobj._merge_reads, keeping the read counts BBMerge reports.
+                    sobj.seq_file = os.path.join(sobj.tempdir, 'seq.fq.gz')
+                    record["reads_in"], record["reads_out"] = run_bbmerge(sobj.r1, sobj.fastq2, sobj.seq_file,
+                                                                          threads=merge_threads, ordered=False)
+        if indexer is not None:
+            sobj.read_index = indexer.indexes
+        if merge:
+            profiler.counts.update(reads_in=record["reads_in"], merged=record["reads_out"])
         return sobj
 
     elif not paired_end:
         sobj = itsxpress.SeqSampleNotPaired(fastq=fastq,
-                                            tempdir=None)
+                                            tempdir=workdir)
         return sobj
 
 
@@ -104,56 +194,1197 @@ def _taxa_prefix_to_taxa(taxa_prefix: str) -> str:
     return taxa_choice
 
 
-# First command Trim for SingleLanePerSampleSingleEndFastqDirFmt
-def trim_single(per_sample_sequences: SingleLanePerSampleSingleEndFastqDirFmt,
+def _prepare_sample(sample: tuple,
+                    paired_in: bool,
+                    paired_out: bool,
+                    reversed_primers: bool,
+                    cluster_id: float,
+                    threads: int,
+                    stream: bool = False,
+                    memory_limit: int = None,
+                    collapse_duplicates: bool = False,
+                    merger: PairMerger = None,
+                    validated: bool = False,
+                    workdir: str = None,
+                    stage_threads: dict = None,
+                    index_reads: bool = False) -> tuple:
+    """Checks, merges and dereplicates the reads of a single sample.
+
+    Args:
+        sample (tuple): (sample id, forward reads path, reverse reads path or None).
+        paired_in (bool): Declares if input files are paired.
+        paired_out (bool): Declares if output files should be paired.
+        reversed_primers (bool): Primers are in reverse orientation.
+        cluster_id (float):The percent identity for clustering reads, set to 1 for exact dereplication.
+        threads (int) : The number of threads the external tools may use for this sample.
+        stream (bool): Stream reads through dereplication without intermediate files.
+        memory_limit (int): The bytes the read mapping may hold in memory, None for no limit.
+        collapse_duplicates (bool): Collapse identical reads before clustering so Vsearch only
+            clusters unique sequences.
+        merger (PairMerger): Merges paired reads in process instead of BBMerge, optional.
+        validated (bool): The reads were checked up front, skip the per-sample check.
+        workdir (str): The directory for temporary files, None for the system temporary directory.
+        stage_threads (dict): {stage: threads} for the merge, dereplicate and search stages,
+            in place of threads, optional.
+        index_reads (bool): Index the read files while they are merged, for paired output.
+
+    Returns:
+        (tuple): (the sobj object with its rep_file set, the Profiler of the sample)
+
+    """
+    sobj, profiler = _merge_sample(sample,
+                                   paired_in=paired_in,
+                                   paired_out=paired_out,
+                                   reversed_primers=reversed_primers,
+                                   threads=threads,
+                                   stream=stream,
+                                   memory_limit=memory_limit,
+                                   merger=merger,
+                                   validated=validated,
+                                   workdir=workdir,
+                                   stage_threads=stage_threads,
+                                   index_reads=index_reads)
+    _dereplicate_sample(sobj,
+                        profiler=profiler,
+                        cluster_id=cluster_id,
+                        threads=(stage_threads or {}).get("dereplicate", threads),
+                        collapse_duplicates=collapse_duplicates)
+    return sobj, profiler
+
+
+def _merge_sample(sample: tuple,
+                  paired_in: bool,
+                  paired_out: bool,
+                  reversed_primers: bool,
+                  threads: int,
+                  stream: bool = False,
+                  memory_limit: int = None,
+                  merger: PairMerger = None,
+                  validated: bool = False,
+                  workdir: str = None,
+                  stage_threads: dict = None,
+                  index_reads: bool = False) -> tuple:
+    """Checks and merges the reads of a single sample. See _prepare_sample.
+
+    Returns:
+        (tuple): (the sobj object with its reads merged, the Profiler of the sample)
+
+    """
+    sample_id, forward, reverse = sample
+    profiler = Profiler(sample_id)
+    # writing fastqs and their attributes and checking the files
+    sobj = _set_fastqs_and_check(
+        fastq=forward,
+        fastq2=reverse if paired_in else None,
+        sample_id=sample_id,
+        single_end=False if paired_in else True,
+        reversed_primers=reversed_primers,
+        threads=threads,
+        stream=stream,
+        paired_out=paired_out,
+        profiler=profiler,
+        memory_limit=memory_limit,
+        merger=merger,
+        validated=validated,
+        workdir=workdir,
+        stage_threads=stage_threads,
+        index_reads=index_reads)
+    return sobj, profiler
+
+
+def _dereplicate_sample(sobj: object,
+                        profiler: Profiler,
+                        cluster_id: float,
+                        threads: int,
+                        collapse_duplicates: bool = False) -> None:
+    """Dereplicates or clusters the merged reads of a single sample, setting its rep_file.
+
+    Args:
+        sobj (object): The sobj object from _set_fastqs_and_check, with its reads merged.
+        profiler (Profiler): Records the dereplicate stage.
+        cluster_id (float):The percent identity for clustering reads, set to 1 for exact dereplication.
+        threads (int) : The number of threads the external tools may use for this sample.
+        collapse_duplicates (bool): Collapse identical reads before clustering so Vsearch only
+            clusters unique sequences.
+
+    """
+    exact = math.isclose(cluster_id, 1,rel_tol=1e-05)
+    # Deduplicate
+    with profiler.stage("dereplicate", threads=threads) as record:
+        if isinstance(sobj, StreamSample):
+            sobj.dereplicate(threads=threads)
+            # Streamed reads are collapsed first, so only unique sequences are clustered.
+            if not exact:
+                sobj.cluster(threads=threads, cluster_id=cluster_id)
+            record["reads_in"] = sobj.n_reads
+            record["reads_out"] = len(set(sobj.repmap.values()))
+            if sobj.fastq2 is not None:
+                profiler.counts.update(reads_in=sobj.n_pairs, merged=sobj.n_reads)
+        else:
+            if exact:
+                sobj.deduplicate(threads=threads)
+            elif collapse_duplicates:
+                collapse_and_cluster(sobj, threads=threads, cluster_id=cluster_id)
+            else:
+                sobj.cluster(threads=threads, cluster_id=cluster_id)
+            record["reads_in"] = profiler.counts.get("merged")
+            record["reads_out"] = count_fasta(sobj.rep_file)
+        profiler.counts["unique"] = record["reads_out"]
+
+
+def _hmm_file(taxa: str) -> str:
+    """Returns the path of the ITSx HMM models for a taxa.
+
+    Args:
+        taxa (str): The taxa to be used for the search.
+
+    Returns:
+        (str): The path to the HMM file.
+
+    """
+    return os.path.join(ROOT_DIR, "ITSx_db", "HMMs", taxa_dict[taxa])
+
+
+def _search_sample(sobj: object, taxa: str, threads: int, hmmfile: str = None) -> None:
+    """Runs HMMSearch on the representative sequences of a sobj object.
+
+    Large sets of sequences are split into shards searched by concurrent hmmsearch
+    processes, the number of shards follows from the threads.
+
+    Args:
+        sobj (object): An itsxpress SeqSample object with its rep_file set.
+        taxa (str): The taxa to be used for the search.
+        threads (int) : The number of threads to use.
+        hmmfile (str): The prepared models to search with, None for the full HMM file of the taxa.
+
+    Raises:
+        ValueError1: hmmsearch error.
+
+    """
+    if hmmfile is None:
+        hmmfile = _hmm_file(taxa)
+    n_seqs = count_fasta(sobj.rep_file)
+    n_shards, shard_threads = plan_shards(threads=threads, n_seqs=n_seqs)
+    try:
+        # HMMSearch for ITS regions
+        if n_shards > 1:
+            sobj.dom_file = os.path.join(sobj.tempdir, 'domtbl.txt')
+            sharded_search(sobj.rep_file,
+                           hmmfile=hmmfile,
+                           dom_file=sobj.dom_file,
+                           n_seqs=n_seqs,
+                           n_shards=n_shards,
+                           threads=shard_threads)
+        else:
+            sobj._search(hmmfile=hmmfile, threads=threads)
+    except (ModuleNotFoundError,
+            FileNotFoundError,
+            NotADirectoryError):
+
+        raise ValueError("hmmsearch was not found, make sure HMMER3 is installed and executable")
+
+
+def _locate_its(rep_file: str,
+                tempdir: str,
+                taxa: str,
                 region: str,
-                taxa: str = "F",
-                threads: int = 1,
-                cluster_id: float = default_cluster_id) -> CasavaOneEightSingleLanePerSampleDirFmt:
-    results = main(per_sample_sequences=per_sample_sequences,
-                   threads=threads,
-                   taxa=taxa,
-                   region=region,
-                   paired_in=False,
-                   paired_out=False,
-                   reversed_primers=False,
-                   cluster_id=cluster_id)
-    return results
-
-
-# Second command Trim for SingleLanePerSamplePairedEndFastqDirFmt
-def trim_pair(per_sample_sequences: SingleLanePerSamplePairedEndFastqDirFmt,
-              region: str,
-              taxa: str = "F",
-              threads: int = 1,
-              reversed_primers: bool = False,
-              cluster_id: float = default_cluster_id) -> CasavaOneEightSingleLanePerSampleDirFmt:
-    results = main(per_sample_sequences=per_sample_sequences,
-                   threads=threads,
-                   taxa=taxa,
-                   region=region,
-                   paired_in=True,
-                   paired_out=False,
-                   reversed_primers=reversed_primers,
-                   cluster_id=cluster_id)
-    return results
-
-# Second command Trim for SingleLanePerSamplePairedEndFastqDirFmt
-def trim_pair_output_unmerged(per_sample_sequences: SingleLanePerSamplePairedEndFastqDirFmt,
-              region: str,
-              taxa: str = "F",
-              threads: int = 1,
-              reversed_primers: bool = False,
-              cluster_id: float = default_cluster_id) -> CasavaOneEightSingleLanePerSampleDirFmt:
-    results = main(per_sample_sequences=per_sample_sequences,
-                   threads=threads,
-                   taxa=taxa,
-                   region=region,
-                   paired_in=True,
-                   paired_out=True,
-                   reversed_primers=reversed_primers,
-                   cluster_id=cluster_id)
-    return results
+                threads: int,
+                cache_dir: str = None,
+                cache_size: int = default_cache_size,
+                index_file: str = None,
+                profiler: Profiler = None,
+                hmmfile: str = None) -> tuple:
+    """Finds the ITS positions of representative sequences.
+
+    When a position index or a cache directory is given only the sequences missing from
+    both are searched with HMMSearch, and their positions are added to the cache.
+
+    Args:
+        rep_file (str): The FASTA file of representative sequences.
+        tempdir (str): The directory for the HMMSearch files.
+        taxa (str): The taxa to be used for the search.
+        region (str) : The region to be used for the search.
+        threads (int) : The number of threads to use.
+        cache_dir (str): The ITS position cache directory, or None for no cache.
+        cache_size (int): The maximum number of positions kept in the cache.
+        index_file (str): An ITS position index file, see _posindex, whose positions are used
+            before the cache and HMMSearch. None for no index.
+        profiler (Profiler): Records the search stage, optional.
+        hmmfile (str): The prepared models to search with, None for the full HMM file of the taxa.
+
+    Returns:
+        (tuple): (ItsPosition or PositionTable object, the sequences found in the index or
+            cache, the sequences searched)
+
+    """
+    if profiler is None:
+        profiler = Profiler(None)
+    with profiler.stage("search", threads=threads) as record:
+        its_pos, hits, misses = _find_positions(rep_file,
+                                                tempdir=tempdir,
+                                                taxa=taxa,
+                                                region=region,
+                                                threads=threads,
+                                                cache_dir=cache_dir,
+                                                cache_size=cache_size,
+                                                index_file=index_file,
+                                                hmmfile=hmmfile)
+        record["reads_in"] = count_fasta(rep_file)
+        # Only the sequences whose ITS can be trimmed to are counted as found.
+        record["reads_out"] = count_usable(its_pos)
+    return its_pos, hits, misses
+
+
+def _find_positions(rep_file: str,
+                    tempdir: str,
+                    taxa: str,
+                    region: str,
+                    threads: int,
+                    cache_dir: str = None,
+                    cache_size: int = default_cache_size,
+                    index_file: str = None,
+                    hmmfile: str = None) -> tuple:
+    """Runs HMMSearch, through the ITS position index and cache if given. See _locate_its."""
+    search_obj = itsxpress.SeqSample(fastq=None, tempdir=tempdir)
+    try:
+        return _search_positions(search_obj,
+                                 rep_file,
+                                 taxa=taxa,
+                                 region=region,
+                                 threads=threads,
+                                 cache_dir=cache_dir,
+                                 cache_size=cache_size,
+                                 index_file=index_file,
+                                 hmmfile=hmmfile)
+    finally:
+        # The positions are parsed into memory, so the domain table is no longer needed.
+        shutil.rmtree(search_obj.tempdir, ignore_errors=True)
+
+
+def _search_positions(search_obj: object,
+                      rep_file: str,
+                      taxa: str,
+                      region: str,
+                      threads: int,
+                      cache_dir: str = None,
+                      cache_size: int = default_cache_size,
+                      index_file: str = None,
+                      hmmfile: str = None) -> tuple:
+    """Runs HMMSearch in the directory of search_obj. See _find_positions."""
+    if cache_dir is None and index_file is None:
+        search_obj.rep_file = rep_file
+        _search_sample(search_obj, taxa=taxa, threads=threads, hmmfile=hmmfile)
+        # Parse HMMseach output.
+        its_pos = itsxpress.ItsPosition(domtable=search_obj.dom_file,
+                                        region=region)
+        return its_pos, 0, 0
+    digests = {seq_id: sequence_digest(seq) for seq_id, seq in read_fasta(rep_file)}
+    unique = set(digests.values())
+    known = {}
+    if index_file is not None:
+        indexed = index_positions(index_file, taxa=taxa, region=region, hmm=hmm_checksum(_hmm_file(taxa)))
+        known = {digest: indexed[digest] for digest in unique if digest in indexed}
+    cache = None
+    if cache_dir is not None:
+        cache = PositionCache(cache_dir,
+                              taxa=taxa,
+                              region=region,
+                              hmmfile=_hmm_file(taxa),
+                              max_entries=cache_size)
+    try:
+        if cache is not None:
+            # Sequences found in the index are not looked up in the cache.
+            known.update(cache.lookup(unique.difference(known)))
+        # Only the sequences missing from the index and cache go to HMMSearch.
+        search_obj.rep_file = os.path.join(search_obj.tempdir, 'rep.fa')
+        queued = {}
+        with open(search_obj.rep_file, 'w') as f:
+            for seq_id, seq in read_fasta(rep_file):
+                digest = digests[seq_id]
+                if digest not in known and digest not in queued:
+                    queued[digest] = seq_id
+                    f.write(">{}\n{}\n".format(seq_id, seq))
+        if queued:
+            _search_sample(search_obj, taxa=taxa, threads=threads, hmmfile=hmmfile)
+            its_pos = itsxpress.ItsPosition(domtable=search_obj.dom_file,
+                                            region=region)
+            found = {digest: its_pos.get_position(seq_id) if seq_id in its_pos.ddict else None
+                     for digest, seq_id in queued.items()}
+            if cache is not None:
+                cache.store(found)
+            known.update(found)
+        positions = {seq_id: known[digest]
+                     for seq_id, digest in digests.items()
+                     if known[digest] is not None}
+        return PositionTable(positions), len(unique) - len(queued), len(queued)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def _write_dedup(dedup_obj: object,
+                 its_pos,
+                 out_path_fwd: str,
+                 out_path_rev: str = None,
+                 compression_level: int = default_compression_level,
+                 compression_threads: int = 1,
+                 read_index: tuple = None) -> int:
+    """Writes the trimmed reads of an itsxpress Dedup object through the gzip writer.
+
+    The reads are trimmed in blocks by _trim rather than by the Dedup object, with the
+    same output.
+
+    Args:
+        dedup_obj (object): An itsxpress Dedup object.
+        its_pos (object): An ItsPosition or PositionTable object.
+        out_path_fwd (str): The file for the merged or forward reads.
+        out_path_rev (str): The file for the reverse reads, None for merged output.
+        compression_level (int): The gzip compression level.
+        compression_threads (int): The number of compression threads for each file.
+        read_index (tuple): (forward ReadIndex, reverse ReadIndex) to write paired output from, optional.
+
+    Returns:
+        (int): The number of reads, or read pairs, written.
+
+    """
+    lookup = DictLookup(dedup_obj.matchdict)
+    positions = RepPositions(lookup.rep_names, its_pos)
+    if out_path_rev is None:
+        with open_gzip(out_path_fwd, compression_level, compression_threads, binary=True) as out:
+            return trim_fastq(dedup_obj.seq_file, lookup, positions, out)
+    # Both files are written in step so the pairs are not held in memory.
+    with open_gzip(out_path_fwd, compression_level, compression_threads, binary=True) as out1, \
+            open_gzip(out_path_rev, compression_level, compression_threads, binary=True) as out2:
+        if read_index is not None:
+            return trim_indexed_pairs(*read_index, lookup, positions, out1, out2)
+        return trim_fastq_pairs(dedup_obj.fastq, dedup_obj.fastq2, lookup, positions, out1, out2)
+
+
+def _write_sample(job: tuple,
+                  results_dir: str,
+                  paired_out: bool,
+                  compression_level: int = default_compression_level,
+                  compression_threads: int = 1,
+                  checkpoint: CheckpointStore = None,
+                  memory_limit: int = None) -> dict:
+    """Writes the trimmed reads of a single sample into the results directory.
+
+    The reads are written under temporary names and renamed once complete, so the
+    results directory never holds a partly written file.
+
+    Args:
+        job (tuple): (sample tuple, sobj object, ItsPosition or PositionTable object, Profiler).
+        results_dir (str): The directory of the CasavaOneEightSingleLanePerSampleDirFmt result.
+        paired_out (bool): Declares if output files should be paired.
+        compression_level (int): The gzip compression level of the trimmed reads.
+        compression_threads (int): The number of threads compressing the output files, split
+            between the forward and reverse files of paired output.
+        checkpoint (CheckpointStore): Keeps the trimmed reads for reruns, optional.
+        memory_limit (int): The bytes the read mapping may hold in memory, None for no limit.
+
+    Returns:
+        (dict): A report with the Sample ID, its stage records and its read counts.
+
+    """
+    (sample_id, forward, reverse), sobj, its_pos, profiler = job
+    # Copy the original filename, that way we preserve all filename fields.
+    outputs = [os.path.join(results_dir, pathlib.Path(forward).name)]
+    if paired_out:
+        outputs.append(os.path.join(results_dir, pathlib.Path(reverse).name))
+    partials = [os.path.join(results_dir, "." + os.path.basename(output) + ".partial")
+                for output in outputs]
+    out_path_fwd = partials[0]
+    out_path_rev = partials[1] if paired_out else None
+    # Paired files are written together, so they share the sample's compression threads.
+    file_threads = max(1, compression_threads // len(outputs))
+    # Set when the read files were indexed as they were merged.
+    read_index = getattr(sobj, "read_index", None)
+    try:
+        with profiler.stage("write") as record:
+            if isinstance(sobj, StreamSample):
+                # Streamed samples trim straight from their reads.
+                dedup_obj = sobj
+                record["reads_in"] = sobj.n_reads
+            elif memory_limit:
+                # Map reads to their representatives within the memory ceiling.
+                dedup_obj = BoundedDedup(uc_file=sobj.uc_file,
+                                         seq_file=sobj.seq_file,
+                                         fastq=sobj.r1,
+                                         fastq2=sobj.fastq2,
+                                         memory_limit=memory_limit,
+                                         tempdir=sobj.tempdir,
+                                         read_index=read_index)
+                record["reads_in"] = len(dedup_obj.readmap)
+            else:
+                # Create deduplication object.
+                dedup_obj = itsxpress.Dedup(uc_file=sobj.uc_file,
+                                            rep_file=sobj.rep_file,
+                                            seq_file=sobj.seq_file,
+                                            fastq=sobj.r1,
+                                            fastq2=sobj.fastq2)
+                record["reads_in"] = len(dedup_obj.matchdict)
+            # Create trimmed sequences.
+            if isinstance(dedup_obj, itsxpress.Dedup):
+                written = _write_dedup(dedup_obj,
+                                       its_pos,
+                                       out_path_fwd=out_path_fwd,
+                                       out_path_rev=out_path_rev,
+                                       compression_level=compression_level,
+                                       compression_threads=file_threads,
+                                       read_index=read_index)
+            elif paired_out:
+                written = dedup_obj.create_paired_trimmed_seqs(out_path_fwd,
+                                                               out_path_rev,
+                                                               gzipped=True,
+                                                               itspos=its_pos,
+                                                               compresslevel=compression_level,
+                                                               threads=file_threads)
+            else:
+                written = dedup_obj.create_trimmed_seqs(out_path_fwd,
+                                                        gzipped=True,
+                                                        itspos=its_pos,
+                                                        compresslevel=compression_level,
+                                                        threads=file_threads)
+            record["reads_out"] = written
+            # Single end reads are first counted here, as they are mapped to their representatives.
+            profiler.counts.setdefault("reads_in", record["reads_in"])
+            profiler.counts.update(its_found=count_usable(its_pos), reads_out=written)
+            for partial_path, output in zip(partials, outputs):
+                os.replace(partial_path, output)
+            if checkpoint is not None:
+                checkpoint.save(sample_id, outputs, metadata={"reads_in": record["reads_in"],
+                                                              "reads_out": written,
+                                                              "stats": profiler.counts})
+    finally:
+        # Deleting the temp files, and any partly written reads if writing failed.
+        shutil.rmtree(sobj.tempdir, ignore_errors=True)
+        for partial_path in partials:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+    return {"sample_id": sample_id, "profile": profiler.records, "stats": profiler.counts}
+
+
+def _trim_sample(sample: tuple,
+                 results_dir: str,
+                 taxa: str,
+                 region: str,
+                 paired_in: bool,
+                 paired_out: bool,
+                 reversed_primers: bool,
+                 cluster_id: float,
+                 threads: int,
+                 cache_dir: str = None,
+                 cache_size: int = default_cache_size,
+                 index_file: str = None,
+                 stream: bool = False,
+                 hmmfile: str = None,
+                 compression_level: int = default_compression_level,
+                 compression_threads: int = 1,
+                 checkpoint: CheckpointStore = None,
+                 memory_limit: int = None,
+                 collapse_duplicates: bool = False,
+                 merger: PairMerger = None,
+                 validated: bool = False,
+                 workdir: str = None,
+                 stage_threads: dict = None,
+                 index_reads: bool = False) -> dict:
+    """Trims a single sample and writes its reads into the results directory.
+
+    Args:
+        sample (tuple): (sample id, forward reads path, reverse reads path or None).
+        results_dir (str): The directory of the CasavaOneEightSingleLanePerSampleDirFmt result.
+        taxa (str): The taxa to be used for the search.
+        region (str) : The region to be used for the search.
+        paired_in (bool): Declares if input files are paired.
+        paired_out (bool): Declares if output files should be paired.
+        reversed_primers (bool): Primers are in reverse orientation.
+        cluster_id (float):The percent identity for clustering reads, set to 1 for exact dereplication.
+        threads (int) : The number of threads the external tools may use for this sample.
+        cache_dir (str): The ITS position cache directory, or None for no cache.
+        cache_size (int): The maximum number of positions kept in the cache.
+        index_file (str): An ITS position index file, see _posindex, whose positions are used
+            before the cache and HMMSearch. None for no index.
+        stream (bool): Stream reads through dereplication without intermediate files.
+        hmmfile (str): The prepared models to search with, None for the full HMM file of the taxa.
+        compression_level (int): The gzip compression level of the trimmed reads.
+        compression_threads (int): The number of threads compressing the output files of a sample.
+        checkpoint (CheckpointStore): Keeps the trimmed reads for reruns, optional.
+        memory_limit (int): The bytes the read mapping may hold in memory, None for no limit.
+        collapse_duplicates (bool): Collapse identical reads before clustering.
+        merger (PairMerger): Merges paired reads in process instead of BBMerge, optional.
+        validated (bool): The reads were checked up front, skip the per-sample check.
+        workdir (str): The directory for temporary files, None for the system temporary directory.
+        stage_threads (dict): {stage: threads} for the merge, dereplicate and search stages,
+            in place of threads, optional.
+        index_reads (bool): Index the read files while they are merged, for paired output.
+
+    Returns:
+        (dict): A report with the Sample ID, its stage records and the cache hits and misses.
+
+    Raises:
+        ValueError1: hmmsearch error.
+
+    """
+    sobj, profiler = _prepare_sample(sample,
+                                     paired_in=paired_in,
+                                     paired_out=paired_out,
+                                     reversed_primers=reversed_primers,
+                                     cluster_id=cluster_id,
+                                     threads=threads,
+                                     stream=stream,
+                                     memory_limit=memory_limit,
+                                     collapse_duplicates=collapse_duplicates,
+                                     merger=merger,
+                                     validated=validated,
+                                     workdir=workdir,
+                                     stage_threads=stage_threads,
+                                     index_reads=index_reads)
+    its_pos, hits, misses = _locate_its(sobj.rep_file,
+                                        tempdir=sobj.tempdir,
+                                        taxa=taxa,
+                                        region=region,
+                                        threads=(stage_threads or {}).get("search", threads),
+                                        cache_dir=cache_dir,
+                                        cache_size=cache_size,
+                                        index_file=index_file,
+                                        profiler=profiler,
+                                        hmmfile=hmmfile)
+    report = _write_sample((sample, sobj, its_pos, profiler),
+                           results_dir=results_dir,
+                           paired_out=paired_out,
+                           compression_level=compression_level,
+                           compression_threads=compression_threads,
+                           checkpoint=checkpoint,
+                           memory_limit=memory_limit)
+    report.update(cache_hits=hits, cache_misses=misses)
+    return report
+
+
+def _locate_pooled(sobjs: list,
+                   taxa: str,
+                   region: str,
+                   threads: int,
+                   cache_dir: str = None,
+                   cache_size: int = default_cache_size,
+                   index_file: str = None,
+                   profiler: Profiler = None,
+                   hmmfile: str = None,
+                   workdir: str = None) -> tuple:
+    """Finds the ITS positions of the unique sequences of several samples with a single HMMSearch.
+
+    Args:
+        sobjs (list): The sobj objects of the samples, with their rep_file set.
+        taxa (str): The taxa to be used for the search.
+        region (str) : The region to be used for the search.
+        threads (int) : The number of threads for the search.
+        cache_dir (str): The ITS position cache directory, or None for no cache.
+        cache_size (int): The maximum number of positions kept in the cache.
+        index_file (str): An ITS position index file, see _posindex, whose positions are used
+            before the cache and HMMSearch. None for no index.
+        profiler (Profiler): Records the pool and search stages, optional.
+        hmmfile (str): The prepared models to search with, None for the full HMM file of the taxa.
+        workdir (str): The directory for temporary files, None for the system temporary directory.
+
+    Returns:
+        (tuple): (a PositionTable for each sample, the number of cache hits, the number of cache misses)
+
+    """
+    profiler = profiler or Profiler("pooled")
+    pool_dir = tempfile.mkdtemp(prefix='itsxpress_', dir=workdir)
+    try:
+        pooled_file = os.path.join(pool_dir, 'rep.fa')
+        with profiler.stage("pool"):
+            idmaps = pool_representatives([sobj.rep_file for sobj in sobjs],
+                                          pooled_file)
+        its_pos, hits, misses = _locate_its(pooled_file,
+                                            tempdir=pool_dir,
+                                            taxa=taxa,
+                                            region=region,
+                                            threads=threads,
+                                            cache_dir=cache_dir,
+                                            cache_size=cache_size,
+                                            index_file=index_file,
+                                            profiler=profiler,
+                                            hmmfile=hmmfile)
+        tables = split_positions(its_pos, idmaps)
+    finally:
+        shutil.rmtree(pool_dir)
+    return tables, hits, misses
+
+
+def _trim_batch(job: tuple,
+                results_dir: str,
+                taxa: str,
+                region: str,
+                paired_in: bool,
+                paired_out: bool,
+                reversed_primers: bool,
+                cluster_id: float,
+                cache_dir: str = None,
+                cache_size: int = default_cache_size,
+                index_file: str = None,
+                stream: bool = False,
+                hmmfile: str = None,
+                compression_level: int = default_compression_level,
+                compression_threads: int = 0,
+                checkpoint: CheckpointStore = None,
+                memory_limit: int = None,
+                collapse_duplicates: bool = False,
+                merger: PairMerger = None,
+                validated: bool = False,
+                workdir: str = None,
+                thread_plan: ThreadPlan = None,
+                index_reads: bool = False) -> list:
+    """Trims a job of the schedule, a single sample or a batch of small samples.
+
+    The samples of a batch are trimmed one after another in the same worker. Paired reads
+    are merged with a single BBMerge process, unless they are streamed, and the ITS is
+    found with a single HMMSearch over the pooled unique sequences.
+
+    Args:
+        job (tuple): (the sample tuples of the job, the threads the external tools may use).
+        results_dir (str): The directory of the CasavaOneEightSingleLanePerSampleDirFmt result.
+        taxa (str): The taxa to be used for the search.
+        region (str) : The region to be used for the search.
+        paired_in (bool): Declares if input files are paired.
+        paired_out (bool): Declares if output files should be paired.
+        reversed_primers (bool): Primers are in reverse orientation.
+        cluster_id (float):The percent identity for clustering reads, set to 1 for exact dereplication.
+        cache_dir (str): The ITS position cache directory, or None for no cache.
+        cache_size (int): The maximum number of positions kept in the cache.
+        index_file (str): An ITS position index file, see _posindex, whose positions are used
+            before the cache and HMMSearch. None for no index.
+        stream (bool): Stream reads through dereplication without intermediate files.
+        hmmfile (str): The prepared models to search with, None for the full HMM file of the taxa.
+        compression_level (int): The gzip compression level of the trimmed reads.
+        compression_threads (int): The number of threads compressing the output files of a sample,
+            0 uses the threads of the job.
+        checkpoint (CheckpointStore): Keeps the trimmed reads for reruns, optional.
+        memory_limit (int): The bytes the read mapping may hold in memory, None for no limit.
+        collapse_duplicates (bool): Collapse identical reads before clustering.
+        merger (PairMerger): Merges paired reads in process instead of BBMerge, optional.
+        validated (bool): The reads were checked up front, skip the per-sample check.
+        workdir (str): The directory for temporary files, None for the system temporary directory.
+        thread_plan (ThreadPlan): Sets the threads of each stage from the threads of the job, optional.
+        index_reads (bool): Index the read files while they are merged, for paired output.
+
+    Returns:
+        (list): A report for each sample, followed by a report for the batch search
+            when there is more than one sample.
+
+    """
+    samples, threads = job
+    compression_threads = compression_threads or threads
+    stage_threads = thread_plan.for_job(threads) if thread_plan is not None else {}
+    if len(samples) == 1:
+        return [_trim_sample(samples[0],
+                             results_dir=results_dir,
+                             taxa=taxa,
+                             region=region,
+                             paired_in=paired_in,
+                             paired_out=paired_out,
+                             reversed_primers=reversed_primers,
+                             cluster_id=cluster_id,
+                             threads=threads,
+                             cache_dir=cache_dir,
+                             cache_size=cache_size,
+                             index_file=index_file,
+                             stream=stream,
+                             hmmfile=hmmfile,
+                             compression_level=compression_level,
+                             compression_threads=compression_threads,
+                             checkpoint=checkpoint,
+                             memory_limit=memory_limit,
+                             collapse_duplicates=collapse_duplicates,
+                             merger=merger,
+                             validated=validated,
+                             workdir=workdir,
+                             stage_threads=stage_threads,
+                             index_reads=index_reads)]
+    batch_profiler = Profiler("batch:" + ",".join(sample[0] for sample in samples))
+    # Batches share one BBMerge process, the in-process merger has no start up to share.
+    batch_merge = paired_in and not stream and merger is None
+    profilers = [Profiler(sample[0]) for sample in samples]
+    sobjs = [_set_fastqs_and_check(fastq=forward,
+                                   fastq2=reverse if paired_in else None,
+                                   sample_id=sample_id,
+                                   single_end=not paired_in,
+                                   reversed_primers=reversed_primers,
+                                   threads=threads,
+                                   stream=stream,
+                                   paired_out=paired_out,
+                                   profiler=profiler,
+                                   memory_limit=memory_limit,
+                                   merge=not batch_merge,
+                                   merger=merger,
+                                   validated=validated,
+                                   workdir=workdir,
+                                   stage_threads=stage_threads,
+                                   index_reads=index_reads)
+             for (sample_id, forward, reverse), profiler in zip(samples, profilers)]
+    if batch_merge:
+        merge_dir = tempfile.mkdtemp(prefix='itsxpress_', dir=workdir)
+        try:
+            merge_threads = stage_threads.get("merge", threads)
+            with contextlib.ExitStack() as stack:
+                indexers = [stack.enter_context(PairIndexer(sobj.r1, sobj.fastq2, sobj.tempdir))
+                            for sobj in sobjs] if index_reads and paired_out else []
+                with batch_profiler.stage("merge", threads=merge_threads) as record:
+                    counts = merge_samples(sobjs, tempdir=merge_dir, threads=merge_threads)
+                    record["reads_in"] = sum(pairs for pairs, merged in counts)
+                    record["reads_out"] = sum(merged for pairs, merged in counts)
+            for sobj, indexer in zip(sobjs, indexers):
+                sobj.read_index = indexer.indexes
+            for profiler, (pairs, merged) in zip(profilers, counts):
+                profiler.counts.update(reads_in=pairs, merged=merged)
+        finally:
+            shutil.rmtree(merge_dir)
+    for sobj, profiler in zip(sobjs, profilers):
+        _dereplicate_sample(sobj,
+                            profiler=profiler,
+                            cluster_id=cluster_id,
+                            threads=stage_threads.get("dereplicate", threads),
+                            collapse_duplicates=collapse_duplicates)
+    tables, hits, misses = _locate_pooled(sobjs,
+                                          taxa=taxa,
+                                          region=region,
+                                          threads=stage_threads.get("search", threads),
+                                          cache_dir=cache_dir,
+                                          cache_size=cache_size,
+                                          index_file=index_file,
+                                          profiler=batch_profiler,
+                                          hmmfile=hmmfile,
+                                          workdir=workdir)
+    reports = [_write_sample(sample_job,
+                             results_dir=results_dir,
+                             paired_out=paired_out,
+                             compression_level=compression_level,
+                             compression_threads=compression_threads,
+                             checkpoint=checkpoint,
+                             memory_limit=memory_limit)
+               for sample_job in zip(samples, sobjs, tables, profilers)]
+    reports.append({"sample_id": None,
+                    "profile": batch_profiler.records,
+                    "cache_hits": hits,
+                    "cache_misses": misses})
+    return reports
+
+
+def _trim_pooled(sample_list: list,
+                 results_dir: str,
+                 taxa: str,
+                 region: str,
+                 paired_in: bool,
+                 paired_out: bool,
+                 reversed_primers: bool,
+                 cluster_id: float,
+                 threads: int,
+                 workers: int,
+                 sample_threads: int,
+                 cache_dir: str = None,
+                 cache_size: int = default_cache_size,
+                 index_file: str = None,
+                 stream: bool = False,
+                 hmmfile: str = None,
+                 compression_level: int = default_compression_level,
+                 compression_threads: int = 1,
+                 checkpoint: CheckpointStore = None,
+                 memory_limit: int = None,
+                 collapse_duplicates: bool = False,
+                 merger: PairMerger = None,
+                 validated: bool = False,
+                 workdir: str = None,
+                 stage_threads: dict = None,
+                 index_reads: bool = False) -> list:
+    """Trims all samples with a single HMMSearch over their pooled unique sequences.
+
+    Args:
+        sample_list (list): The sample tuples to trim.
+        results_dir (str): The directory of the CasavaOneEightSingleLanePerSampleDirFmt result.
+        taxa (str): The taxa to be used for the search.
+        region (str) : The region to be used for the search.
+        paired_in (bool): Declares if input files are paired.
+        paired_out (bool): Declares if output files should be paired.
+        reversed_primers (bool): Primers are in reverse orientation.
+        cluster_id (float):The percent identity for clustering reads, set to 1 for exact dereplication.
+        threads (int) : The number of threads for the pooled search.
+        workers (int): The number of samples to process at once.
+        sample_threads (int): The number of threads for each concurrent sample.
+        cache_dir (str): The ITS position cache directory, or None for no cache.
+        cache_size (int): The maximum number of positions kept in the cache.
+        index_file (str): An ITS position index file, see _posindex, whose positions are used
+            before the cache and HMMSearch. None for no index.
+        stream (bool): Stream reads through dereplication without intermediate files.
+        hmmfile (str): The prepared models to search with, None for the full HMM file of the taxa.
+        compression_level (int): The gzip compression level of the trimmed reads.
+        compression_threads (int): The number of threads compressing the output files of a sample.
+        checkpoint (CheckpointStore): Keeps the trimmed reads for reruns, optional.
+        memory_limit (int): The bytes the read mapping may hold in memory, None for no limit.
+        collapse_duplicates (bool): Collapse identical reads before clustering.
+        merger (PairMerger): Merges paired reads in process instead of BBMerge, optional.
+        validated (bool): The reads were checked up front, skip the per-sample check.
+        workdir (str): The directory for temporary files, None for the system temporary directory.
+        stage_threads (dict): {stage: threads} for the merge and dereplicate stages of each
+            sample, in place of sample_threads, optional.
+        index_reads (bool): Index the read files while they are merged, for paired output.
+
+    Returns:
+        (list): A report for each sample, followed by a report for the pooled search
+            with the cache hits and misses.
+
+    """
+    prepare_func = partial(_prepare_sample,
+                           paired_in=paired_in,
+                           paired_out=paired_out,
+                           reversed_primers=reversed_primers,
+                           cluster_id=cluster_id,
+                           threads=sample_threads,
+                           stream=stream,
+                           memory_limit=memory_limit,
+                           collapse_duplicates=collapse_duplicates,
+                           merger=merger,
+                           validated=validated,
+                           workdir=workdir,
+                           stage_threads=stage_threads,
+                           index_reads=index_reads)
+    # The largest samples start first, the results come back in manifest order.
+    order = sorted(range(len(sample_list)), key=lambda index: -sample_size(sample_list[index]))
+    prepared = [None] * len(sample_list)
+    for index, result in zip(order, run_samples(prepare_func, [sample_list[index] for index in order], workers)):
+        prepared[index] = result
+    sobjs, profilers = zip(*prepared)
+    pool_profiler = Profiler("pooled")
+    tables, hits, misses = _locate_pooled(sobjs,
+                                          taxa=taxa,
+                                          region=region,
+                                          threads=threads,
+                                          cache_dir=cache_dir,
+                                          cache_size=cache_size,
+                                          index_file=index_file,
+                                          profiler=pool_profiler,
+                                          hmmfile=hmmfile,
+                                          workdir=workdir)
+    write_func = partial(_write_sample,
+                         results_dir=results_dir,
+                         paired_out=paired_out,
+                         compression_level=compression_level,
+                         compression_threads=compression_threads,
+                         checkpoint=checkpoint,
+                         memory_limit=memory_limit)
+    reports = run_samples(write_func, list(zip(sample_list, sobjs, tables, profilers)), workers)
+    reports.append({"sample_id": None,
+                    "profile": pool_profiler.records,
+                    "cache_hits": hits,
+                    "cache_misses": misses})
+    return reports
+
+
+def _trim_chunked(sample: tuple,
+                  results_dir: str,
+                  taxa: str,
+                  region: str,
+                  paired_in: bool,
+                  paired_out: bool,
+                  reversed_primers: bool,
+                  cluster_id: float,
+                  threads: int,
+                  chunk_reads: int = default_chunk_reads,
+                  cache_dir: str = None,
+                  cache_size: int = default_cache_size,
+                  index_file: str = None,
+                  stream: bool = False,
+                  hmmfile: str = None,
+                  compression_level: int = default_compression_level,
+                  compression_threads: int = 0,
+                  checkpoint: CheckpointStore = None,
+                  memory_limit: int = None,
+                  collapse_duplicates: bool = False,
+                  merger: PairMerger = None,
+                  validated: bool = False,
+                  workdir: str = None,
+                  index_reads: bool = False) -> list:
+    """Trims a single large sample by splitting it into chunks that are trimmed in parallel.
+
+    The chunks are merged and dereplicated concurrently, their unique sequences are pooled
+    for a single HMMSearch, and their trimmed reads are joined in read order. With a
+    cluster_id below 1 each chunk is clustered on its own.
+
+    Args:
+        sample (tuple): (sample id, forward reads path, reverse reads path or None).
+        results_dir (str): The directory of the CasavaOneEightSingleLanePerSampleDirFmt result.
+        taxa (str): The taxa to be used for the search.
+        region (str) : The region to be used for the search.
+        paired_in (bool): Declares if input files are paired.
+        paired_out (bool): Declares if output files should be paired.
+        reversed_primers (bool): Primers are in reverse orientation.
+        cluster_id (float):The percent identity for clustering reads, set to 1 for exact dereplication.
+        threads (int) : The number of threads shared by the chunks, and used by the pooled search.
+        chunk_reads (int): The number of reads, or read pairs, in each chunk.
+        cache_dir (str): The ITS position cache directory, or None for no cache.
+        cache_size (int): The maximum number of positions kept in the cache.
+        index_file (str): An ITS position index file, see _posindex, whose positions are used
+            before the cache and HMMSearch. None for no index.
+        stream (bool): Stream reads through dereplication without intermediate files.
+        hmmfile (str): The prepared models to search with, None for the full HMM file of the taxa.
+        compression_level (int): The gzip compression level of the trimmed reads.
+        compression_threads (int): The number of threads compressing the output files of a sample,
+            0 uses the threads of each chunk.
+        checkpoint (CheckpointStore): Keeps the trimmed reads for reruns, optional.
+        memory_limit (int): The bytes the read mapping may hold in memory, None for no limit.
+        collapse_duplicates (bool): Collapse identical reads before clustering.
+        merger (PairMerger): Merges paired reads in process instead of BBMerge, optional.
+        validated (bool): The reads were checked up front, skip the per-chunk check.
+        workdir (str): The directory for temporary files, None for the system temporary directory.
+        index_reads (bool): Index the read files of each chunk while they are merged, for paired output.
+
+    Returns:
+        (list): A report for the sample, followed by a report for each chunk.
+
+    """
+    sample_id, forward, reverse = sample
+    profiler = Profiler(sample_id)
+    chunk_dir = tempfile.mkdtemp(prefix='chunks_', dir=workdir)
+    try:
+        with profiler.stage("split") as record:
+            chunks = split_sample(sample, chunk_dir, chunk_reads=chunk_reads)
+            record["reads_out"] = len(chunks)
+        workers, chunk_threads = plan_threads(threads=threads, n_samples=len(chunks))
+        prepared = run_samples(partial(_prepare_sample,
+                                       paired_in=paired_in,
+                                       paired_out=paired_out,
+                                       reversed_primers=reversed_primers,
+                                       cluster_id=cluster_id,
+                                       threads=chunk_threads,
+                                       stream=stream,
+                                       memory_limit=memory_limit,
+                                       collapse_duplicates=collapse_duplicates,
+                                       merger=merger,
+                                       validated=validated,
+                                       workdir=chunk_dir,
+                                       index_reads=index_reads),
+                               chunks, workers)
+        sobjs, profilers = zip(*prepared)
+        tables, hits, misses = _locate_pooled(sobjs,
+                                              taxa=taxa,
+                                              region=region,
+                                              threads=threads,
+                                              cache_dir=cache_dir,
+                                              cache_size=cache_size,
+                                              index_file=index_file,
+                                              profiler=profiler,
+                                              hmmfile=hmmfile,
+                                              workdir=chunk_dir)
+        chunk_results = os.path.join(chunk_dir, 'trimmed')
+        os.makedirs(chunk_results)
+        chunk_reports = run_samples(partial(_write_sample,
+                                            results_dir=chunk_results,
+                                            paired_out=paired_out,
+                                            compression_level=compression_level,
+                                            compression_threads=compression_threads or chunk_threads,
+                                            memory_limit=memory_limit),
+                                    list(zip(chunks, sobjs, tables, profilers)),
+                                    workers)
+        # Copy the original filename, that way we preserve all filename fields.
+        outputs = [os.path.join(results_dir, pathlib.Path(forward).name)]
+        chunk_files = [[os.path.join(chunk_results, pathlib.Path(chunk[1]).name) for chunk in chunks]]
+        if paired_out:
+            outputs.append(os.path.join(results_dir, pathlib.Path(reverse).name))
+            chunk_files.append([os.path.join(chunk_results, pathlib.Path(chunk[2]).name) for chunk in chunks])
+        with profiler.stage("join") as record:
+            for output, paths in zip(outputs, chunk_files):
+                # Gzip files joined end to end are one gzip file, read in chunk order.
+                partial_path = os.path.join(results_dir, "." + os.path.basename(output) + ".partial")
+                join_files(paths, partial_path)
+                os.replace(partial_path, output)
+            record["reads_in"] = len(chunks)
+        counts = combine_counts([report["stats"] for report in chunk_reports])
+        searched = [record for record in profiler.records if record["stage"] == "search"]
+        # The unique sequences and ITS found are those of the pooled search, not the sum over the chunks.
+        counts.update(unique=searched[0]["reads_in"], its_found=searched[0]["reads_out"])
+        profiler.counts = counts
+        if checkpoint is not None:
+            checkpoint.save(sample_id, outputs, metadata={"reads_in": counts.get("reads_in"),
+                                                          "reads_out": counts.get("reads_out"),
+                                                          "stats": counts})
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+    reports = [{"sample_id": sample_id, "profile": profiler.records, "stats": counts,
+                "cache_hits": hits, "cache_misses": misses}]
+    # The chunk records keep their chunk ids, the stats table has a row for the sample only.
+    reports += [{"sample_id": None, "profile": report["profile"]} for report in chunk_reports]
+    return reports
+
+
+def _trim_pipelined(sample_list: list,
+                    results_dir: str,
+                    taxa: str,
+                    region: str,
+                    paired_in: bool,
+                    paired_out: bool,
+                    reversed_primers: bool,
+                    cluster_id: float,
+                    threads: int,
+                    stage_workers: dict = None,
+                    cache_dir: str = None,
+                    cache_size: int = default_cache_size,
+                    index_file: str = None,
+                    stream: bool = False,
+                    hmmfile: str = None,
+                    compression_level: int = default_compression_level,
+                    compression_threads: int = 0,
+                    checkpoint: CheckpointStore = None,
+                    memory_limit: int = None,
+                    collapse_duplicates: bool = False,
+                    merger: PairMerger = None,
+                    validated: bool = False,
+                    workdir: str = None,
+                    stage_threads: dict = None,
+                    index_reads: bool = False,
+                    scratch_space: int = None,
+                    memory_space: int = None) -> list:
+    """Trims samples with their merge, dereplicate, search and write stages overlapping.
+
+    Each stage runs on its own worker threads, see _pipeline, so the stages of
+    different samples run at the same time. Samples enter the pipeline in the order
+    given while the scratch space and memory estimated for the samples in flight fit.
+
+    Args:
+        sample_list (list): The (sample id, forward reads path, reverse reads path or None) tuples.
+        results_dir (str): The directory of the CasavaOneEightSingleLanePerSampleDirFmt result.
+        taxa (str): The taxa to be used for the search.
+        region (str) : The region to be used for the search.
+        paired_in (bool): Declares if input files are paired.
+        paired_out (bool): Declares if output files should be paired.
+        reversed_primers (bool): Primers are in reverse orientation.
+        cluster_id (float):The percent identity for clustering reads, set to 1 for exact dereplication.
+        threads (int) : The number of threads of the run, split between the stage workers.
+        stage_workers (dict): {stage: workers} for the stages in _pipeline.PIPELINE_STAGES,
+            one worker for each stage not given.
+        cache_dir (str): The ITS position cache directory, or None for no cache.
+        cache_size (int): The maximum number of positions kept in the cache.
+        index_file (str): An ITS position index file, see _posindex, whose positions are used
+            before the cache and HMMSearch. None for no index.
+        stream (bool): Stream reads through dereplication without intermediate files.
+        hmmfile (str): The prepared models to search with, None for the full HMM file of the taxa.
+        compression_level (int): The gzip compression level of the trimmed reads.
+        compression_threads (int): The number of threads compressing the output files of a sample,
+            0 uses the threads of each stage worker.
+        checkpoint (CheckpointStore): Keeps the trimmed reads for reruns, optional.
+        memory_limit (int): The bytes the read mapping may hold in memory, None for no limit.
+        collapse_duplicates (bool): Collapse identical reads before clustering.
+        merger (PairMerger): Merges paired reads in process instead of BBMerge, optional.
+        validated (bool): The reads were checked up front, skip the per-sample check.
+        workdir (str): The directory for temporary files, None for the system temporary directory.
+        stage_threads (dict): {stage: threads} for the merge, dereplicate and search stages,
+            optional. The threads are split evenly between the stage workers if not given.
+        index_reads (bool): Index the read files while they are merged, for paired output.
+        scratch_space (int): The scratch bytes the samples in flight may take, None for no limit.
+        memory_space (int): The bytes of memory the samples in flight may take, None for no limit.
+
+    Returns:
+        (list): A report for each sample, in the order of sample_list.
+
+    """
+    stage_workers = dict({stage: 1 for stage in PIPELINE_STAGES}, **(stage_workers or {}))
+    worker_threads = max(1, threads // sum(stage_workers.values()))
+    if stage_threads is None:
+        stage_threads = {stage: worker_threads for stage in TUNED_STAGES}
+
+    def merge(sample):
+        sobj, profiler = _merge_sample(sample,
+                                       paired_in=paired_in,
+                                       paired_out=paired_out,
+                                       reversed_primers=reversed_primers,
+                                       threads=worker_threads,
+                                       stream=stream,
+                                       memory_limit=memory_limit,
+                                       merger=merger,
+                                       validated=validated,
+                                       workdir=workdir,
+                                       stage_threads=stage_threads,
+                                       index_reads=index_reads)
+        return sample, sobj, profiler
+
+    def dereplicate(job):
+        sample, sobj, profiler = job
+        _dereplicate_sample(sobj,
+                            profiler=profiler,
+                            cluster_id=cluster_id,
+                            threads=stage_threads.get("dereplicate", worker_threads),
+                            collapse_duplicates=collapse_duplicates)
+        return job
+
+    def search(job):
+        sample, sobj, profiler = job
+        its_pos, hits, misses = _locate_its(sobj.rep_file,
+                                            tempdir=sobj.tempdir,
+                                            taxa=taxa,
+                                            region=region,
+                                            threads=stage_threads.get("search", worker_threads),
+                                            cache_dir=cache_dir,
+                                            cache_size=cache_size,
+                                            index_file=index_file,
+                                            profiler=profiler,
+                                            hmmfile=hmmfile)
+        return (sample, sobj, its_pos, profiler), hits, misses
+
+    def write(job):
+        job, hits, misses = job
+        report = _write_sample(job,
+                               results_dir=results_dir,
+                               paired_out=paired_out,
+                               compression_level=compression_level,
+                               compression_threads=compression_threads or worker_threads,
+                               checkpoint=checkpoint,
+                               memory_limit=memory_limit)
+        report.update(cache_hits=hits, cache_misses=misses)
+        # The CPU and I/O figures of each stage include the other samples in flight.
+        for record in report["profile"]:
+            record["pipelined"] = True
+        return report
+
+    funcs = {"merge": merge, "dereplicate": dereplicate, "search": search, "write": write}
+    pipeline = Pipeline([Stage(stage, funcs[stage], workers=stage_workers[stage]) for stage in PIPELINE_STAGES],
+                        budgets=[(Budget(scratch_space),
+                                  lambda sample: scratch_needed([sample_size(sample)], 1, index_reads=index_reads)),
+                                 (Budget(memory_space),
+                                  lambda sample: sample_memory(sample_size(sample), memory_limit))])
+    return pipeline.run(sample_list)
+
+
+def _validate_samples(sample_list: list, cache_dir: str, workers: int) -> dict:
+    """Checks the read files of every sample before any sample is trimmed.
+
+    Args:
+        sample_list (list): The sample tuples to check.
+        cache_dir (str): The cache directory remembering samples that passed, or None.
+        workers (int): The number of worker processes.
+
+    Returns:
+        (dict): A report with the validate stage record.
+
+    Raises:
+        ValueError: One or more samples have invalid or mismatched read files.
+
+    """
+    profiler = Profiler("manifest")
+    with profiler.stage("validate") as record:
+        results = run_samples(partial(check_sample, cache_dir=cache_dir), sample_list, workers)
+        record["reads_in"] = len(sample_list)
+    problems = ["{}: {}".format(sample[0], "; ".join(errors))
+                for sample, errors in zip(sample_list, results) if errors]
+    if problems:
+        raise ValueError("There is a problem with the fastq file(s) of {} sample(s):\n{}".format(
+            len(problems), "\n".join(problems)))
+    return {"sample_id": None, "profile": profiler.records}
+
+
+def _manifest_order(sample_list: list):
+    """Returns a sort key putting sample reports in manifest order, with batch reports last."""
+    position = {sample[0]: index for index, sample in enumerate(sample_list)}
+    return lambda report: position.get(report["sample_id"], len(position))
+
+
 # The ITSxpress handling
 def main(per_sample_sequences,
          threads: int,
@@ -162,7 +1393,31 @@ def main(per_sample_sequences,
          paired_in: bool,
          paired_out: bool,
          reversed_primers: bool,
-         cluster_id: float) -> CasavaOneEightSingleLanePerSampleDirFmt:
+         cluster_id: float,
+         sample_parallelism: int = 0,
+         pool_samples: bool = False,
+         cache_dir: str = None,
+         cache_size: int = default_cache_size,
+         stream: bool = False,
+         profile_file: str = None,
+         profile_hook=None,
+         compression_level: int = default_compression_level,
+         compression_threads: int = 0,
+         checkpoint_dir: str = None,
+         memory_limit: int = 0,
+         collapse_duplicates: bool = False,
+         native_merge: bool = False,
+         merge_min_overlap: int = default_min_overlap,
+         merge_max_mismatch_rate: float = default_max_mismatch_rate,
+         scratch_dir: str = None,
+         auto_threads: bool = False,
+         tuning_profile: str = None,
+         index_reads: bool = False,
+         chunk_threshold: int = 0,
+         chunk_reads: int = default_chunk_reads,
+         pipeline: bool = False,
+         stage_workers: str = None,
+         position_index: ITSPositionIndexDirFmt = None) -> tuple:
     """The main communication between the plugin and the ITSxpress program.
 
     Args:
@@ -174,13 +1429,59 @@ def main(per_sample_sequences,
         paired_in (bool): Declares if input files are paired.
         paired_out (bool): Declares if output files should be paired.
         cluster_id (float):The percent identity for clustering reads, set to 1 for exact dereplication.
+        sample_parallelism (int): The number of samples to trim at once, 0 splits
+            the threads between samples automatically.
+        pool_samples (bool): Run HMMSearch once on the unique sequences of all samples.
+        cache_dir (str): The ITS position cache directory, or None for no cache. The
+            prepared HMM models are kept there too.
+        cache_size (int): The maximum number of positions kept in the cache.
+        stream (bool): Stream reads through dereplication and trimming without
+            writing merged or dereplicated intermediate files.
+        profile_file (str): Write the per-stage records to this .json or .tsv file.
+        profile_hook (callable): Called with each per-stage record, optional.
+        compression_level (int): The gzip compression level of the trimmed reads, 1 to 9.
+        compression_threads (int): The number of threads compressing the output files of a sample,
+            0 uses the threads of each sample.
+        checkpoint_dir (str): Keep the trimmed reads of each finished sample in this directory,
+            and reuse them instead of trimming the sample again. None for no checkpoints.
+        memory_limit (int): The MiB the read to representative mapping of each sample may hold
+            in memory before it is spilled to disk, 0 for no limit.
+        collapse_duplicates (bool): Collapse identical reads with their abundances before
+            clustering, so Vsearch only clusters unique sequences. Only used when cluster_id is below 1.
+        native_merge (bool): Merge paired reads in process instead of with BBMerge.
+        merge_min_overlap (int): The shortest overlap accepted by the in-process merger.
+        merge_max_mismatch_rate (float): The highest fraction of mismatches the in-process
+            merger accepts in an overlap.
+        scratch_dir (str): The directory for the run's temporary files, such as /dev/shm or a
+            local disk. None uses the system temporary directory.
+        auto_threads (bool): Pick the samples run at once and the threads of the merge,
+            dereplicate and search stages from how each stage scales, in place of sample_parallelism.
+            The scaling is measured on the largest sample, trimmed first with every thread,
+            unless tuning_profile is given.
+        tuning_profile (str): A profile_file of an earlier run on this machine to measure the
+            scaling from, used with auto_threads.
+        index_reads (bool): Decompress and index the read files of each sample while its pairs
+            are merged, so unmerged output gathers the kept pairs from the index instead of
+            reading both files again. Only used when paired_out is set.
+        chunk_threshold (int): Samples whose read files are larger than this many MiB are split
+            into chunks of chunk_reads reads that are trimmed in parallel, 0 never splits samples.
+        chunk_reads (int): The number of reads, or read pairs, in each chunk of a split sample.
+        pipeline (bool): Run the merge, dereplicate, search and write stages of different
+            samples at the same time, see _pipeline. Not with pool_samples.
+        stage_workers (str): The workers of each pipeline stage, such as "merge=2,search=1",
+            one for each stage not given.
+        position_index (ITSPositionIndexDirFmt): An ITS position index, whose positions are used
+            before the cache and HMMSearch. None for no index.
 
     Returns:
-        (CasavaOneEightSingleLanePerSampleDirFmt): A catch-all output type for
-        both single and paired-end reads.
+        (tuple): (CasavaOneEightSingleLanePerSampleDirFmt, a catch-all output type for
+        both single and paired-end reads, pd.DataFrame of the read counts and stage
+        throughput of each sample, see _stats.stats_table)
 
     Raises:
         ValueError1: hmmsearch error.
+        ValueError: Invalid or mismatched read files, found before any sample is trimmed,
+            or pipeline is combined with pool_samples.
 
     """
     # Setting the taxa
@@ -188,59 +1489,298 @@ def main(per_sample_sequences,
     samples = per_sample_sequences.manifest.view(pd.DataFrame)
     # Creating result dir
     results = CasavaOneEightSingleLanePerSampleDirFmt()
-    # Running the for loop for each sample
-    for sample in samples.itertuples():
-        # writing fastqs and their attributes and checking the files
-        sobj = _set_fastqs_and_check(
-            fastq=sample.forward,
-            fastq2=sample.reverse if paired_in else None,
-            sample_id=sample.Index,
-            single_end=False if paired_in else True,
-            reversed_primers=reversed_primers,
-            threads=threads)
-        # Deduplicate
-        if math.isclose(cluster_id, 1,rel_tol=1e-05):
-            sobj.deduplicate(threads=threads)
-        else:
-            sobj.cluster(threads=threads, cluster_id=cluster_id)
-        try:
-            # HMMSearch for ITS regions
-            hmmfile = os.path.join(ROOT_DIR, "ITSx_db", "HMMs", taxa_dict[taxa])
-            sobj._search(hmmfile=hmmfile, threads=threads)
-        except (ModuleNotFoundError,
-                FileNotFoundError,
-                NotADirectoryError):
+    # Plain tuples so the samples can be sent to worker processes.
+    sample_list = [(sample.Index,
+                    sample.forward,
+                    sample.reverse if paired_in else None)
+                   for sample in samples.itertuples()]
+    manifest = sample_list
+    workers, sample_threads = plan_threads(threads=threads,
+                                           n_samples=len(sample_list),
+                                           sample_parallelism=sample_parallelism)
+    memory_limit = memory_limit * 1024 * 1024 if memory_limit else None
+    merger = None
+    if native_merge and paired_in:
+        merger = PairMerger(min_overlap=merge_min_overlap,
+                            max_mismatch_rate=merge_max_mismatch_rate)
+    checkpoint = None
+    reports = []
+    if checkpoint_dir is not None:
+        params = {"taxa": taxa,
+                  "region": region,
+                  "cluster_id": cluster_id,
+                  "paired_in": paired_in,
+                  "paired_out": paired_out,
+                  "reversed_primers": reversed_primers,
+                  # Both cluster the unique sequences, weighted by abundance.
+                  "two_tier": (stream or collapse_duplicates)
+                  and not math.isclose(cluster_id, 1, rel_tol=1e-05),
+                  "hmm": hmm_checksum(_hmm_file(taxa))}
+        if merger is not None:
+            # Only added for the in-process merger, so BBMerge checkpoints keep their keys.
+            params["merger"] = [merger.min_overlap, merger.max_mismatch_rate]
+        checkpoint = CheckpointStore(checkpoint_dir, params=params)
+        restore_func = partial(checkpoint.restore,
+                               results_dir=str(results),
+                               paired_out=paired_out)
+        restored = run_samples(restore_func, sample_list, workers)
+        checkpoint.keys = {sample[0]: key for sample, (key, done) in zip(sample_list, restored)}
+        reports = [{"sample_id": sample[0], "profile": [], "restored": True,
+                    "stats": checkpoint.metadata(sample[0]).get("stats", {})}
+                   for sample, (key, done) in zip(sample_list, restored) if done]
+        sample_list = [sample for sample, (key, done) in zip(sample_list, restored) if not done]
+        logging.info("Checkpoints: {} samples restored, {} to trim".format(len(reports), len(sample_list)))
+    index_file = str(position_index.path / 'positions.tsv') if position_index is not None else None
+    # A mistyped stage fails here, before any sample is read.
+    pipeline_workers = parse_stage_workers(stage_workers) if pipeline else None
+    if pipeline and pool_samples:
+        raise ValueError("pipeline and pool_samples cannot be used together, pooled samples share one HMMSearch")
+    # Bad samples fail here, before any sample is trimmed.
+    if sample_list:
+        reports.append(_validate_samples(sample_list, cache_dir=cache_dir, workers=workers))
+    # Every temporary file of the run is made in one workspace, removed even when the run fails.
+    with Workspace(scratch_dir) as workspace:
+        sizes = [sample_size(sample) for sample in sample_list]
+        index_reads = index_reads and paired_out
+        workspace.check_space(scratch_needed(sizes, workers, index_reads=index_reads,
+                                             chunk_threshold=chunk_threshold * 1024 * 1024))
+        # The models of the region are prepared once, and kept with the cache if there is one.
+        model_dir = (os.path.join(cache_dir, "models") if cache_dir is not None
+                     else workspace.mkdtemp(prefix='models_'))
+        hmmfile = prepare_models(_hmm_file(taxa), region=region, model_dir=model_dir)
+        trim_func = partial(_trim_batch,
+                            results_dir=str(results),
+                            taxa=taxa,
+                            region=region,
+                            paired_in=paired_in,
+                            paired_out=paired_out,
+                            reversed_primers=reversed_primers,
+                            cluster_id=cluster_id,
+                            cache_dir=cache_dir,
+                            cache_size=cache_size,
+                            index_file=index_file,
+                            stream=stream,
+                            hmmfile=hmmfile,
+                            compression_level=compression_level,
+                            compression_threads=compression_threads,
+                            checkpoint=checkpoint,
+                            memory_limit=memory_limit,
+                            collapse_duplicates=collapse_duplicates,
+                            merger=merger,
+                            validated=True,
+                            workdir=workspace.root,
+                            index_reads=index_reads)
+        if chunk_threshold:
+            # Each large sample is trimmed in chunks with every thread, before the other samples.
+            large = [index for index, size in enumerate(sizes) if size > chunk_threshold * 1024 * 1024]
+            for index in large:
+                reports += _trim_chunked(sample_list[index],
+                                         results_dir=str(results),
+                                         taxa=taxa,
+                                         region=region,
+                                         paired_in=paired_in,
+                                         paired_out=paired_out,
+                                         reversed_primers=reversed_primers,
+                                         cluster_id=cluster_id,
+                                         threads=threads,
+                                         chunk_reads=chunk_reads,
+                                         cache_dir=cache_dir,
+                                         cache_size=cache_size,
+                                         index_file=index_file,
+                                         stream=stream,
+                                         hmmfile=hmmfile,
+                                         compression_level=compression_level,
+                                         compression_threads=compression_threads,
+                                         checkpoint=checkpoint,
+                                         memory_limit=memory_limit,
+                                         collapse_duplicates=collapse_duplicates,
+                                         merger=merger,
+                                         validated=True,
+                                         workdir=workspace.root,
+                                         index_reads=index_reads)
+            sample_list = [sample for index, sample in enumerate(sample_list) if index not in large]
+            sizes = [size for index, size in enumerate(sizes) if index not in large]
+        thread_plan = None
+        if auto_threads and (tuning_profile is not None or len(sample_list) > 1):
+            if tuning_profile is not None:
+                records = read_profile(tuning_profile)
+                source = tuning_profile
+            else:
+                # The largest sample is trimmed first with every thread, and its stages measured.
+                first = max(range(len(sample_list)), key=lambda index: sizes[index])
+                calibration = trim_func(([sample_list[first]], threads))
+                reports += calibration
+                records = [record for report in calibration for record in report["profile"]]
+                source = sample_list[first][0]
+                sample_list = sample_list[:first] + sample_list[first + 1:]
+                sizes = sizes[:first] + sizes[first + 1:]
+            thread_plan = plan_stages(calibrate(records), threads=threads, n_samples=len(sample_list))
+            workers = thread_plan.workers
+            sample_threads = max(1, threads // workers)
+            logging.info("Thread plan: {}, calibrated on {}".format(thread_plan.describe(), source))
+        # Each sample writes to its own file names, so the result is the same
+        # whatever order the samples finish in.
+        if pool_samples and sample_list:
+            reports += _trim_pooled(sample_list,
+                                    results_dir=str(results),
+                                    taxa=taxa,
+                                    region=region,
+                                    paired_in=paired_in,
+                                    paired_out=paired_out,
+                                    reversed_primers=reversed_primers,
+                                    cluster_id=cluster_id,
+                                    threads=threads,
+                                    workers=workers,
+                                    sample_threads=sample_threads,
+                                    cache_dir=cache_dir,
+                                    cache_size=cache_size,
+                                    index_file=index_file,
+                                    stream=stream,
+                                    hmmfile=hmmfile,
+                                    compression_level=compression_level,
+                                    compression_threads=compression_threads or sample_threads,
+                                    checkpoint=checkpoint,
+                                    memory_limit=memory_limit,
+                                    collapse_duplicates=collapse_duplicates,
+                                    merger=merger,
+                                    validated=True,
+                                    workdir=workspace.root,
+                                    stage_threads=thread_plan.for_job(sample_threads) if thread_plan else None,
+                                    index_reads=index_reads)
+        elif pipeline and sample_list:
+            # Samples go through in manifest order, as many at once as scratch space and memory allow.
+            logging.info("Pipeline workers per stage: {}".format(
+                ", ".join("{} {}".format(stage, pipeline_workers[stage]) for stage in PIPELINE_STAGES)))
+            reports += _trim_pipelined(sample_list,
+                                       results_dir=str(results),
+                                       taxa=taxa,
+                                       region=region,
+                                       paired_in=paired_in,
+                                       paired_out=paired_out,
+                                       reversed_primers=reversed_primers,
+                                       cluster_id=cluster_id,
+                                       threads=threads,
+                                       stage_workers=pipeline_workers,
+                                       cache_dir=cache_dir,
+                                       cache_size=cache_size,
+                                       index_file=index_file,
+                                       stream=stream,
+                                       hmmfile=hmmfile,
+                                       compression_level=compression_level,
+                                       compression_threads=compression_threads,
+                                       checkpoint=checkpoint,
+                                       memory_limit=memory_limit,
+                                       collapse_duplicates=collapse_duplicates,
+                                       merger=merger,
+                                       validated=True,
+                                       workdir=workspace.root,
+                                       stage_threads=thread_plan.stage_threads if thread_plan else None,
+                                       index_reads=index_reads,
+                                       scratch_space=workspace.free_space(),
+                                       memory_space=available_memory())
+        elif sample_list:
+            # The largest samples start first with more threads, small samples are batched.
+            jobs = plan_jobs(sizes,
+                             threads=threads,
+                             workers=workers)
+            job_reports = run_samples(partial(trim_func, thread_plan=thread_plan),
+                                      [([sample_list[index] for index in indices], job_threads)
+                                       for indices, job_threads in jobs],
+                                      workers)
+            reports += sorted([report for job_report in job_reports for report in job_report],
+                              key=_manifest_order(sample_list))
+    if cache_dir is not None or index_file is not None:
+        logging.info("ITS position {}: {} hits, {} misses".format(
+            "cache" if index_file is None else "index" if cache_dir is None else "index and cache",
+            sum(report.get("cache_hits", 0) for report in reports),
+            sum(report.get("cache_misses", 0) for report in reports)))
+    records = [record for report in reports for record in report["profile"]]
+    if profile_hook is not None:
+        for record in records:
+            profile_hook(record)
+    if profile_file is not None:
+        write_profile(records, profile_file)
+    # Writing out the results.
+    return results, stats_table(sorted(reports, key=_manifest_order(manifest)))
 
-            raise ValueError("hmmsearch was not found, make sure HMMER3 is installed and executable")
 
-        # Parse HMMseach output.
-        its_pos = itsxpress.ItsPosition(domtable=sobj.dom_file,
-                                        region=region)
-        # Create deduplication object.
-        dedup_obj = itsxpress.Dedup(uc_file=sobj.uc_file,
-                                    rep_file=sobj.rep_file,
-                                    seq_file=sobj.seq_file,
-                                    fastq=sobj.r1,
-                                    fastq2=sobj.fastq2)
+def _search_references(fasta: str, taxa: str, threads: int, scratch_dir: str = None) -> dict:
+    """Finds the ITS positions of reference sequences for every region.
 
-        # Copy the original filename, that way we preserve all filename fields.
-        out_path_fwd = os.path.join(str(results),
-                                    pathlib.Path(sample.forward).name)
+    Args:
+        fasta (str): The reference sequences, a FASTA file.
+        taxa (str): The taxa to be used for the search.
+        threads (int) : The number of threads to use.
+        scratch_dir (str): The directory for the search's workspace, None for the system
+            temporary directory.
 
-        # Create trimmed sequences.
-        if paired_out:
-            # Copy the original filename, that way we preserve all filename fields.
-            out_path_rev = os.path.join(str(results),
-                                        pathlib.Path(sample.reverse).name)
-            dedup_obj.create_paired_trimmed_seqs(out_path_fwd,
-                                                 out_path_rev,
-                                                 gzipped=True,
-                                                 itspos=its_pos)
-        else:
-            dedup_obj.create_trimmed_seqs(out_path_fwd,
-                                      gzipped=True,
-                                      itspos=its_pos)
-        # Deleting the temp files.
-        shutil.rmtree(sobj.tempdir)
-    # Writing out the results.
-    return results
+    Returns:
+        (dict): {(digest, taxa, region, hmm): (start, stop, tlen) or None}
+
+    """
+    hmm = hmm_checksum(_hmm_file(taxa))
+    with Workspace(scratch_dir) as workspace:
+        workspace.check_space(scratch_needed([os.path.getsize(fasta)], 1))
+        tempdir = workspace.mkdtemp()
+        search_obj = itsxpress.SeqSample(fastq=None, tempdir=tempdir)
+        search_obj.rep_file = os.path.join(tempdir, 'rep.fa')
+        # Each unique sequence is searched once, under a short id.
+        digests = {}
+        with open(search_obj.rep_file, 'w') as f:
+            for _, seq in read_fasta(fasta):
+                digest = sequence_digest(seq)
+                if digest not in digests:
+                    digests[digest] = "seq{}".format(len(digests))
+                    f.write(">{}\n{}\n".format(digests[digest], seq))
+        if not digests:
+            return {}
+        _search_sample(search_obj, taxa=taxa, threads=threads)
+        rows = {}
+        for region in REGIONS:
+            its_pos = itsxpress.ItsPosition(domtable=search_obj.dom_file, region=region)
+            for digest, seq_id in digests.items():
+                rows[(digest, taxa, region, hmm)] = its_pos.get_position(seq_id) if seq_id in its_pos.ddict else None
+        return rows
+
+
+def build_index(reference_sequences=None,
+                previous_index: ITSPositionIndexDirFmt = None,
+                taxa: str = "F",
+                threads: int = 1,
+                cache_dir: str = None,
+                scratch_dir: str = None) -> ITSPositionIndexDirFmt:
+    """Builds an ITS position index from reference sequences, an earlier index and a cache.
+
+    Where the sources hold the same sequence, taxa, region and HMM file the reference
+    search is kept over the cache, and the cache over the earlier index.
+
+    Args:
+        reference_sequences (DNAFASTAFormat): Sequences to search with HMMSearch for every region, optional.
+        previous_index (ITSPositionIndexDirFmt): An index to extend, optional.
+        taxa (str): The taxa to search the reference sequences with.
+        threads (int) : The number of threads to use.
+        cache_dir (str): An ITS position cache directory whose positions are added, optional.
+        scratch_dir (str): The directory for the search's temporary files, None for the
+            system temporary directory.
+
+    Returns:
+        (ITSPositionIndexDirFmt): The index.
+
+    Raises:
+        ValueError: No source of positions was given.
+
+    """
+    if reference_sequences is None and previous_index is None and cache_dir is None:
+        raise ValueError("Give reference sequences, a previous index or a cache directory to build an index from")
+    rows = {}
+    if previous_index is not None:
+        rows.update(read_index(str(previous_index.path / 'positions.tsv')))
+    if cache_dir is not None:
+        rows.update(read_cache(cache_dir))
+    if reference_sequences is not None:
+        rows.update(_search_references(str(reference_sequences), taxa=taxa, threads=threads,
+                                       scratch_dir=scratch_dir))
+    index = ITSPositionIndexDirFmt()
+    n_rows = write_index(rows, str(index.path / 'positions.tsv'))
+    logging.info("ITS position index: {} rows".format(n_rows))
+    return index
@@ -0,0 +1,192 @@
+"""Batched read merging for the q2_itsxpress plugin.
+
+itsxpress merges the reads of each paired end sample with its own BBMerge process, and
+every process pays for starting a Java virtual machine and warming up its JIT compiler.
+For runs of many small samples this fixed cost is larger than the merging itself. Here
+the reads of several samples are tagged with the index of their sample and merged by a
+single BBMerge process, then split back into one merged file per sample with the tags
+removed. BBMerge merges each pair on its own, so a sample's merged reads are the same
+as when it is merged alone.
+
+"""
+import logging
+import os
+import re
+import subprocess
+
+from itsxpress.definitions import maxmismatches, maxratio
+
+from q2_itsxpress._fastq import open_fastq, read_fastq, write_fastq
+
+_PAIRS = re.compile(r"^Pairs:\s+(\d+)", re.MULTILINE)
+_JOINED = re.compile(r"^Joined:\s+(\d+)", re.MULTILINE)
+
+
+def tag_title(index: int, title: str) -> str:
+    """Returns a title line tagged with the index of its sample."""
+    return "s{}_{}".format(index, title)
+
+
+def untag_title(title: str) -> tuple:
+    """Splits a tagged title line.
+
+    Args:
+        title (str): A title line from tag_title.
+
+    Returns:
+        (tuple): (the index of the sample, the original title line)
+
+    """
+    tag, title = title.split("_", 1)
+    return int(tag[1:]), title
+
+
+def bbmerge_counts(stderr: str) -> tuple:
+    """Reads the number of pairs and merged pairs from the summary BBMerge writes to stderr.
+
+    Args:
+        stderr (str): The standard error of BBMerge.
+
+    Returns:
+        (tuple): (pairs, merged pairs), None for counts that were not found.
+
+    """
+    pairs = _PAIRS.search(stderr)
+    joined = _JOINED.search(stderr)
+    return (int(pairs.group(1)) if pairs else None,
+            int(joined.group(1)) if joined else None)
+
+
+def tag_reads(pairs: list, out1: str, out2: str) -> list:
+    """Writes the read pairs of several samples into one pair of files, tagging every title.
+
+    Args:
+        pairs (list): (forward reads path, reverse reads path) for each sample.
+        out1 (str): The forward reads file to write.
+        out2 (str): The reverse reads file to write.
+
+    Returns:
+        (list): The number of read pairs of each sample.
+
+    Raises:
+        ValueError: The forward and reverse files of a sample hold different numbers of
+            reads, which would pair the reads of the samples after it with the wrong mates.
+
+    """
+    counts = []
+    with open(out1, 'w') as o1, open(out2, 'w') as o2:
+        for index, (fastq, fastq2) in enumerate(pairs):
+            counts.append(0)
+            with open_fastq(fastq) as f:
+                for title, seq, qual in read_fastq(f):
+                    write_fastq(o1, tag_title(index, title), seq, qual)
+                    counts[index] += 1
+            reverse = 0
+            with open_fastq(fastq2) as f:
+                for title, seq, qual in read_fastq(f):
+                    write_fastq(o2, tag_title(index, title), seq, qual)
+                    reverse += 1
+            if reverse != counts[index]:
+                raise ValueError("{} has {} reads but {} has {}, the read files of a sample should "
+                                 "hold the same read pairs".format(fastq, counts[index], fastq2, reverse))
+    return counts
+
+
+def run_bbmerge(in1: str, in2: str, out: str, threads: int, ordered: bool = True) -> tuple:
+    """Merges read pairs with BBMerge, with the settings itsxpress uses.
+
+    Args:
+        in1 (str): The forward reads.
+        in2 (str): The reverse reads.
+        out (str): The merged reads file to write.
+        threads (int): The number of threads for BBMerge.
+        ordered (bool): Write the merged reads in input order.
+
+    Returns:
+        (tuple): (pairs, merged pairs) as reported by BBMerge, see bbmerge_counts.
+
+    Raises:
+        FileNotFoundError: BBMerge was not found.
+        subprocess.CalledProcessError: BBMerge failed.
+
+    """
+    parameters = ['bbmerge.sh',
+                  'in=' + in1,
+                  'in2=' + in2,
+                  'out=' + out,
+                  't=' + str(threads),
+                  'maxmismatches=' + str(maxmismatches),
+                  'maxratio=' + str(maxratio)]
+    if ordered:
+        parameters.append('ordered=t')
+    try:
+        p1 = subprocess.run(parameters, stderr=subprocess.PIPE)
+        p1.check_returncode()
+        logging.info(p1.stderr.decode('utf-8'))
+        return bbmerge_counts(p1.stderr.decode('utf-8'))
+    except subprocess.CalledProcessError as e:
+        logging.exception("Could not perform read merging with BBmerge. Error from BBmerge was: \n  {}".format(
+            p1.stderr.decode('utf-8')))
+        raise e
+    except FileNotFoundError as f:
+        logging.error("BBmerge was not found, make sure BBmerge is executable")
+        raise f
+
+
+def demultiplex(merged: str, outputs: list) -> list:
+    """Splits tagged merged reads into one file per sample, removing the tags.
+
+    Args:
+        merged (str): The merged reads from run_bbmerge.
+        outputs (list): The merged reads file to write for each sample, in tag order.
+
+    Returns:
+        (list): The number of merged reads of each sample.
+
+    """
+    handles = [open(output, 'w') for output in outputs]
+    counts = [0] * len(outputs)
+    try:
+        with open(merged, 'r') as f:
+            for title, seq, qual in read_fastq(f):
+                index, title = untag_title(title)
+                write_fastq(handles[index], title, seq, qual)
+                counts[index] += 1
+    finally:
+        for handle in handles:
+            handle.close()
+    return counts
+
+
+def merge_samples(sobjs: list, tempdir: str, threads: int) -> list:
+    """Merges the reads of several paired end samples with one BBMerge process.
+
+    Sets the seq_file of each sample to its merged reads, as sobj._merge_reads does.
+
+    Args:
+        sobjs (list): itsxpress SeqSamplePairedNotInterleaved objects.
+        tempdir (str): A directory for the pooled files.
+        threads (int): The number of threads for BBMerge.
+
+    Returns:
+        (list): (read pairs, merged reads) of each sample.
+
+    Raises:
+        ValueError: The read files of a sample hold different numbers of reads, see tag_reads.
+
+    """
+    in1 = os.path.join(tempdir, 'batch_r1.fq')
+    in2 = os.path.join(tempdir, 'batch_r2.fq')
+    merged = os.path.join(tempdir, 'batch_merged.fq')
+    try:
+        pairs = tag_reads([(sobj.r1, sobj.fastq2) for sobj in sobjs], in1, in2)
+        run_bbmerge(in1, in2, merged, threads=threads)
+        outputs = [os.path.join(sobj.tempdir, 'seq.fq') for sobj in sobjs]
+        counts = demultiplex(merged, outputs)
+    finally:
+        for path in (in1, in2, merged):
+            if os.path.exists(path):
+                os.remove(path)
+    for sobj, output in zip(sobjs, outputs):
+        sobj.seq_file = output
+    return list(zip(pairs, counts))
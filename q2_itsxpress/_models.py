@@ -0,0 +1,99 @@
+"""Prepared HMM model sets for the q2_itsxpress plugin.
+
+The ITSx HMM file of a taxa holds the models of every ITS boundary, but the trimming
+of a region only uses the models on either side of it: SSU end and 5.8S start for
+ITS1, 5.8S end and LSU start for ITS2, and SSU end and LSU start for the whole ITS.
+Each hmmsearch call otherwise parses the complete flat file and searches every model.
+The models needed for a region are written once to a model directory, converted to
+the HMMER binary format when hmmconvert is available, and reused by every sample of
+the run and by later runs sharing the directory.
+
+"""
+import logging
+import os
+import subprocess
+import tempfile
+
+from q2_itsxpress._cache import hmm_checksum
+
+# The model name prefixes ItsPosition reads for each region.
+region_prefixes = {"ITS1": ("1_", "2_"),
+                   "ITS2": ("3_", "4_"),
+                   "ALL": ("1_", "4_")}
+
+
+def filter_models(hmmfile: str, outfile: str, prefixes: tuple) -> int:
+    """Copies the models whose names start with one of the prefixes.
+
+    Args:
+        hmmfile (str): The HMMER3 text format file to read.
+        outfile (str): The file to write the selected models to.
+        prefixes (tuple): The model name prefixes to keep.
+
+    Returns:
+        (int): The number of models written.
+
+    """
+    kept = 0
+    with open(hmmfile, 'r') as f, open(outfile, 'w') as out:
+        model = []
+        keep = False
+        for line in f:
+            model.append(line)
+            if line.startswith("NAME"):
+                keep = line.split()[1].startswith(prefixes)
+            elif line.startswith("//"):
+                if keep:
+                    out.writelines(model)
+                    kept += 1
+                model = []
+                keep = False
+    return kept
+
+
+def _atomic_write(path: str, write) -> None:
+    """Calls write with a temporary path and moves the result to path once complete."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def prepare_models(hmmfile: str, region: str, model_dir: str) -> str:
+    """Returns an HMM file holding only the models needed for a region, building it if needed.
+
+    Args:
+        hmmfile (str): The ITSx HMM file of the taxa.
+        region (str): The region of the ITS being trimmed.
+        model_dir (str): The directory the prepared models are kept in, created if needed.
+
+    Returns:
+        (str): The path of the prepared HMM file, binary if hmmconvert is available.
+
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(hmmfile))[0]
+    key = "{}.{}.{}".format(stem, region, hmm_checksum(hmmfile)[:16])
+    text_file = os.path.join(model_dir, key + ".hmm")
+    binary_file = os.path.join(model_dir, key + ".h3b")
+    if os.path.exists(binary_file):
+        return binary_file
+    if not os.path.exists(text_file):
+        _atomic_write(text_file,
+                      lambda tmp: filter_models(hmmfile, tmp, region_prefixes[region]))
+
+    def _convert(tmp):
+        with open(tmp, 'wb') as out:
+            subprocess.run(["hmmconvert", "-b", text_file],
+                           stdout=out, stderr=subprocess.PIPE, check=True)
+
+    try:
+        _atomic_write(binary_file, _convert)
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        logging.info("hmmconvert could not write binary models, using text models: {}".format(e))
+        return text_file
+    return binary_file
@@ -0,0 +1,285 @@
+"""In-process merging of paired end reads for the q2_itsxpress plugin.
+
+BBMerge runs as a separate Java process and its merged reads go through a temporary
+file or a pipe. ITS amplicon pairs usually overlap cleanly, so they can be merged here
+instead. Pairs are merged in batches: the forward reads and the reverse complemented
+reverse reads of a batch are held as padded byte matrices, and the matching bases at
+every overlap of every pair are counted at once with FFT cross-correlations, one per
+base. Each pair takes the overlap with the best score, if it is long enough and has few
+enough mismatches, and the overlap is resolved into a consensus using the base
+qualities. numpy holds the GIL through most of this, so batches are merged on a pool of
+processes, and come back in input order.
+
+As with BBMerge, only the merged pairs are returned and the title of the forward read
+is kept. Pairs whose reads run past each other's ends, such as inserts shorter than a
+read, are not merged. As BBMerge does, the merge fails when the forward and reverse
+files hold different numbers of reads or the names of a pair differ.
+
+"""
+import collections
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from q2_itsxpress._fastq import open_fastq, read_fastq, write_fastq
+from q2_itsxpress._validate import pair_name
+from q2_itsxpress._defaults import default_min_overlap, default_max_mismatch_rate
+
+batch_size = 4096
+# A mismatch costs as much as this many matches when overlaps are compared.
+mismatch_penalty = 3
+max_quality = 41
+min_quality = 2
+
+_COMPLEMENT = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+_N = ord("N")
+_MISSING = object()
+
+
+def _encode(strings: list, width: int, offset: int = 0) -> np.ndarray:
+    """Returns strings as the rows of a zero padded byte matrix, less an offset."""
+    matrix = np.zeros((len(strings), width), dtype=np.int16)
+    for row, string in enumerate(strings):
+        matrix[row, :len(string)] = np.frombuffer(string.encode('ascii'), dtype=np.uint8)
+    if offset:
+        matrix -= offset
+    return matrix
+
+
+def _correlate(a: np.ndarray, b: np.ndarray, size: int) -> np.ndarray:
+    """Returns sum_j a[:, j + s] * b[:, j] for every shift s, computed with FFTs."""
+    return np.fft.irfft(np.fft.rfft(a, size) * np.conj(np.fft.rfft(b, size)), size)
+
+
+def overlap_counts(a: np.ndarray, b: np.ndarray) -> tuple:
+    """Counts matching and comparable bases where b starts at each position of a.
+
+    Args:
+        a (np.ndarray): Forward reads as a padded byte matrix.
+        b (np.ndarray): Reverse complemented reverse reads as a padded byte matrix.
+
+    Returns:
+        (tuple): (matches, compared) integer matrices indexed by pair and shift. Bases
+            are compared where both are A, C, G or T.
+
+    """
+    size = a.shape[1] + b.shape[1]
+    spectrum = 0
+    for base in _BASES:
+        spectrum = spectrum + (np.fft.rfft((a == base).astype(np.float32), size) *
+                               np.conj(np.fft.rfft((b == base).astype(np.float32), size)))
+    matches = np.rint(np.fft.irfft(spectrum, size))[:, :a.shape[1]].astype(np.int64)
+    compared = np.rint(_correlate(np.isin(a, _BASES).astype(np.float32),
+                                  np.isin(b, _BASES).astype(np.float32),
+                                  size))[:, :a.shape[1]].astype(np.int64)
+    return matches, compared
+
+
+def best_overlaps(a: np.ndarray, b: np.ndarray, len1: np.ndarray, len2: np.ndarray,
+                  min_overlap: int, max_mismatch_rate: float) -> np.ndarray:
+    """Returns the start of the best overlap of b on a for each pair, -1 where there is none.
+
+    Args:
+        a (np.ndarray): Forward reads as a padded byte matrix.
+        b (np.ndarray): Reverse complemented reverse reads as a padded byte matrix.
+        len1 (np.ndarray): The length of each forward read.
+        len2 (np.ndarray): The length of each reverse read.
+        min_overlap (int): The shortest overlap accepted.
+        max_mismatch_rate (float): The highest fraction of mismatches accepted in an overlap.
+
+    Returns:
+        (np.ndarray): The position in the forward read where the reverse read starts.
+
+    """
+    matches, compared = overlap_counts(a, b)
+    mismatches = compared - matches
+    shifts = np.arange(a.shape[1])[None, :]
+    overlap = len1[:, None] - shifts
+    valid = ((overlap >= max(1, min_overlap)) &
+             (overlap <= len2[:, None]) &
+             (mismatches <= max_mismatch_rate * overlap))
+    score = np.where(valid, matches - mismatch_penalty * mismatches, np.iinfo(np.int64).min)
+    best = np.argmax(score, axis=1)
+    return np.where(valid[np.arange(len(best)), best], best, -1)
+
+
+def _consensus(a, b, qa, qb, starts, len1, len2) -> tuple:
+    """Builds merged sequences and qualities, as padded matrices, from the overlap starts."""
+    lengths = starts + len2
+    width = int(lengths.max())
+    rows = len(starts)
+    positions = np.broadcast_to(np.arange(width)[None, :], (rows, width))
+    in_a = positions < len1[:, None]
+    b_positions = positions - starts[:, None]
+    in_b = (b_positions >= 0) & (b_positions < len2[:, None])
+    a_index = np.minimum(positions, a.shape[1] - 1)
+    b_index = np.clip(b_positions, 0, b.shape[1] - 1)
+    sa = np.take_along_axis(a, a_index, axis=1)
+    sb = np.take_along_axis(b, b_index, axis=1)
+    qa = np.take_along_axis(qa, a_index, axis=1)
+    qb = np.take_along_axis(qb, b_index, axis=1)
+    seq = np.where(in_a, sa, sb)
+    qual = np.where(in_a, qa, qb)
+    both = in_a & in_b
+    a_n = sa == _N
+    b_n = sb == _N
+    # An N takes the called base of the other read.
+    fill = both & a_n & ~b_n
+    seq = np.where(fill, sb, seq)
+    qual = np.where(fill, qb, qual)
+    # Agreeing bases support each other, disagreeing bases keep the better one at lower quality.
+    agree = both & (sa == sb) & ~a_n
+    disagree = both & (sa != sb) & ~a_n & ~b_n
+    seq = np.where(disagree & (qb > qa), sb, seq)
+    qual = np.where(agree, np.minimum(qa + qb, max_quality), qual)
+    qual = np.where(disagree, np.maximum(np.abs(qa - qb), min_quality), qual)
+    return seq, qual, lengths
+
+
+def merge_batch(pairs: list, min_overlap: int = default_min_overlap,
+                max_mismatch_rate: float = default_max_mismatch_rate) -> list:
+    """Merges a batch of read pairs.
+
+    Args:
+        pairs (list): ((title, seq, qual), (title, seq, qual)) pairs of forward and reverse reads.
+        min_overlap (int): The shortest overlap accepted.
+        max_mismatch_rate (float): The highest fraction of mismatches accepted in an overlap.
+
+    Returns:
+        (list): The (title, seq, qual) of each merged pair, in input order.
+
+    """
+    if not pairs:
+        return []
+    titles = [rec1[0] for rec1, _ in pairs]
+    seq1 = [rec1[1].upper() for rec1, _ in pairs]
+    qual1 = [rec1[2] for rec1, _ in pairs]
+    seq2 = [rec2[1].translate(_COMPLEMENT).upper()[::-1] for _, rec2 in pairs]
+    qual2 = [rec2[2][::-1] for _, rec2 in pairs]
+    len1 = np.array([len(seq) for seq in seq1], dtype=np.int64)
+    len2 = np.array([len(seq) for seq in seq2], dtype=np.int64)
+    width1 = max(1, int(len1.max()))
+    width2 = max(1, int(len2.max()))
+    a = _encode(seq1, width1)
+    b = _encode(seq2, width2)
+    starts = best_overlaps(a, b, len1, len2, min_overlap, max_mismatch_rate)
+    merged = np.flatnonzero(starts >= 0)
+    if not len(merged):
+        return []
+    qa = _encode(qual1, width1, offset=33)
+    qb = _encode(qual2, width2, offset=33)
+    seq, qual, lengths = _consensus(a[merged], b[merged], qa[merged], qb[merged],
+                                    starts[merged], len1[merged], len2[merged])
+    seq = seq.astype(np.uint8)
+    qual = (qual + 33).astype(np.uint8)
+    return [(titles[index],
+             seq[row, :lengths[row]].tobytes().decode('ascii'),
+             qual[row, :lengths[row]].tobytes().decode('ascii'))
+            for row, index in enumerate(merged)]
+
+
+def read_pairs(records1, records2):
+    """Pairs forward and reverse reads, checking that they belong together.
+
+    Args:
+        records1 (iterable): Forward FASTQ records as returned by read_fastq.
+        records2 (iterable): Reverse FASTQ records as returned by read_fastq.
+
+    Yields:
+        (tuple): (forward record, reverse record) pairs.
+
+    Raises:
+        ValueError: The files hold different numbers of reads, or a pair's names differ.
+
+    """
+    for n, (rec1, rec2) in enumerate(itertools.zip_longest(records1, records2, fillvalue=_MISSING), 1):
+        if rec1 is _MISSING or rec2 is _MISSING:
+            raise ValueError("The {} reads end at read {}, but the {} reads continue".format(
+                "forward" if rec1 is _MISSING else "reverse", n - 1,
+                "reverse" if rec1 is _MISSING else "forward"))
+        if pair_name(rec1[0]) != pair_name(rec2[0]):
+            raise ValueError("Read {} is named {} in the forward reads and {} in the reverse reads".format(
+                n, pair_name(rec1[0]), pair_name(rec2[0])))
+        yield rec1, rec2
+
+
+def _batches(pairs, counter: list):
+    batch = []
+    for pair in pairs:
+        counter[0] += 1
+        batch.append(pair)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class PairMerger:
+    """Merges paired end reads in process, in place of BBMerge.
+
+    Args:
+        min_overlap (int): The shortest overlap accepted.
+        max_mismatch_rate (float): The highest fraction of mismatches accepted in an overlap.
+
+    """
+    def __init__(self, min_overlap: int = default_min_overlap,
+                 max_mismatch_rate: float = default_max_mismatch_rate):
+        self.min_overlap = min_overlap
+        self.max_mismatch_rate = max_mismatch_rate
+
+    def merge(self, records1, records2, threads: int = 1, counter: list = None):
+        """Merges read pairs, in batches on a pool of processes.
+
+        Args:
+            records1 (iterable): Forward FASTQ records as returned by read_fastq.
+            records2 (iterable): Reverse FASTQ records as returned by read_fastq.
+            threads (int): The number of processes merging batches.
+            counter (list): A one item list the number of read pairs read is added to, optional.
+
+        Yields:
+            (tuple): The (title, seq, qual) of each merged pair, in input order.
+
+        Raises:
+            ValueError: The reads do not pair up, see read_pairs.
+
+        """
+        batches = _batches(read_pairs(records1, records2), counter if counter is not None else [0])
+        if threads <= 1:
+            for batch in batches:
+                yield from merge_batch(batch, self.min_overlap, self.max_mismatch_rate)
+            return
+        pending = collections.deque()
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            for batch in batches:
+                pending.append(executor.submit(merge_batch, batch, self.min_overlap,
+                                               self.max_mismatch_rate))
+                # Two batches in flight per process keeps them busy without holding the sample.
+                while len(pending) >= 2 * threads:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def merge_files(self, fastq: str, fastq2: str, outfile: str, threads: int = 1) -> tuple:
+        """Merges the read pairs of two FASTQ files into a FASTQ file.
+
+        Args:
+            fastq (str): The forward reads.
+            fastq2 (str): The reverse reads.
+            outfile (str): The merged reads file to write, uncompressed.
+            threads (int): The number of processes merging batches.
+
+        Returns:
+            (tuple): (the number of read pairs read, the number of merged reads written).
+
+        """
+        counter = [0]
+        written = 0
+        with open_fastq(fastq) as f, open_fastq(fastq2) as g, open(outfile, 'w') as out:
+            for title, seq, qual in self.merge(read_fastq(f), read_fastq(g), threads=threads,
+                                               counter=counter):
+                write_fastq(out, title, seq, qual)
+                written += 1
+        return counter[0], written
@@ -0,0 +1,228 @@
+"""Pipelined sample stages for the q2_itsxpress plugin.
+
+Each sample is merged, dereplicated, searched and written in turn, and most of that
+time is spent waiting on one external tool or on gzip, so a single sample leaves most
+of the cores idle. Running whole samples concurrently only helps when there are enough
+samples, and scratch space and memory for all of them at once. A Pipeline instead runs
+each stage on its own worker threads, linked by bounded queues, so HMMSearch runs on
+one sample while the next is merged and the one before is written. The throughput of a
+run then approaches that of its slowest stage rather than the sum of its stages.
+
+A sample only enters the pipeline while the scratch space and memory estimated for the
+samples in flight stay within their budgets, and a full queue holds back the stage
+before it, so a fast merge stage cannot fill the scratch disk with samples the search
+stage has not reached. The CPU and I/O figures of a profile are measured for the
+whole process, so with a pipeline they include the other samples in flight. Such
+records are marked as pipelined, and calibrate does not plan threads from them.
+
+"""
+import os
+import queue
+import threading
+
+# The stages of a pipelined sample, in order.
+PIPELINE_STAGES = ("merge", "dereplicate", "search", "write")
+# The samples waiting between two stages.
+default_queue_size = 1
+# The memory a sample in flight may take, as a multiple of the size of its read files.
+memory_factor = 2
+
+_DONE = object()
+
+
+def parse_stage_workers(spec: str, stages: tuple = PIPELINE_STAGES) -> dict:
+    """Parses per-stage worker counts such as "merge=2,search=1".
+
+    Args:
+        spec (str): Comma separated stage=workers pairs, None or empty for one worker each.
+        stages (tuple): The stage names.
+
+    Returns:
+        (dict): {stage: workers} for every stage, one for the stages not given.
+
+    Raises:
+        ValueError: A stage is unknown or its count is not a positive integer.
+
+    """
+    workers = {stage: 1 for stage in stages}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        stage, _, count = part.partition("=")
+        stage = stage.strip()
+        if stage not in workers:
+            raise ValueError("{} is not a stage, choose from {}".format(stage, ", ".join(stages)))
+        try:
+            workers[stage] = int(count)
+        except ValueError:
+            raise ValueError("The workers of {} should be an integer, not {!r}".format(stage, count.strip()))
+        if workers[stage] < 1:
+            raise ValueError("The workers of {} should be at least 1".format(stage))
+    return workers
+
+
+def available_memory() -> int:
+    """Returns the bytes of memory available to the run, None where they cannot be read."""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def sample_memory(size: int, memory_limit: int = None) -> int:
+    """Estimates the memory a sample holds while in flight.
+
+    Args:
+        size (int): The size of the read files of the sample in bytes.
+        memory_limit (int): The bytes the read mapping of the sample may hold, None for no limit.
+
+    Returns:
+        (int): The estimated bytes.
+
+    """
+    return memory_limit if memory_limit else memory_factor * size
+
+
+class Budget:
+    """A quantity, such as scratch bytes, shared by the samples in flight.
+
+    A request larger than the whole budget is granted once nothing else holds any of
+    it, so an oversized sample runs on its own rather than never.
+
+    Args:
+        capacity (int): The total, None for no limit.
+
+    """
+    def __init__(self, capacity: int = None):
+        self.capacity = capacity
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def _fits(self, amount: int) -> bool:
+        return self.capacity is None or self.used == 0 or self.used + amount <= self.capacity
+
+    def acquire(self, amount: int) -> None:
+        """Waits until the amount fits in the budget, then holds it."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._fits(amount))
+            self.used += amount
+
+    def release(self, amount: int) -> None:
+        """Returns an amount taken with acquire."""
+        with self._cond:
+            self.used -= amount
+            self._cond.notify_all()
+
+
+class Stage:
+    """A step of a Pipeline.
+
+    Args:
+        name (str): The name of the stage, used for its threads.
+        func (callable): Takes the output of the stage before, or an item for the first stage.
+        workers (int): The number of threads running the stage.
+
+    """
+    def __init__(self, name: str, func, workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    """Runs items through stages on worker threads linked by bounded queues.
+
+    Args:
+        stages (list): The Stage objects, in order.
+        queue_size (int): The items that may wait between two stages.
+        budgets (list): (Budget, cost) pairs, where cost gives the amount of the budget
+            an item holds from when it enters the first stage until it leaves the last.
+
+    """
+    def __init__(self, stages: list, queue_size: int = default_queue_size, budgets: list = ()):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.budgets = list(budgets)
+
+    def run(self, items: list) -> list:
+        """Runs every item through the stages.
+
+        Once a stage raises, no new items are started and the items in flight are
+        dropped, then the first exception is raised again.
+
+        Args:
+            items (list): The items for the first stage.
+
+        Returns:
+            (list): The output of the last stage for each item, in the order of items.
+
+        """
+        results = [None] * len(items)
+        held = {}
+        errors = []
+        failed = threading.Event()
+        lock = threading.Lock()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        running = [stage.workers for stage in self.stages]
+
+        def release(index):
+            for (budget, _), amount in zip(self.budgets, held.pop(index)):
+                budget.release(amount)
+
+        def work(position):
+            stage = self.stages[position]
+            inbox = queues[position]
+            last = position == len(self.stages) - 1
+            while True:
+                entry = inbox.get()
+                if entry is _DONE:
+                    # Passed on to the other workers of the stage, the last one tells the next stage.
+                    inbox.put(_DONE)
+                    with lock:
+                        running[position] -= 1
+                        finished = running[position] == 0
+                    if finished and not last:
+                        queues[position + 1].put(_DONE)
+                    return
+                index, value = entry
+                if failed.is_set():
+                    release(index)
+                    continue
+                try:
+                    value = stage.func(value)
+                except BaseException as e:
+                    with lock:
+                        errors.append(e)
+                    failed.set()
+                    release(index)
+                    continue
+                if last:
+                    results[index] = value
+                    release(index)
+                else:
+                    queues[position + 1].put((index, value))
+
+        threads = [threading.Thread(target=work, args=(position,),
+                                    name="itsxpress-{}-{}".format(stage.name, n), daemon=True)
+                   for position, stage in enumerate(self.stages)
+                   for n in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for index, item in enumerate(items):
+                if failed.is_set():
+                    break
+                amounts = []
+                for budget, cost in self.budgets:
+                    amount = cost(item)
+                    budget.acquire(amount)
+                    amounts.append(amount)
+                held[index] = amounts
+                queues[0].put((index, item))
+        finally:
+            queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+        return results
@@ -0,0 +1,189 @@
+"""Cross-sample pooling of representative sequences for the q2_itsxpress plugin.
+
+Amplicon studies share most of their dominant ITS variants between samples. Rather
+than running HMMSearch on the representative sequences of every sample, the
+representatives of all samples are dereplicated into one pooled FASTA file, searched
+once, and the ITS positions are handed back to each sample's trimming step.
+
+"""
+import hashlib
+
+_COMPLEMENT = str.maketrans("ACGTURYKMSWBDHVN", "TGCAAYRMKSWVHDBN")
+
+
+def read_fasta(fasta: str):
+    """Reads a FASTA file, such as the representative sequences written by Vsearch.
+
+    Args:
+        fasta (str): The path to the FASTA file.
+
+    Yields:
+        (tuple): (sequence id, sequence) where the id is the header up to the first whitespace.
+
+    """
+    seq_id = None
+    seq = []
+    with open(fasta, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                if seq_id is not None:
+                    yield seq_id, "".join(seq)
+                seq_id = line[1:].split()[0]
+                seq = []
+            elif line:
+                seq.append(line)
+    if seq_id is not None:
+        yield seq_id, "".join(seq)
+
+
+def count_fasta(fasta: str) -> int:
+    """Counts the sequences in a FASTA file.
+
+    Args:
+        fasta (str): The path to the FASTA file.
+
+    Returns:
+        (int): The number of sequences.
+
+    """
+    with open(fasta, 'r') as f:
+        return sum(1 for line in f if line.startswith(">"))
+
+
+def sequence_digest(seq: str) -> bytes:
+    """Returns a compact, case-insensitive key for a sequence.
+
+    Args:
+        seq (str): A nucleotide sequence.
+
+    Returns:
+        (bytes): The SHA-1 digest of the upper-case sequence.
+
+    """
+    return hashlib.sha1(seq.upper().encode('ascii')).digest()
+
+
+def strand_digest(seq: str) -> bytes:
+    """Returns a key shared by a sequence and its reverse complement.
+
+    Reads with the same key are duplicates for Vsearch --derep_fulllength --strand both.
+
+    Args:
+        seq (str): A nucleotide sequence.
+
+    Returns:
+        (bytes): The sequence_digest of the lesser of the upper-case sequence and its
+            reverse complement.
+
+    """
+    seq = seq.upper()
+    return sequence_digest(min(seq, seq.translate(_COMPLEMENT)[::-1]))
+
+
+def pool_representatives(rep_files: list, pooled_file: str) -> list:
+    """Writes the unique sequences from several representative sequence files to one FASTA file.
+
+    Args:
+        rep_files (list): The representative sequence FASTA files, one per sample.
+        pooled_file (str): The FASTA file to write the pooled unique sequences to.
+
+    Returns:
+        (list): A dictionary for each rep_file mapping its sequence ids to pooled sequence ids.
+
+    """
+    pooled = {}
+    idmaps = []
+    with open(pooled_file, 'w') as out:
+        for rep_file in rep_files:
+            idmap = {}
+            for seq_id, seq in read_fasta(rep_file):
+                key = sequence_digest(seq)
+                if key not in pooled:
+                    pooled[key] = "pooled{}".format(len(pooled))
+                    out.write(">{}\n{}\n".format(pooled[key], seq))
+                idmap[seq_id] = pooled[key]
+            idmaps.append(idmap)
+    return idmaps
+
+
+class PositionTable:
+    """ITS start and stop positions for a set of representative sequences.
+
+    A stand-in for itsxpress.ItsPosition holding positions that were found elsewhere,
+    such as in a pooled search. Dedup only calls get_position so the two are interchangeable.
+
+    Args:
+        positions (dict): {sequence id: (start, stop, tlen)}
+
+    """
+    def __init__(self, positions: dict):
+        self.positions = positions
+
+    def get_position(self, sequence: str) -> tuple:
+        """Returns the start and stop positions for a given sequence.
+
+        Args:
+            sequence (str): The name of the sequence.
+
+        Returns:
+            (tuple): (start position, end position, sequence length) zero indexed
+
+        Raises:
+            KeyError: If no ITS start or stop sites were found for the sequence.
+
+        """
+        return self.positions[sequence]
+
+
+def usable_position(position: tuple) -> bool:
+    """Returns True where an ITS position can be trimmed to, with a start before its stop.
+
+    Args:
+        position (tuple): (start, stop, tlen) as from get_position, None where not found.
+
+    Returns:
+        (bool): True if the start and stop are both set and the start is before the stop.
+
+    """
+    start, stop, _ = position
+    return bool(start and stop and start < stop)
+
+
+def count_usable(its_pos) -> int:
+    """Counts the sequences of an ItsPosition or PositionTable whose ITS can be trimmed to.
+
+    Sequences with only a start or only a stop hit, or with the start after the stop, are
+    left untrimmed and not counted.
+
+    Args:
+        its_pos (object): The itsxpress ItsPosition object, or PositionTable.
+
+    Returns:
+        (int): The number of sequences with a usable position.
+
+    """
+    found = its_pos.positions if isinstance(its_pos, PositionTable) else its_pos.ddict
+    return sum(1 for seq_id in found if usable_position(its_pos.get_position(seq_id)))
+
+
+def split_positions(its_pos, idmaps: list) -> list:
+    """Fans the positions from a pooled search back out to each sample.
+
+    Args:
+        its_pos (object): The itsxpress ItsPosition object, or PositionTable when the search
+            went through the position cache, for the pooled sequences.
+        idmaps (list): The id mappings returned by pool_representatives.
+
+    Returns:
+        (list): A PositionTable for each sample, keyed by that sample's sequence ids.
+
+    """
+    found = its_pos.positions if isinstance(its_pos, PositionTable) else its_pos.ddict
+    tables = []
+    for idmap in idmaps:
+        positions = {seq_id: its_pos.get_position(pooled_id)
+                     for seq_id, pooled_id in idmap.items()
+                     if pooled_id in found}
+        tables.append(PositionTable(positions))
+    return tables
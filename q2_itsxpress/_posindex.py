@@ -0,0 +1,111 @@
+"""ITS position indexes for the q2_itsxpress plugin.
+
+The ITS start and stop sites of a sequence only depend on the sequence, the taxa, the
+region and the HMM models, so the positions of known variants can be found once and
+reused by every study with the same primers. An index holds them as a table with a row
+for each sequence digest, taxa, region and HMM file checksum, the same key as the
+position cache, and is saved as an ITSPositionIndex artifact. The trim actions look up
+the representative sequences of each sample in the index first, and only sequences it
+does not hold go to the cache or to HMMSearch.
+
+"""
+import binascii
+import csv
+
+INDEX_COLUMNS = ("digest", "taxa", "region", "hmm", "found", "start", "stop", "tlen")
+REGIONS = ("ITS1", "ITS2", "ALL")
+
+_loaded = {}
+
+
+def parse_row(row: list) -> tuple:
+    """Parses a row of an index file.
+
+    Args:
+        row (list): The fields of the row, in INDEX_COLUMNS order.
+
+    Returns:
+        (tuple): ((digest, taxa, region, hmm), (start, stop, tlen) or None where no ITS was found)
+
+    Raises:
+        ValueError: The row is malformed.
+
+    """
+    if len(row) != len(INDEX_COLUMNS):
+        raise ValueError("expected {} fields, found {}".format(len(INDEX_COLUMNS), len(row)))
+    digest, taxa, region, hmm, found, start, stop, tlen = row
+    if len(digest) != 40:
+        raise ValueError("{} is not a sequence digest".format(digest))
+    if region not in REGIONS:
+        raise ValueError("{} is not a region".format(region))
+    if found not in ("0", "1"):
+        raise ValueError("found must be 0 or 1, not {}".format(found))
+    key = (binascii.unhexlify(digest), taxa, region, hmm)
+    if found == "0":
+        return key, None
+    return key, tuple(int(value) if value else None for value in (start, stop, tlen))
+
+
+def read_index(path: str) -> dict:
+    """Reads every row of an index file.
+
+    Args:
+        path (str): The index file.
+
+    Returns:
+        (dict): {(digest, taxa, region, hmm): (start, stop, tlen) or None}
+
+    Raises:
+        ValueError: The file is not an index file.
+
+    """
+    rows = {}
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f, delimiter="\t")
+        if tuple(next(reader, ())) != INDEX_COLUMNS:
+            raise ValueError("{} does not start with the index header".format(path))
+        for row in reader:
+            key, pos = parse_row(row)
+            rows[key] = pos
+    return rows
+
+
+def write_index(rows: dict, path: str) -> int:
+    """Writes an index file, sorted by taxa, region, HMM checksum and digest.
+
+    Args:
+        rows (dict): {(digest, taxa, region, hmm): (start, stop, tlen) or None}
+        path (str): The file to write.
+
+    Returns:
+        (int): The number of rows written.
+
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(INDEX_COLUMNS)
+        for key in sorted(rows, key=lambda key: key[1:] + (key[0],)):
+            digest, taxa, region, hmm = key
+            pos = rows[key]
+            found = ["1"] + ["" if value is None else str(value) for value in pos] if pos else ["0", "", "", ""]
+            writer.writerow([binascii.hexlify(digest).decode('ascii'), taxa, region, hmm] + found)
+    return len(rows)
+
+
+def index_positions(path: str, taxa: str, region: str, hmm: str) -> dict:
+    """Returns the positions of an index file for one taxa, region and HMM file, read once per process.
+
+    Args:
+        path (str): The index file.
+        taxa (str): The taxa used for the search.
+        region (str): The region of the ITS being trimmed.
+        hmm (str): The checksum of the HMM file, see _cache.hmm_checksum.
+
+    Returns:
+        (dict): {digest: (start, stop, tlen) or None}
+
+    """
+    key = (path, taxa, region, hmm)
+    if key not in _loaded:
+        _loaded[key] = {row[0]: pos for row, pos in read_index(path).items() if row[1:] == (taxa, region, hmm)}
+    return _loaded[key]
@@ -0,0 +1,146 @@
+"""Per-stage timing and resource records for the q2_itsxpress plugin.
+
+Each sample passes through a handful of stages (checking, merging with BBMerge,
+dereplication with Vsearch, HMMSearch and writing the trimmed reads). A Profiler
+records the wall time, CPU time, CPU time of the external tools, bytes read and
+written and read counts of each stage, so slow stages can be found on production
+runs without a profiler attached. The records travel back from the worker processes
+with the sample reports and can be written to a JSON or TSV sidecar file.
+
+"""
+import csv
+import json
+import resource
+import time
+from contextlib import contextmanager
+
+PROFILE_FIELDS = ["sample_id",
+                  "stage",
+                  "threads",
+                  "wall_time",
+                  "cpu_time",
+                  "child_cpu_time",
+                  "bytes_read",
+                  "bytes_written",
+                  "child_bytes_read",
+                  "child_bytes_written",
+                  "reads_in",
+                  "reads_out",
+                  "pipelined"]
+
+
+def _io_counters() -> tuple:
+    """Returns the bytes read and written by this process, or Nones off Linux."""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _snapshot() -> tuple:
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (time.perf_counter(),
+            time.process_time(),
+            children.ru_utime + children.ru_stime,
+            children.ru_inblock,
+            children.ru_oublock) + _io_counters()
+
+
+class Profiler:
+    """Collects the stage records of one sample.
+
+    Args:
+        sample_id (str): The Sample ID, written with every record.
+
+    Attributes:
+        records (list): A dictionary for each finished stage, keyed by PROFILE_FIELDS.
+        counts (dict): The read counts of the sample set by the stages, see _stats.STATS_COUNTS.
+
+    """
+    def __init__(self, sample_id: str):
+        self.sample_id = sample_id
+        self.records = []
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name: str, threads: int = None):
+        """Measures the enclosed block as one stage.
+
+        Args:
+            name (str): The name of the stage.
+            threads (int): The threads the stage was given, None if it does not take threads.
+
+        Yields:
+            (dict): The record of the stage, reads_in and reads_out may be set by the caller.
+
+        """
+        record = {"sample_id": self.sample_id, "stage": name, "threads": threads,
+                  "reads_in": None, "reads_out": None, "pipelined": False}
+        start = _snapshot()
+        try:
+            yield record
+        finally:
+            end = _snapshot()
+            record["wall_time"] = end[0] - start[0]
+            record["cpu_time"] = end[1] - start[1]
+            record["child_cpu_time"] = end[2] - start[2]
+            # Block counts from getrusage are in 512 byte units.
+            record["child_bytes_read"] = (end[3] - start[3]) * 512
+            record["child_bytes_written"] = (end[4] - start[4]) * 512
+            if start[5] is not None and end[5] is not None:
+                record["bytes_read"] = end[5] - start[5]
+                record["bytes_written"] = end[6] - start[6]
+            else:
+                record["bytes_read"] = record["bytes_written"] = None
+            self.records.append(record)
+
+
+def write_profile(records: list, path: str) -> None:
+    """Writes stage records to a sidecar file, as TSV if the path ends in .tsv and JSON otherwise.
+
+    Args:
+        records (list): The stage records.
+        path (str): The file to write.
+
+    """
+    if path.endswith(".tsv"):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=PROFILE_FIELDS, delimiter="\t",
+                                    extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(path, 'w') as f:
+            json.dump(records, f, indent=2)
+
+
+def read_profile(path: str) -> list:
+    """Reads the stage records of a sidecar file written by write_profile.
+
+    Args:
+        path (str): The .json or .tsv file.
+
+    Returns:
+        (list): The stage records, with the numbers of a TSV file as floats and empty values as None.
+
+    """
+    if not path.endswith(".tsv"):
+        with open(path) as f:
+            return json.load(f)
+    records = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            record = {}
+            for field, value in row.items():
+                if value == "":
+                    record[field] = None
+                elif field in ("sample_id", "stage"):
+                    record[field] = value
+                elif field == "pipelined":
+                    record[field] = value == "True"
+                else:
+                    record[field] = float(value)
+            records.append(record)
+    return records
@@ -0,0 +1,189 @@
+"""Indexed access to the read files of paired end samples for the q2_itsxpress plugin.
+
+Unmerged output trims the original forward and reverse reads, so after the reads have
+been merged and searched both gzipped input files are decompressed and parsed again
+from the start, including every pair whose ITS was not found. Here each input is
+decompressed once, while its pairs are being merged, into a copy in the sample's
+scratch directory, and the start and end of the title, sequence and quality lines of
+every record are kept in an array saved next to it. Both are memory mapped when the
+pairs are written: the read ids are taken from the title spans and looked up, and only
+the records of the pairs that are kept are gathered out of the two copies, without
+decompressing or parsing the files again.
+
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from q2_itsxpress._fastq import open_fastq
+from q2_itsxpress._trim import read_blocks, format_records
+
+# The number of records whose read ids are looked up at a time.
+index_chunk = 65536
+# Columns of the spans array: title start and end, sequence start and end, quality start and end.
+_SPAN_COLUMNS = 6
+
+
+def _block_spans(block) -> np.ndarray:
+    """Returns the spans of the records of a FastqBlock as an (n, 6) array."""
+    return np.stack(block.titles + block.seqs + block.quals, axis=1).astype(np.int64)
+
+
+class ReadIndex:
+    """A decompressed copy of a FASTQ file with the spans of its records, memory mapped when used.
+
+    Has the buffer, titles, seqs and quals attributes of a FastqBlock holding every record
+    of the file, so that records can be formatted with _trim.format_records. Only the
+    paths are pickled, so an index can be sent to another worker process.
+
+    Args:
+        path (str): The decompressed copy.
+        spans_path (str): The .npy file of the (n, 6) spans of the records in the copy.
+
+    """
+    def __init__(self, path: str, spans_path: str):
+        self.path = path
+        self.spans_path = spans_path
+        self._buffer = None
+        self._spans = None
+
+    def __getstate__(self):
+        return {"path": self.path, "spans_path": self.spans_path, "_buffer": None, "_spans": None}
+
+    @property
+    def spans(self) -> np.ndarray:
+        if self._spans is None:
+            self._spans = np.load(self.spans_path, mmap_mode='r')
+        return self._spans
+
+    @property
+    def buffer(self) -> np.ndarray:
+        if self._buffer is None:
+            # An empty file cannot be memory mapped.
+            self._buffer = (np.memmap(self.path, dtype=np.uint8, mode='r') if os.path.getsize(self.path)
+                            else np.zeros(0, dtype=np.uint8))
+        return self._buffer
+
+    @property
+    def titles(self) -> tuple:
+        return self.spans[:, 0], self.spans[:, 1]
+
+    @property
+    def seqs(self) -> tuple:
+        return self.spans[:, 2], self.spans[:, 3]
+
+    @property
+    def quals(self) -> tuple:
+        return self.spans[:, 4], self.spans[:, 5]
+
+    def __len__(self):
+        return len(self.spans)
+
+    def read_ids(self, first: int, last: int) -> list:
+        """Returns the read ids of records first to last, as FastqBlock.read_ids does."""
+        if first >= last:
+            return []
+        titles = np.asarray(self.spans[first:last, 0:2])
+        base = int(titles[0, 0])
+        data = self.buffer[base:int(titles[-1, 1])].tobytes()
+        return [data[start - base:end - base].split(None, 1)[0].decode('utf-8') if end > start else ""
+                for start, end in titles.tolist()]
+
+
+def index_fastq(fastq: str, directory: str, name: str) -> ReadIndex:
+    """Decompresses a FASTQ file into a directory and indexes its records.
+
+    Blank lines between records are dropped from the copy, as read_blocks drops them.
+
+    Args:
+        fastq (str): The reads, a .fastq or .fastq.gz file.
+        directory (str): The directory for the copy and its spans.
+        name (str): The file name of the copy, without an extension.
+
+    Returns:
+        (ReadIndex): The index of the copy.
+
+    """
+    path = os.path.join(directory, name + '.fq')
+    spans_path = os.path.join(directory, name + '_spans.npy')
+    parts = []
+    offset = 0
+    with open_fastq(fastq, 'rb') as f, open(path, 'wb') as out:
+        for block in read_blocks(f):
+            out.write(block.data)
+            parts.append(_block_spans(block) + offset)
+            offset += len(block.data)
+    spans = np.concatenate(parts) if parts else np.zeros((0, _SPAN_COLUMNS), dtype=np.int64)
+    np.save(spans_path, spans)
+    return ReadIndex(path, spans_path)
+
+
+class PairIndexer:
+    """Indexes the two read files of a sample on background threads.
+
+    Used as a context manager around the first pass over the reads, such as merging, so
+    that the files are decompressed while the merger runs.
+
+    Args:
+        fastq (str): The forward reads, as used for merging.
+        fastq2 (str): The reverse reads.
+        directory (str): The directory for the copies, such as the sample's temporary directory.
+
+    Attributes:
+        indexes (tuple): (forward ReadIndex, reverse ReadIndex), set when the context exits.
+
+    """
+    def __init__(self, fastq: str, fastq2: str, directory: str):
+        self.fastq = fastq
+        self.fastq2 = fastq2
+        self.directory = directory
+        self.indexes = None
+        self._executor = None
+        self._futures = None
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._futures = (self._executor.submit(index_fastq, self.fastq, self.directory, 'index_r1'),
+                         self._executor.submit(index_fastq, self.fastq2, self.directory, 'index_r2'))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._executor.shutdown(wait=True)
+        if exc_type is None:
+            self.indexes = tuple(future.result() for future in self._futures)
+
+
+def trim_indexed_pairs(index1: ReadIndex, index2: ReadIndex, lookup, positions, out1, out2) -> int:
+    """Writes unmerged read pairs trimmed to the ITS region, from indexed read files.
+
+    The output is the same as that of _trim.trim_fastq_pairs on the original files.
+
+    Args:
+        index1 (ReadIndex): The index of the forward reads.
+        index2 (ReadIndex): The index of the reverse reads.
+        lookup (object): Maps forward read ids to representative numbers, with a lookup(read_ids) method.
+        positions (RepPositions): The ITS positions by representative number.
+        out1 (object): A binary file object for the forward reads.
+        out2 (object): A binary file object for the reverse reads.
+
+    Returns:
+        (int): The number of read pairs written.
+
+    """
+    written = 0
+    # Reverse reads without a forward read are dropped, as zip drops them.
+    n_pairs = min(len(index1), len(index2))
+    for first in range(0, n_pairs, index_chunk):
+        last = min(n_pairs, first + index_chunk)
+        reps = lookup.lookup(index1.read_ids(first, last))
+        known = reps >= 0
+        keep = np.zeros(last - first, dtype=bool)
+        keep[known] = positions.usable[reps[known]]
+        rows = np.flatnonzero(keep)
+        rep = reps[rows]
+        rows += first
+        out1.write(format_records(index1, rows, positions.starts[rep]))
+        out2.write(format_records(index2, rows, positions.tlens[rep] - positions.stops[rep]))
+        written += len(rows)
+    return written
@@ -0,0 +1,135 @@
+"""Sample scheduling for the q2_itsxpress plugin.
+
+Samples in a per_sample_sequences artifact are independent of each other, so they
+can be trimmed concurrently. The user supplies a single thread budget which is split
+between the number of samples running at once and the threads handed to the
+external tools (BBMerge, Vsearch and HMMSearch) inside each sample.
+
+Sample sizes within a run can differ a hundred fold, so samples are not run in
+manifest order. plan_jobs starts the largest samples first, so a large sample never
+starts last and runs on alone, gives samples larger than their share of the run the
+tool threads the other running samples leave free, and packs small samples into
+batches that share one HMMSearch and one worker task.
+
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Small samples are packed into batches of about this fraction of a worker's share of the run.
+batch_fraction = 0.25
+
+
+def plan_threads(threads: int,
+                 n_samples: int,
+                 sample_parallelism: int = 0) -> tuple:
+    """Splits the thread budget between concurrent samples and tool threads.
+
+    Args:
+        threads (int): The total number of processor threads available to the run.
+        n_samples (int): The number of samples to be trimmed.
+        sample_parallelism (int): The number of samples to run at once, 0 selects
+            this automatically.
+
+    Returns:
+        (tuple): (the number of concurrent samples, the threads for each sample)
+
+    """
+    threads = max(1, threads)
+    if sample_parallelism > 0:
+        workers = min(sample_parallelism, threads)
+    else:
+        # Most of the per-sample work is single threaded, so when there are
+        # enough samples one thread per sample keeps every core busy.
+        workers = threads
+    workers = max(1, min(workers, n_samples))
+    inner_threads = max(1, threads // workers)
+    return workers, inner_threads
+
+
+def run_samples(func, samples: list, workers: int) -> list:
+    """Runs a function over every sample, concurrently when more than one worker is used.
+
+    Args:
+        func (callable): A picklable function taking a single sample.
+        samples (list): The samples to process.
+        workers (int): The number of worker processes.
+
+    Returns:
+        (list): The return value of func for each sample, in the order of samples.
+
+    """
+    if workers <= 1 or len(samples) <= 1:
+        return [func(sample) for sample in samples]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, samples))
+
+
+def sample_size(sample: tuple) -> int:
+    """Returns the size of the read files of a sample in bytes.
+
+    Args:
+        sample (tuple): (sample id, forward reads path, reverse reads path or None).
+
+    Returns:
+        (int): The combined size of the read files.
+
+    """
+    return sum(os.path.getsize(path) for path in sample[1:] if path)
+
+
+def plan_jobs(sizes: list, threads: int, workers: int) -> list:
+    """Groups samples into jobs, largest first, with the tool threads for each job.
+
+    A sample is run on its own when it is at least batch_fraction of a worker's share
+    of the run, and gets threads in proportion to its size, but no fewer than the
+    threads of an even split. Smaller samples are packed, smallest first, into batches
+    of about that size, which run with the threads of an even split. The threads beyond
+    an even split are those left once every job that can run at once has an even split,
+    given to the largest samples first, so the jobs running at once never take more
+    than threads between them.
+
+    Args:
+        sizes (list): The size of each sample, as from sample_size.
+        threads (int): The total number of processor threads available to the run.
+        workers (int): The number of jobs running at once.
+
+    Returns:
+        (list): (sample indices, threads) tuples, in the order the jobs should start.
+
+    """
+    threads = max(1, threads)
+    workers = max(1, workers)
+    base_threads = max(1, threads // workers)
+    total = sum(sizes)
+    if not sizes:
+        return []
+    if total == 0:
+        return [([index], base_threads) for index in range(len(sizes))]
+    target = batch_fraction * total / workers
+    order = sorted(range(len(sizes)), key=lambda index: (-sizes[index], index))
+    jobs = []
+    batch = []
+    batch_size = 0
+    large = [index for index in order if sizes[index] >= target]
+    for index in large:
+        jobs.append(([index], base_threads))
+    for index in reversed(order):
+        if sizes[index] >= target:
+            break
+        batch.append(index)
+        batch_size += sizes[index]
+        if batch_size >= target:
+            jobs.append((sorted(batch), base_threads))
+            batch = []
+            batch_size = 0
+    if batch:
+        jobs.append((sorted(batch), base_threads))
+    # Every extra thread is handed out once, so any jobs running together stay within threads.
+    spare = max(0, threads - min(workers, len(jobs)) * base_threads)
+    for position, index in enumerate(large):
+        share = int(round(threads * sizes[index] / total))
+        extra = min(spare, max(0, share - base_threads))
+        jobs[position] = ([index], base_threads + extra)
+        spare -= extra
+    jobs.sort(key=lambda job: -sum(sizes[index] for index in job[0]))
+    return jobs
@@ -0,0 +1,187 @@
+"""Sharded HMMSearch for the q2_itsxpress plugin.
+
+HMMER3 threading stops scaling after a few cores, so a single hmmsearch process
+leaves most of a large node idle. Instead the representative sequences are split
+into shards of balanced total length, one hmmsearch process is run on each shard at
+the same time, and the domain tables are merged before ItsPosition parses them.
+
+Sequence scores do not depend on the size of the database, and the sequence
+E-values and independent domain E-values are kept comparable by passing the full
+number of sequences with -Z. The conditional domain E-values, which --domE is applied
+to, depend on the number of sequences reported for each model, so they are rescaled
+to the whole search when the tables are merged and domains above the default
+reporting threshold are dropped, as a single hmmsearch would have done.
+
+"""
+import heapq
+import logging
+import os
+import subprocess
+import tempfile
+
+from q2_itsxpress._pool import read_fasta
+
+# HMMER keeps one thread busy reading the targets, two threads per process is where it scales well.
+shard_threads = 2
+# Shards smaller than this cost more in process start up and model loading than they save.
+min_shard_size = 500
+# The hmmsearch default for --domE.
+dom_evalue = 10.0
+
+
+def plan_shards(threads: int, n_seqs: int) -> tuple:
+    """Chooses the number of hmmsearch processes and the threads for each.
+
+    Args:
+        threads (int): The number of threads available to the search.
+        n_seqs (int): The number of sequences to search.
+
+    Returns:
+        (tuple): (number of shards, threads for each hmmsearch process)
+
+    """
+    n_shards = max(1, min(threads // shard_threads, n_seqs // min_shard_size))
+    return n_shards, max(1, threads // n_shards)
+
+
+def split_fasta(fasta: str, outdir: str, n_shards: int) -> list:
+    """Splits a FASTA file into shards of balanced total sequence length.
+
+    Each sequence goes to the shard with the fewest residues so far, so shards take
+    about the same time to search even when sequence lengths vary.
+
+    Args:
+        fasta (str): The FASTA file to split.
+        outdir (str): The directory to write the shards to.
+        n_shards (int): The number of shards.
+
+    Returns:
+        (list): The paths of the shard FASTA files.
+
+    """
+    paths = [os.path.join(outdir, "shard{}.fa".format(i)) for i in range(n_shards)]
+    handles = [open(path, 'w') for path in paths]
+    try:
+        heap = [(0, i) for i in range(n_shards)]
+        for seq_id, seq in read_fasta(fasta):
+            size, i = heapq.heappop(heap)
+            handles[i].write(">{}\n{}\n".format(seq_id, seq))
+            heapq.heappush(heap, (size + len(seq), i))
+    finally:
+        for handle in handles:
+            handle.close()
+    return paths
+
+
+def hmmsearch_parameters(hmmfile: str, rep_file: str, dom_file: str,
+                         threads: int, n_targets: int = None) -> list:
+    """Returns the hmmsearch command line used by ITSxpress.
+
+    Args:
+        hmmfile (str): The HMM file of the taxa.
+        rep_file (str): The FASTA file to search.
+        dom_file (str): The domain table to write.
+        threads (int): The number of threads for hmmsearch.
+        n_targets (int): The database size for E-values, None for the number of sequences in rep_file.
+
+    Returns:
+        (list): The command and its arguments.
+
+    """
+    parameters = ["hmmsearch",
+                  "--domtblout",
+                  dom_file,
+                  "-T", "10",
+                  "--cpu", str(threads),
+                  "--tformat", "fasta",
+                  "--F1", "1e-6",
+                  "--F2", "1e-6",
+                  "--F3", "1e-6"]
+    if n_targets is not None:
+        parameters += ["-Z", str(n_targets)]
+    return parameters + [hmmfile, rep_file]
+
+
+def merge_domtables(dom_files: list, dom_file: str) -> None:
+    """Merges the domain tables of the shards into one.
+
+    Args:
+        dom_files (list): The domain tables of the shards.
+        dom_file (str): The merged domain table to write.
+
+    """
+    # HMMER sets the domain database size to the number of sequences reported for
+    # each model, count them per shard and over the whole search.
+    shard_reported = []
+    total_reported = {}
+    for path in dom_files:
+        reported = {}
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.startswith("#"):
+                    ll = line.split()
+                    reported.setdefault(ll[3], set()).add(ll[0])
+        counts = {model: len(targets) for model, targets in reported.items()}
+        for model, count in counts.items():
+            total_reported[model] = total_reported.get(model, 0) + count
+        shard_reported.append(counts)
+    with open(dom_file, 'w') as out:
+        for path, counts in zip(dom_files, shard_reported):
+            with open(path, 'r') as f:
+                for line in f:
+                    if line.startswith("#"):
+                        continue
+                    ll = line.split()
+                    model = ll[3]
+                    # The conditional E-value, the independent E-value already uses -Z.
+                    c_evalue = float(ll[11]) * total_reported[model] / counts[model]
+                    if c_evalue <= dom_evalue:
+                        out.write(line)
+
+
+def sharded_search(rep_file: str, hmmfile: str, dom_file: str,
+                   n_seqs: int, n_shards: int, threads: int) -> None:
+    """Runs one hmmsearch process per shard at the same time and merges their domain tables.
+
+    Args:
+        rep_file (str): The FASTA file to search.
+        hmmfile (str): The HMM file of the taxa.
+        dom_file (str): The merged domain table to write.
+        n_seqs (int): The number of sequences in rep_file.
+        n_shards (int): The number of shards.
+        threads (int): The number of threads for each hmmsearch process.
+
+    Raises:
+        FileNotFoundError: hmmsearch was not found.
+        subprocess.CalledProcessError: hmmsearch failed.
+
+    """
+    with tempfile.TemporaryDirectory(prefix="shards_", dir=os.path.dirname(dom_file)) as shard_dir:
+        shards = split_fasta(rep_file, shard_dir, n_shards)
+        dom_files = [shard + ".domtbl" for shard in shards]
+        procs = []
+        try:
+            for shard, shard_dom in zip(shards, dom_files):
+                parameters = hmmsearch_parameters(hmmfile, shard, shard_dom, threads, n_targets=n_seqs)
+                err = tempfile.TemporaryFile(dir=shard_dir)
+                procs.append((subprocess.Popen(parameters, stdout=subprocess.DEVNULL, stderr=err),
+                              err, parameters))
+        except FileNotFoundError as f:
+            logging.error("hmmsearch was not found, make sure HMMER3 is installed and executable")
+            for p, err, _ in procs:
+                p.kill()
+                p.wait()
+                err.close()
+            raise f
+        failed = None
+        for p, err, parameters in procs:
+            with err:
+                if p.wait() != 0 and failed is None:
+                    err.seek(0)
+                    failed = subprocess.CalledProcessError(p.returncode, parameters,
+                                                           stderr=err.read().decode('utf-8'))
+        if failed is not None:
+            logging.error("Could not perform ITS identification with hmmserach. "
+                          "The error was:\n {}".format(failed.stderr))
+            raise failed
+        merge_domtables(dom_files, dom_file)
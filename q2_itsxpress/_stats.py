@@ -0,0 +1,59 @@
+"""Per-sample trimming statistics for the q2_itsxpress plugin.
+
+The read counts of each sample are taken from the passes the trimming makes anyway:
+BBMerge's summary or the in-process merger for the pairs and merged reads, the
+dereplication for the unique sequences, the ITS positions for the representatives
+with a start and stop to trim to, and the trimmed reads as they are written. With the wall
+time of each stage they make a table with a row for each sample, returned as the
+stats output of the trim actions.
+
+"""
+import pandas as pd
+
+# (key in Profiler.counts, column) of each read count. reads_in is the read pairs for
+# paired end input and the reads otherwise.
+STATS_COUNTS = [("reads_in", "input-reads"),
+                ("merged", "merged-reads"),
+                ("unique", "unique-sequences"),
+                ("its_found", "its-found"),
+                ("reads_out", "trimmed-reads")]
+
+
+def _sample_row(report: dict) -> dict:
+    """Returns the counts and stage throughput of a sample report as a table row."""
+    counts = report.get("stats") or {}
+    row = {column: counts.get(key) for key, column in STATS_COUNTS}
+    if row["input-reads"] is not None and row["trimmed-reads"] is not None:
+        row["dropped-reads"] = row["input-reads"] - row["trimmed-reads"]
+    for record in report["profile"]:
+        stage = record["stage"]
+        row[stage + "-seconds"] = record["wall_time"]
+        if record["reads_in"] is not None and record["wall_time"] > 0:
+            row[stage + "-reads-per-second"] = record["reads_in"] / record["wall_time"]
+    row["restored"] = "yes" if report.get("restored") else "no"
+    return row
+
+
+def stats_table(reports: list) -> pd.DataFrame:
+    """Builds the statistics table of a run from its sample reports.
+
+    Args:
+        reports (list): The reports of a run, reports of batches and pooled searches are skipped.
+
+    Returns:
+        (pd.DataFrame): A row for each sample, indexed by sample-id, with the read counts,
+            the reads dropped, and the seconds and input reads per second of each stage the
+            sample ran by itself. Unknown values are NaN.
+
+    """
+    rows = {}
+    for report in reports:
+        if report["sample_id"] is not None:
+            rows[report["sample_id"]] = _sample_row(report)
+    columns = [column for _, column in STATS_COUNTS] + ["dropped-reads"]
+    for row in rows.values():
+        columns += [column for column in row if column not in columns and column != "restored"]
+    table = pd.DataFrame.from_dict(rows, orient='index', columns=columns + ["restored"])
+    table[columns] = table[columns].astype(float)
+    table.index.name = "sample-id"
+    return table
@@ -0,0 +1,254 @@
+"""Streaming dereplication and trimming for the q2_itsxpress plugin.
+
+The file based workflow writes merged reads, a Vsearch uc file and a full copy of the
+sequences to a temporary directory and reads them back to trim. In streaming mode
+reads flow through generators instead: BBMerge writes merged reads to a pipe, duplicate
+reads are collapsed in memory, and the reads are trimmed in a single pass. As with
+Vsearch --derep_fulllength --strand both in the file based workflow, a read and its
+reverse complement are duplicates and share the representative seen first. Only
+the representative sequence FASTA file and the HMMSearch domain table are written to
+the temporary directory, plus a copy of the merged reads when merged reads are the
+output.
+
+"""
+import contextlib
+import gzip
+import logging
+import os
+import subprocess
+import tempfile
+
+from itsxpress.definitions import maxmismatches, maxratio
+
+from q2_itsxpress._pool import read_fasta, strand_digest
+from q2_itsxpress._fastq import open_fastq, read_fastq, write_fastq, read_id
+from q2_itsxpress._gzip import open_gzip, default_compression_level
+from q2_itsxpress._derep import ReadMap
+from q2_itsxpress._trim import RepPositions, trim_fastq_pairs
+from q2_itsxpress._readindex import PairIndexer, trim_indexed_pairs
+from q2_itsxpress._cluster import write_uniques, cluster_uniques, read_centroids
+from q2_itsxpress._merge import bbmerge_counts
+
+
+class StreamSample:
+    """A sample that is dereplicated and trimmed by streaming its reads.
+
+    Args:
+        fastq (str): The path to the forward reads file.
+        fastq2 (str): The path to the reverse reads file, None for single-end reads.
+        tempdir (str): A directory in which to create the sample's temporary directory.
+        reversed_primers (bool): Primers are in reverse orientation.
+        keep_merged (bool): Keep a copy of the merged reads to write trimmed merged reads from.
+        memory_limit (int): The bytes the read mapping of unmerged output may hold in memory,
+            None for no limit.
+        merger (PairMerger): Merges the reads in process instead of BBMerge, optional.
+        index_reads (bool): Index the read files while they are merged, to write unmerged
+            output from the index.
+
+    Attributes:
+        tempdir (str): The temporary directory of the sample.
+        r1 (str): The forward reads file used for merging.
+        fastq2 (str): The reverse reads file used for merging.
+        seq_file (str): The reads that are trimmed, the input or merged reads.
+        rep_file (str): The FASTA file of unique sequences.
+        repmap (dict): {strand_digest of a sequence: representative id}
+        sizes (dict): {unique sequence id: number of reads}
+        readmap (ReadMap): The representative of each merged pair, used for unmerged output.
+        n_reads (int): The number of reads dereplicated, after merging for paired reads.
+        n_pairs (int): The number of read pairs merged, None for single-end reads or when
+            BBMerge did not report it.
+        read_index (tuple): (forward ReadIndex, reverse ReadIndex) of r1 and fastq2, when indexed.
+
+    """
+    def __init__(self, fastq, fastq2=None, tempdir=None, reversed_primers=False, keep_merged=True,
+                 memory_limit=None, merger=None, index_reads=False):
+        self.tempdir = tempfile.mkdtemp(prefix='itsxpress_', dir=tempdir)
+        self.fastq = fastq
+        if fastq2 and reversed_primers:
+            self.r1 = fastq2
+            self.fastq2 = fastq
+        else:
+            self.r1 = fastq
+            self.fastq2 = fastq2
+        self.keep_merged = keep_merged
+        self.memory_limit = memory_limit
+        self.merger = merger
+        self.index_reads = index_reads
+        self.seq_file = None if fastq2 else fastq
+        self.rep_file = os.path.join(self.tempdir, 'rep.fa')
+        self.repmap = {}
+        self.sizes = {}
+        self.readmap = None
+        self.n_reads = 0
+        self.n_pairs = None
+        self.read_index = None
+
+    def _merged_reads(self, threads: int):
+        """Runs BBMerge and yields the merged reads from its standard output.
+
+        Reads are merged in process instead when the sample has a merger.
+
+        Args:
+            threads (int): The number of threads for BBMerge.
+
+        Yields:
+            (tuple): FASTQ records as returned by read_fastq.
+
+        """
+        if self.merger is not None:
+            counter = [0]
+            with open_fastq(self.r1) as f, open_fastq(self.fastq2) as g:
+                yield from self.merger.merge(read_fastq(f), read_fastq(g), threads=threads, counter=counter)
+            self.n_pairs = counter[0]
+            return
+        parameters = ['bbmerge.sh',
+                      'in=' + self.r1,
+                      'in2=' + self.fastq2,
+                      'out=stdout.fq',
+                      't=' + str(threads),
+                      'maxmismatches=' + str(maxmismatches),
+                      'maxratio=' + str(maxratio)]
+        # stderr goes to a file so a chatty BBMerge can never block on a full pipe.
+        with tempfile.TemporaryFile(dir=self.tempdir) as err:
+            try:
+                p1 = subprocess.Popen(parameters, stdout=subprocess.PIPE, stderr=err,
+                                      universal_newlines=True)
+            except FileNotFoundError as f:
+                logging.error("BBmerge was not found, make sure BBmerge is executable")
+                raise f
+            with p1.stdout:
+                yield from read_fastq(p1.stdout)
+            returncode = p1.wait()
+            err.seek(0)
+            msg = err.read().decode('utf-8')
+            self.n_pairs = bbmerge_counts(msg)[0]
+            if returncode != 0:
+                logging.error("Could not perform read merging with BBmerge. "
+                              "Error from BBmerge was: \n  {}".format(msg))
+                raise subprocess.CalledProcessError(p1.returncode, parameters, stderr=msg)
+
+    def dereplicate(self, threads: int = 1) -> None:
+        """Collapses duplicate reads on either strand and writes one representative of each to rep_file.
+
+        Args:
+            threads (int): The number of threads for BBMerge.
+
+        """
+        indexer = None
+        with contextlib.ExitStack() as stack:
+            if self.fastq2:
+                if not self.keep_merged:
+                    self.readmap = ReadMap(memory_limit=self.memory_limit, tempdir=self.tempdir)
+                    if self.index_reads:
+                        # The read files are indexed while they are merged.
+                        indexer = stack.enter_context(PairIndexer(self.r1, self.fastq2, self.tempdir))
+                records = self._merged_reads(threads)
+            else:
+                handle = open_fastq(self.seq_file)
+                records = read_fastq(handle)
+            spool = None
+            if self.fastq2 and self.keep_merged:
+                # The merged reads are the output, so they are needed again to trim.
+                self.seq_file = os.path.join(self.tempdir, 'seq.fq.gz')
+                spool = gzip.open(self.seq_file, 'wt', compresslevel=1)
+            try:
+                with open(self.rep_file, 'w') as rep:
+                    for title, seq, qual in records:
+                        seq_id = read_id(title)
+                        digest = strand_digest(seq)
+                        rep_id = self.repmap.get(digest)
+                        if rep_id is None:
+                            rep_id = self.repmap[digest] = seq_id
+                            rep.write(">{}\n{}\n".format(seq_id, seq))
+                            self.sizes[rep_id] = 0
+                        self.sizes[rep_id] += 1
+                        if spool:
+                            write_fastq(spool, title, seq, qual)
+                        if self.readmap is not None:
+                            self.readmap.add(seq_id, rep_id)
+                        self.n_reads += 1
+                if self.readmap is not None:
+                    self.readmap.close()
+            finally:
+                if spool:
+                    spool.close()
+                if not self.fastq2:
+                    handle.close()
+        if indexer is not None:
+            self.read_index = indexer.indexes
+
+    def cluster(self, threads: int = 1, cluster_id: float = 0.995) -> None:
+        """Clusters the unique sequences found by dereplicate, weighted by their abundance.
+
+        The centroids replace the unique sequences in rep_file, and the reads of each
+        unique sequence are mapped to its centroid.
+
+        Args:
+            threads (int): The number of threads for Vsearch.
+            cluster_id (float): The percent identity for clustering.
+
+        """
+        uniques_file = os.path.join(self.tempdir, 'uniques.fa')
+        unique_uc = os.path.join(self.tempdir, 'uniques.uc')
+        write_uniques([(seq_id, seq, self.sizes[seq_id]) for seq_id, seq in read_fasta(self.rep_file)],
+                      uniques_file)
+        cluster_uniques(uniques_file, self.rep_file, unique_uc, cluster_id=cluster_id, threads=threads)
+        centroids = read_centroids(unique_uc)
+        self.repmap = {digest: centroids[rep_id] for digest, rep_id in self.repmap.items()}
+        if self.readmap is not None:
+            self.readmap.rename(centroids)
+        os.remove(uniques_file)
+        os.remove(unique_uc)
+
+    def create_trimmed_seqs(self, outfile: str, gzipped: bool, itspos,
+                            compresslevel: int = default_compression_level, threads: int = 1) -> int:
+        """Writes the reads trimmed to the selected region.
+
+        Args:
+            outfile (str): The file to write the sequences to.
+            gzipped (bool): Should the file be gzipped?
+            itspos (object): An ItsPosition or PositionTable object.
+            compresslevel (int): The gzip compression level.
+            threads (int): The number of compression threads.
+
+        Returns:
+            (int): The number of reads written.
+
+        """
+        written = 0
+        out = open_gzip(outfile, compresslevel, threads) if gzipped else open(outfile, 'w')
+        with out, open_fastq(self.seq_file) as f:
+            for title, seq, qual in read_fastq(f):
+                try:
+                    start, stop, tlen = itspos.get_position(self.repmap[strand_digest(seq)])
+                except KeyError:
+                    continue
+                if start and stop and start < stop:
+                    write_fastq(out, title, seq[start:stop], qual[start:stop])
+                    written += 1
+        return written
+
+    def create_paired_trimmed_seqs(self, outfile1: str, outfile2: str, gzipped: bool, itspos,
+                                   compresslevel: int = default_compression_level, threads: int = 1) -> int:
+        """Writes unmerged read pairs trimmed to the selected region.
+
+        Args:
+            outfile1 (str): The file to write the forward sequences to.
+            outfile2 (str): The file to write the reverse sequences to.
+            gzipped (bool): Should the files be gzipped?
+            itspos (object): An ItsPosition or PositionTable object.
+            compresslevel (int): The gzip compression level.
+            threads (int): The number of compression threads for each file.
+
+        Returns:
+            (int): The number of read pairs written.
+
+        """
+        def _open(outfile):
+            return open_gzip(outfile, compresslevel, threads, binary=True) if gzipped else open(outfile, 'wb')
+
+        positions = RepPositions(self.readmap.rep_names, itspos)
+        with _open(outfile1) as out1, _open(outfile2) as out2:
+            if self.read_index is not None:
+                return trim_indexed_pairs(*self.read_index, self.readmap, positions, out1, out2)
+            return trim_fastq_pairs(self.r1, self.fastq2, self.readmap, positions, out1, out2)
@@ -0,0 +1,35 @@
+"""The transformers of the q2_itsxpress plugin, registered when plugin_setup is imported."""
+import pandas as pd
+import qiime2
+
+from q2_itsxpress.plugin_setup import plugin
+from q2_itsxpress._format import ITSxpressStatsFormat, ITSPositionIndexFormat
+
+
+@plugin.register_transformer
+def _1(data: pd.DataFrame) -> ITSxpressStatsFormat:
+    ff = ITSxpressStatsFormat()
+    qiime2.Metadata(data).save(str(ff))
+    return ff
+
+
+@plugin.register_transformer
+def _2(ff: ITSxpressStatsFormat) -> qiime2.Metadata:
+    return qiime2.Metadata.load(str(ff))
+
+
+@plugin.register_transformer
+def _3(ff: ITSxpressStatsFormat) -> pd.DataFrame:
+    return qiime2.Metadata.load(str(ff)).to_dataframe()
+
+
+@plugin.register_transformer
+def _4(ff: ITSPositionIndexFormat) -> pd.DataFrame:
+    return pd.read_csv(str(ff), sep="\t", dtype={"digest": str, "hmm": str}, keep_default_na=False)
+
+
+@plugin.register_transformer
+def _5(data: pd.DataFrame) -> ITSPositionIndexFormat:
+    ff = ITSPositionIndexFormat()
+    data.to_csv(str(ff), sep="\t", index=False)
+    return ff
@@ -0,0 +1,333 @@
+"""Batched trimming of FASTQ reads for the q2_itsxpress plugin.
+
+itsxpress trims reads one Biopython record at a time: every read is parsed into a
+SeqRecord, looked up in the read to representative dictionary, sliced and formatted
+again. Here reads are trimmed in blocks. A block of the FASTQ file is read as bytes
+into a numpy array and the title, sequence and quality lines of every record are
+found from the positions of its newlines. The reads are mapped to an integer
+representative index, whose start and stop positions are held in arrays, and the
+trimmed records of the whole block are gathered out of the input buffer in one numpy
+indexing operation and written at once.
+
+The output is the same, byte for byte, as SeqIO.write of the records trimmed by
+itsxpress: the title line and the sequence and quality lines with trailing
+whitespace removed, and sequences sliced with Python's slicing rules.
+
+"""
+import numpy as np
+
+from q2_itsxpress._fastq import open_fastq
+from q2_itsxpress._pool import usable_position
+
+block_bytes = 1 << 22
+
+_NEWLINE = ord("\n")
+_AT = ord("@")
+_WHITESPACE = np.array([ord(c) for c in " \t\n\r\x0b\x0c"], dtype=np.uint8)
+# The literal bytes of a record: "@" at 0, "\n" at 1 and "\n+\n" at 1 to 3.
+_LITERALS = np.frombuffer(b"@\n+\n", dtype=np.uint8)
+
+
+class FastqBlock:
+    """The records of a block of a FASTQ file, as spans of a byte buffer.
+
+    Args:
+        data (bytes): Complete four line FASTQ records.
+
+    Attributes:
+        buffer (np.ndarray): The bytes of the block.
+        titles (tuple): (start, end) arrays of the title lines, without the @.
+        seqs (tuple): (start, end) arrays of the sequence lines.
+        quals (tuple): (start, end) arrays of the quality lines.
+
+    Raises:
+        ValueError: A record does not start with @.
+
+    """
+    def __init__(self, data: bytes):
+        self.data = data
+        self.buffer = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(self.buffer == _NEWLINE).reshape(-1, 4)
+        starts = np.concatenate(([0], newlines[:-1, 3] + 1)) if len(newlines) else newlines[:, 0]
+        if len(starts) and not (self.buffer[starts] == _AT).all():
+            raise ValueError("A FASTQ record does not start with '@'")
+        self.titles = (starts + 1, self._rstrip(starts + 1, newlines[:, 0]))
+        self.seqs = (newlines[:, 0] + 1, self._rstrip(newlines[:, 0] + 1, newlines[:, 1]))
+        self.quals = (newlines[:, 2] + 1, self._rstrip(newlines[:, 2] + 1, newlines[:, 3]))
+
+    def __len__(self):
+        return len(self.titles[0])
+
+    def _rstrip(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Moves line ends back over trailing whitespace, as str.rstrip does."""
+        ends = ends.copy()
+        while True:
+            strip = ends > starts
+            strip[strip] = np.isin(self.buffer[ends[strip] - 1], _WHITESPACE)
+            if not strip.any():
+                return ends
+            ends[strip] -= 1
+
+    def read_ids(self) -> list:
+        """Returns the read id of each record, the title up to the first whitespace."""
+        data = self.data
+        return [data[start:end].split(None, 1)[0].decode('utf-8') if end > start else ""
+                for start, end in zip(self.titles[0].tolist(), self.titles[1].tolist())]
+
+
+def _drop_blank_titles(data: bytes) -> bytes:
+    """Removes blank lines where a title line is expected, as read_fastq skips them.
+
+    data starts at a record, a last line without a newline is kept as it is.
+
+    """
+    lines = data.split(b"\n")
+    kept = []
+    for line in lines[:-1]:
+        if len(kept) % 4 == 0 and not line.strip():
+            continue
+        kept.append(line)
+    kept.append(lines[-1])
+    return b"\n".join(kept)
+
+
+def _aligned(buffer: np.ndarray, newlines: np.ndarray) -> bool:
+    """Returns True if every fourth line of a buffer, from the first, starts with @."""
+    starts = np.concatenate(([0], newlines[3:-1:4] + 1))
+    starts = starts[starts < len(buffer)]
+    return bool((buffer[starts] == _AT).all())
+
+
+def read_blocks(handle, size: int = None):
+    """Reads a FASTQ file in blocks of complete records.
+
+    Args:
+        handle (object): A binary file object.
+        size (int): The bytes read at a time, block_bytes if None.
+
+    Yields:
+        (FastqBlock): The records of each block.
+
+    """
+    size = size or block_bytes
+    carry = b""
+    while True:
+        chunk = handle.read(size)
+        data = carry + chunk
+        if not chunk:
+            # The last record may lack a final newline, and blank lines may follow it.
+            data = _drop_blank_titles(data.rstrip(b"\r\n") + b"\n") if data.strip() else b""
+            if data:
+                yield FastqBlock(data)
+            return
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buffer == _NEWLINE)
+        if len(newlines) and not _aligned(buffer, newlines):
+            # Blank lines between records shift the four line layout, they are rare enough to drop slowly.
+            data = _drop_blank_titles(data)
+            newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == _NEWLINE)
+        complete = len(newlines) - len(newlines) % 4
+        if complete == 0:
+            carry = data
+            continue
+        end = int(newlines[complete - 1]) + 1
+        carry = data[end:]
+        yield FastqBlock(data[:end])
+
+
+class RepPositions:
+    """The ITS positions of representative sequences, as arrays indexed by representative number.
+
+    Args:
+        rep_names (list): The representative ids, in representative number order.
+        itspos (object): An ItsPosition or PositionTable object.
+
+    Attributes:
+        starts (np.ndarray): The start of the ITS in each representative.
+        stops (np.ndarray): The stop of the ITS in each representative.
+        tlens (np.ndarray): The length of each representative.
+        usable (np.ndarray): True where the ITS has a start and stop, and the start is before the stop.
+
+    """
+    def __init__(self, rep_names: list, itspos):
+        n = len(rep_names)
+        self.starts = np.zeros(n, dtype=np.int64)
+        self.stops = np.zeros(n, dtype=np.int64)
+        self.tlens = np.zeros(n, dtype=np.int64)
+        self.usable = np.zeros(n, dtype=bool)
+        for index, name in enumerate(rep_names):
+            try:
+                start, stop, tlen = itspos.get_position(name)
+            except KeyError:
+                continue
+            if usable_position((start, stop, tlen)):
+                self.starts[index] = start
+                self.stops[index] = stop
+                # tlen is only needed for paired reads, None only matters if it is used.
+                self.tlens[index] = tlen if tlen is not None else 0
+                self.usable[index] = True
+
+
+class DictLookup:
+    """Maps read ids to representative numbers through a {read id: representative id} dictionary.
+
+    Args:
+        matchdict (dict): {read id: representative id}, as itsxpress.Dedup.matchdict.
+
+    Attributes:
+        rep_names (list): The representative ids, by representative number.
+
+    """
+    def __init__(self, matchdict: dict):
+        self.matchdict = matchdict
+        self.rep_names = sorted(set(matchdict.values()))
+        self._rep_index = {name: index for index, name in enumerate(self.rep_names)}
+
+    def lookup(self, read_ids: list) -> np.ndarray:
+        """Returns the representative number of each read id, -1 for unknown reads."""
+        rep_index = self._rep_index
+        matchdict = self.matchdict
+        return np.fromiter((rep_index.get(matchdict.get(read_id), -1) for read_id in read_ids),
+                           dtype=np.int64, count=len(read_ids))
+
+
+def _slice_bounds(index: np.ndarray, length: np.ndarray) -> np.ndarray:
+    """Resolves slice indices against sequence lengths as Python slicing does."""
+    return np.where(index < 0, np.maximum(index + length, 0), np.minimum(index, length))
+
+
+def format_records(block: FastqBlock, rows: np.ndarray, starts: np.ndarray, stops: np.ndarray = None) -> bytes:
+    """Formats records of a block with their sequences and qualities sliced.
+
+    Args:
+        block (FastqBlock): The block holding the records, or an object with the same
+            buffer, titles, seqs and quals attributes.
+        rows (np.ndarray): The records to write, in order.
+        starts (np.ndarray): The slice start of each record.
+        stops (np.ndarray): The slice stop of each record, None to keep the rest of the read.
+
+    Returns:
+        (bytes): The FASTQ records, in the layout SeqIO.write uses.
+
+    """
+    if not len(rows):
+        return b""
+    title_start = block.titles[0][rows]
+    title_len = block.titles[1][rows] - title_start
+    seq_start = block.seqs[0][rows]
+    seq_len = block.seqs[1][rows] - seq_start
+    qual_start = block.quals[0][rows]
+    lo = _slice_bounds(starts, seq_len)
+    hi = seq_len if stops is None else _slice_bounds(stops, seq_len)
+    kept = np.maximum(hi - lo, 0)
+    literal = len(block.buffer)
+    # Seven segments per record: @, title, newline, sequence, newline + newline, quality, newline.
+    offsets = np.stack([np.full_like(rows, literal), title_start, np.full_like(rows, literal + 1),
+                        seq_start + lo, np.full_like(rows, literal + 1), qual_start + lo,
+                        np.full_like(rows, literal + 1)], axis=1).ravel()
+    lengths = np.stack([np.ones_like(rows), title_len, np.ones_like(rows), kept,
+                        np.full_like(rows, 3), kept, np.ones_like(rows)], axis=1).ravel()
+    ends = np.cumsum(lengths)
+    total = int(ends[-1])
+    gather = np.arange(total, dtype=np.int64) + np.repeat(offsets - (ends - lengths), lengths)
+    # The literals are indexed past the end of the buffer, which is not copied to append them.
+    literals = gather >= literal
+    records = np.empty(total, dtype=np.uint8)
+    records[~literals] = block.buffer[gather[~literals]]
+    records[literals] = _LITERALS[gather[literals] - literal]
+    return records.tobytes()
+
+
+def trim_fastq(fastq: str, lookup, positions: RepPositions, out) -> int:
+    """Writes reads trimmed to the ITS region of their representative.
+
+    Args:
+        fastq (str): The reads, a .fastq or .fastq.gz file.
+        lookup (object): Maps read ids to representative numbers, with a lookup(read_ids) method.
+        positions (RepPositions): The ITS positions by representative number.
+        out (object): A binary file object.
+
+    Returns:
+        (int): The number of reads written.
+
+    """
+    written = 0
+    with open_fastq(fastq, 'rb') as f:
+        for block in read_blocks(f):
+            reps = lookup.lookup(block.read_ids())
+            known = reps >= 0
+            keep = np.zeros(len(block), dtype=bool)
+            keep[known] = positions.usable[reps[known]]
+            rows = np.flatnonzero(keep)
+            out.write(format_records(block, rows, positions.starts[reps[rows]], positions.stops[reps[rows]]))
+            written += len(rows)
+    return written
+
+
+class BlockReader:
+    """Takes runs of records from a FASTQ file, to keep the blocks of two files in step.
+
+    Args:
+        handle (object): A binary file object.
+
+    """
+    def __init__(self, handle):
+        self._blocks = read_blocks(handle)
+        self._block = None
+        self._offset = 0
+
+    def take(self, count: int) -> FastqBlock:
+        """Returns a block of the next count records, fewer at the end of the file."""
+        parts = []
+        while count > 0:
+            if self._block is None or self._offset >= len(self._block):
+                self._block = next(self._blocks, None)
+                self._offset = 0
+                if self._block is None:
+                    break
+            last = min(len(self._block), self._offset + count)
+            parts.append(_record_bytes(self._block, self._offset, last))
+            count -= last - self._offset
+            self._offset = last
+        return FastqBlock(b"".join(parts))
+
+
+def _record_bytes(block: FastqBlock, first: int, last: int) -> bytes:
+    """Returns the bytes of the records first to last of a block."""
+    start = int(block.titles[0][first]) - 1
+    end = len(block.data) if last >= len(block) else int(block.titles[0][last]) - 1
+    return block.data[start:end]
+
+
+def trim_fastq_pairs(fastq: str, fastq2: str, lookup, positions: RepPositions, out1, out2) -> int:
+    """Writes unmerged read pairs trimmed to the ITS region of their merged representative.
+
+    Args:
+        fastq (str): The forward reads, a .fastq or .fastq.gz file.
+        fastq2 (str): The reverse reads.
+        lookup (object): Maps forward read ids to representative numbers, with a lookup(read_ids) method.
+        positions (RepPositions): The ITS positions by representative number.
+        out1 (object): A binary file object for the forward reads.
+        out2 (object): A binary file object for the reverse reads.
+
+    Returns:
+        (int): The number of read pairs written.
+
+    """
+    written = 0
+    with open_fastq(fastq, 'rb') as f, open_fastq(fastq2, 'rb') as g:
+        reverse = BlockReader(g)
+        for block in read_blocks(f):
+            block2 = reverse.take(len(block))
+            reps = lookup.lookup(block.read_ids())
+            known = reps >= 0
+            keep = np.zeros(len(block), dtype=bool)
+            keep[known] = positions.usable[reps[known]]
+            # Reverse reads without a forward read are dropped, as zip drops them.
+            keep[len(block2):] = False
+            rows = np.flatnonzero(keep)
+            rep = reps[rows]
+            out1.write(format_records(block, rows, positions.starts[rep]))
+            out2.write(format_records(block2, rows, positions.tlens[rep] - positions.stops[rep]))
+            written += len(rows)
+    return written
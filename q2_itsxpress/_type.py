@@ -0,0 +1,9 @@
+"""The semantic types of the q2_itsxpress plugin."""
+from q2_types.sample_data import SampleData
+from qiime2.plugin import SemanticType
+
+# The read counts and stage throughput of each trimmed sample.
+ITSxpressStats = SemanticType('ITSxpressStats', variant_of=SampleData.field['type'])
+
+# The ITS start and stop positions of known sequences, for each taxa and region.
+ITSPositionIndex = SemanticType('ITSPositionIndex')
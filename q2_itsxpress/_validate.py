@@ -0,0 +1,188 @@
+"""Up-front validation of the input reads for the q2_itsxpress plugin.
+
+itsxpress checks the FASTQ files of each sample just before the sample is merged, so a
+malformed file or a mismatched pair used to surface only when its sample's turn came,
+possibly hours into a run. Here every sample of the manifest is checked before any
+trimming starts, with the samples spread over the worker processes. Only the first
+validation_reads records of each file are read: their layout, the bases and qualities,
+whether the forward and reverse read names pair up, whether the read counts agree as
+far as they are read, and whether a file looks interleaved.
+
+When there is a cache directory, samples that passed are remembered under a fingerprint
+of their files, the size and the first and last MiB, so repeated runs skip them.
+
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from q2_itsxpress._fastq import open_fastq, read_id
+
+validation_reads = 10000
+_FINGERPRINT_BYTES = 1 << 20
+_BASES = re.compile(r"^[ACGTURYKMSWBDHVN.\-]*$", re.IGNORECASE)
+_QUALITIES = re.compile(r"^[!-~]*$")
+
+
+def pair_name(title: str) -> str:
+    """Returns the name shared by the two reads of a pair, the read id without a /1 or /2."""
+    name = read_id(title) if title.strip() else ""
+    if name.endswith(("/1", "/2")):
+        return name[:-2]
+    return name
+
+
+def scan_fastq(path: str, limit: int = validation_reads) -> tuple:
+    """Reads and checks the first records of a FASTQ file.
+
+    Args:
+        path (str): The .fastq or .fastq.gz file.
+        limit (int): The most records to read.
+
+    Returns:
+        (tuple): (the pair names of the records read, True if the file ended within the limit,
+            a description of the first problem found or None)
+
+    """
+    names = []
+    try:
+        with open_fastq(path) as f:
+            while len(names) < limit:
+                title = f.readline()
+                if not title:
+                    return names, True, None
+                if not title.strip():
+                    continue
+                seq = f.readline().rstrip("\n")
+                plus = f.readline()
+                qual = f.readline().rstrip("\n")
+                n = len(names) + 1
+                if not title.startswith("@"):
+                    return names, False, "record {} does not start with '@'".format(n)
+                if not plus.startswith("+"):
+                    return names, False, "record {} has no '+' line".format(n)
+                if len(seq) != len(qual):
+                    return names, False, "record {} has {} bases and {} qualities".format(n, len(seq), len(qual))
+                if not _BASES.match(seq):
+                    return names, False, "record {} has characters that are not bases".format(n)
+                if not _QUALITIES.match(qual):
+                    return names, False, "record {} has invalid quality characters".format(n)
+                names.append(pair_name(title[1:]))
+            return names, not f.readline().strip(), None
+    except FileNotFoundError:
+        return names, False, "the file could not be found"
+    except (OSError, EOFError, UnicodeDecodeError) as e:
+        return names, False, "the file could not be read ({})".format(e)
+
+
+def _interleaved(names: list) -> bool:
+    """Returns True when the records come in pairs with the same name."""
+    if len(names) < 2:
+        return False
+    return all(names[i] == names[i + 1] for i in range(0, len(names) - 1, 2))
+
+
+def validate_sample(sample: tuple, limit: int = validation_reads) -> list:
+    """Checks the read files of a sample.
+
+    Args:
+        sample (tuple): (sample id, forward reads path, reverse reads path or None).
+        limit (int): The most records to read from each file.
+
+    Returns:
+        (list): A description of each problem found, empty for a valid sample.
+
+    """
+    sample_id, forward, reverse = sample
+    errors = []
+    scans = []
+    for role, path in (("forward", forward), ("reverse", reverse)):
+        if path is None:
+            continue
+        names, ended, error = scan_fastq(path, limit=limit)
+        if error:
+            errors.append("{} reads {}: {}".format(role, os.path.basename(path), error))
+        elif _interleaved(names):
+            errors.append("{} reads {}: the file appears to be interleaved".format(role, os.path.basename(path)))
+        scans.append((names, ended))
+    if reverse is not None and not errors:
+        (names1, ended1), (names2, ended2) = scans
+        for n, (name1, name2) in enumerate(zip(names1, names2), 1):
+            if name1 != name2:
+                errors.append("read {} is named {} in the forward reads and {} in the reverse reads".format(
+                    n, name1, name2))
+                break
+        if not errors and (len(names1) != len(names2) or ended1 != ended2):
+            errors.append("the forward and reverse reads have different numbers of reads")
+    return errors
+
+
+def file_fingerprint(path: str) -> str:
+    """Returns a checksum of the size and the first and last MiB of a file."""
+    size = os.path.getsize(path)
+    sha = hashlib.sha1(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        sha.update(f.read(_FINGERPRINT_BYTES))
+        if size > _FINGERPRINT_BYTES:
+            f.seek(max(_FINGERPRINT_BYTES, size - _FINGERPRINT_BYTES))
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+class ValidationCache:
+    """Remembers the samples that passed validation.
+
+    Args:
+        cache_dir (str): The cache directory, validations are kept in its validation subdirectory.
+        limit (int): The most records read from each file.
+
+    """
+    def __init__(self, cache_dir: str, limit: int = validation_reads):
+        self.path = os.path.join(cache_dir, "validation")
+        os.makedirs(self.path, exist_ok=True)
+        self.limit = limit
+
+    def key(self, sample: tuple) -> str:
+        """Returns the cache key of a sample's read files."""
+        sha = hashlib.sha1(str(self.limit).encode('ascii'))
+        for path in sample[1:]:
+            sha.update((file_fingerprint(path) if path else "-").encode('ascii'))
+        return sha.hexdigest()
+
+    def passed(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.path, key + ".json"))
+
+    def add(self, key: str, sample: tuple) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp_")
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"sample_id": sample[0], "files": [os.path.basename(path) for path in sample[1:] if path]}, f)
+        os.replace(tmp, os.path.join(self.path, key + ".json"))
+
+
+def check_sample(sample: tuple, cache_dir: str = None, limit: int = validation_reads) -> list:
+    """Validates a sample, skipping samples that passed before when there is a cache.
+
+    Args:
+        sample (tuple): (sample id, forward reads path, reverse reads path or None).
+        cache_dir (str): The cache directory, or None for no cache.
+        limit (int): The most records to read from each file.
+
+    Returns:
+        (list): A description of each problem found, empty for a valid sample.
+
+    """
+    if cache_dir is None:
+        return validate_sample(sample, limit=limit)
+    cache = ValidationCache(cache_dir, limit=limit)
+    try:
+        key = cache.key(sample)
+    except OSError:
+        return validate_sample(sample, limit=limit)
+    if cache.passed(key):
+        return []
+    errors = validate_sample(sample, limit=limit)
+    if not errors:
+        cache.add(key, sample)
+    return errors
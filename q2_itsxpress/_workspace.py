@@ -0,0 +1,97 @@
+"""A run-scoped scratch workspace for the q2_itsxpress plugin.
+
+itsxpress gives every sample its own directory under the system temporary directory,
+which on clusters is often a shared network file system, and a sample's directory
+leaked whenever a stage raised before the directory was removed. A Workspace is a
+single directory for the whole run, created under a scratch root that can be chosen,
+such as /dev/shm or a local NVMe disk. Every temporary directory of the run is made
+inside it, and the whole workspace is removed when the run ends, whether it finished
+or failed.
+
+"""
+import logging
+import os
+import shutil
+import tempfile
+
+# The scratch space a sample may take, as a multiple of the size of its read files.
+space_factor = 4
+# The extra space of the decompressed, indexed copies of a sample's read files.
+index_space_factor = 5
+# The extra space of the uncompressed chunks of a sample split by chunk_threshold.
+chunk_space_factor = 4
+
+
+def scratch_needed(sizes: list, workers: int, index_reads: bool = False, chunk_threshold: int = 0) -> int:
+    """Estimates the scratch space of a run, from the largest samples that may run at once.
+
+    Args:
+        sizes (list): The size of the read files of each sample in bytes.
+        workers (int): The number of samples running at once.
+        index_reads (bool): The read files are indexed, see _readindex.
+        chunk_threshold (int): Samples larger than this many bytes are split into
+            chunks, see _chunk. 0 when no sample is split.
+
+    Returns:
+        (int): The estimated bytes.
+
+    """
+    factor = space_factor + (index_space_factor if index_reads else 0)
+    split = [size for size in sizes if chunk_threshold and size > chunk_threshold]
+    sizes = [size for size in sizes if not (chunk_threshold and size > chunk_threshold)]
+    needed = factor * sum(sorted(sizes, reverse=True)[:max(1, workers)])
+    # Split samples run one at a time, before the other samples, with their chunks copied out.
+    return max([needed] + [(factor + chunk_space_factor) * size for size in split])
+
+
+class Workspace:
+    """The scratch directory of a run, removed when the run ends.
+
+    Args:
+        scratch_dir (str): The directory to create the workspace in, created if needed.
+            None uses the system temporary directory.
+
+    Attributes:
+        root (str): The workspace directory.
+
+    """
+    def __init__(self, scratch_dir: str = None):
+        if scratch_dir is not None:
+            os.makedirs(scratch_dir, exist_ok=True)
+        self.root = tempfile.mkdtemp(prefix='itsxpress_run_', dir=scratch_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """Removes the workspace and everything in it."""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def mkdtemp(self, prefix: str = 'itsxpress_') -> str:
+        """Creates a temporary directory inside the workspace."""
+        return tempfile.mkdtemp(prefix=prefix, dir=self.root)
+
+    def free_space(self) -> int:
+        """Returns the free bytes of the file system holding the workspace."""
+        return shutil.disk_usage(self.root).free
+
+    def check_space(self, needed: int) -> bool:
+        """Warns when the workspace has less free space than a run is estimated to need.
+
+        Args:
+            needed (int): The estimated bytes, as from scratch_needed.
+
+        Returns:
+            (bool): True if there is enough space.
+
+        """
+        free = self.free_space()
+        if free >= needed:
+            return True
+        logging.warning("The scratch directory {} has {:.1f} GiB free, the run may need about {:.1f} GiB. "
+                        "Set scratch_dir to a larger local disk if it runs out of space.".format(
+                            os.path.dirname(self.root), free / 2 ** 30, needed / 2 ** 30))
+        return False
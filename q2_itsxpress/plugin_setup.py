@@ -1,7 +1,10 @@
+import importlib
+
 from q2_types.per_sample_sequences import (SequencesWithQuality,
                                            PairedEndSequencesWithQuality,
                                            JoinedSequencesWithQuality)
 from q2_types.sample_data import SampleData
+from q2_types.feature_data import FeatureData, Sequence
 from qiime2.plugin import (Plugin,
                            Str,
                            Choices,
@@ -11,10 +14,16 @@ from qiime2.plugin import (Plugin,
                            Bool,
                            Citations)
 
-from q2_itsxpress._itsxpress import (trim_single,
-                                     trim_pair,
-                                     trim_pair_output_unmerged,
-                                     default_cluster_id)
+from q2_itsxpress._type import ITSxpressStats, ITSPositionIndex
+from q2_itsxpress._format import (ITSxpressStatsFormat,
+                                  ITSxpressStatsDirFmt,
+                                  ITSPositionIndexFormat,
+                                  ITSPositionIndexDirFmt)
+from q2_itsxpress._actions import (trim_single,
+                                   trim_pair,
+                                   trim_pair_output_unmerged,
+                                   build_position_index,
+                                   default_cluster_id)
 
 plugin = Plugin(
     name='q2_itsxpress',
@@ -39,26 +48,137 @@ plugin = Plugin(
     citations=Citations.load('citations.bib', package='q2_itsxpress')
 )
 
+plugin.register_semantic_types(ITSxpressStats)
+plugin.register_formats(ITSxpressStatsFormat, ITSxpressStatsDirFmt)
+plugin.register_semantic_type_to_format(SampleData[ITSxpressStats],
+                                        artifact_format=ITSxpressStatsDirFmt)
+plugin.register_semantic_types(ITSPositionIndex)
+plugin.register_formats(ITSPositionIndexFormat, ITSPositionIndexDirFmt)
+plugin.register_semantic_type_to_format(ITSPositionIndex,
+                                        artifact_format=ITSPositionIndexDirFmt)
+
 taxaList = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'L', 'M', 'ALL', 'O', 'P', 'Q', 'R', 'S', 'T', 'U']
 
+# The parameters of every trim command, passed on to main as they are.
+trim_parameters = {
+    'sample_parallelism': Int % Range(0, None),
+    'pool_samples': Bool,
+    'cache_dir': Str,
+    'cache_size': Int % Range(1, None),
+    'stream': Bool,
+    'profile_file': Str,
+    'compression_level': Int % Range(1, 10),
+    'compression_threads': Int % Range(0, None),
+    'checkpoint_dir': Str,
+    'memory_limit': Int % Range(0, None),
+    'collapse_duplicates': Bool,
+    'scratch_dir': Str,
+    'auto_threads': Bool,
+    'tuning_profile': Str,
+    'chunk_threshold': Int % Range(0, None),
+    'chunk_reads': Int % Range(1, None),
+    'pipeline': Bool,
+    'stage_workers': Str
+}
+
+trim_parameter_descriptions = {
+    'sample_parallelism': ('\nThe number of samples to trim at the same time. The threads are shared '
+                           'between concurrent samples. 0 selects this automatically.'),
+    'pool_samples': ('\nDereplicate the unique sequences of all samples together and run '
+                     'HMMSearch once on the pooled set instead of once per sample.'),
+    'cache_dir': ('\nA directory for a persistent cache of ITS positions. Sequences found in '
+                  'the cache are not searched again with HMMSearch. The HMM models prepared for '
+                  'the region are kept there as well. No cache is used if unset.'),
+    'cache_size': ('\nThe maximum number of sequences kept in the ITS position cache. The least '
+                   'recently used sequences are removed first.'),
+    'stream': ('\nStream reads through dereplication and trimming without writing merged or '
+               'dereplicated reads to temporary files. Identical reads, on either strand, are '
+               'collapsed in memory, and with a cluster_id below 1 only the unique sequences are '
+               'clustered with Vsearch.'),
+    'profile_file': ('\nWrite the wall time, CPU time, bytes read and written and read counts '
+                     'of every stage of every sample to this file, as TSV if it ends in .tsv '
+                     'and JSON otherwise.'),
+    'compression_level': ('\nThe gzip compression level of the trimmed reads, from 1 (fastest) '
+                          'to 9 (smallest files).'),
+    'compression_threads': ('\nThe number of threads compressing the output files of each sample while '
+                            'reads are trimmed, split between the forward and reverse files of unmerged '
+                            'output. 0 uses the threads available to each sample.'),
+    'checkpoint_dir': ('\nKeep the trimmed reads of each finished sample in this directory. When a '
+                       'run is repeated with the same inputs and parameters, the samples found there '
+                       'are reused and only the remaining samples are trimmed.'),
+    'memory_limit': ('\nThe MiB of memory each sample may use to map reads to their unique '
+                     'sequences. Beyond it the mapping is sorted and spilled to disk, so memory '
+                     'use stays flat for very deep samples. 0 keeps the mapping in memory.'),
+    'collapse_duplicates': ('\nCollapse identical reads and count their abundance before clustering, '
+                            'so Vsearch only clusters the unique sequences, most abundant first. '
+                            'Only used when cluster_id is below 1.'),
+    'scratch_dir': ('\nThe directory for the run\'s temporary files, such as /dev/shm or a local disk. '
+                    'Every temporary file is made in one directory there, removed when the run ends '
+                    'or fails. Defaults to the system temporary directory.'),
+    'auto_threads': ('\nChoose the number of samples trimmed at once and the threads given to merging, '
+                     'dereplication and HMMSearch from how well each scales on this machine, measured '
+                     'on the largest sample or read from tuning_profile. The chosen plan is logged. '
+                     'Replaces sample_parallelism.'),
+    'tuning_profile': ('\nA profile_file written by an earlier run on this machine, used by auto_threads '
+                       'instead of measuring the largest sample.'),
+    'chunk_threshold': ('\nSplit samples whose read files are larger than this many MiB into chunks of '
+                        'chunk_reads reads, which are merged, dereplicated and trimmed in parallel with '
+                        'one HMMSearch over the unique sequences of the whole sample. Their trimmed '
+                        'reads are joined in read order. 0 never splits samples.'),
+    'chunk_reads': ('\nThe number of reads, or read pairs, in each chunk of a sample split by '
+                    'chunk_threshold.'),
+    'pipeline': ('\nRun merging, dereplication, HMMSearch and writing as a pipeline, so the stages of '
+                 'different samples overlap. Samples start in manifest order for as long as the free '
+                 'scratch space and memory allow. Replaces sample_parallelism, and cannot be combined '
+                 'with pool_samples. Records written to profile_file are marked as pipelined and not '
+                 'used by auto_threads.'),
+    'stage_workers': ('\nThe number of samples each pipeline stage works on at once, such as '
+                      '"merge=2,search=1,write=2". Stages not given get one. The threads are split '
+                      'between the workers of all stages.')
+}
+
+# The parameters of the paired-end trim commands that control merging.
+merge_parameters = {
+    'native_merge': Bool,
+    'merge_min_overlap': Int % Range(1, None),
+    'merge_max_mismatch_rate': Float % Range(0, 1, inclusive_end=True)
+}
+
+merge_parameter_descriptions = {
+    'native_merge': ('\nMerge read pairs in process instead of with BBMerge, avoiding the start up '
+                     'of a Java process and the temporary merged read files. Only the merged pairs '
+                     'are kept, as with BBMerge.'),
+    'merge_min_overlap': ('\nThe shortest overlap between the reads of a pair that native_merge accepts.'),
+    'merge_max_mismatch_rate': ('\nThe highest fraction of mismatched bases that native_merge accepts '
+                                'in an overlap.')
+}
+
 plugin.methods.register_function(
     function=trim_single,
-    inputs={'per_sample_sequences': SampleData[SequencesWithQuality]},
+    inputs={'per_sample_sequences': SampleData[SequencesWithQuality],
+            'position_index': ITSPositionIndex},
     parameters={'region': Str % Choices(['ITS2', 'ITS1', 'ALL']),
                 'taxa': Str % Choices(taxaList),
                 'threads': Int,
-                'cluster_id': Float % Range(0.97, 1.0, inclusive_start=True, inclusive_end=True)},
-    outputs=[('trimmed', SampleData[SequencesWithQuality])],
+                'cluster_id': Float % Range(0.97, 1.0, inclusive_start=True, inclusive_end=True),
+                **trim_parameters},
+    outputs=[('trimmed', SampleData[SequencesWithQuality]),
+             ('stats', SampleData[ITSxpressStats])],
     input_descriptions={'per_sample_sequences': 'The artifact that contains the sequence file(s).'
                                                 ' Either Joined Paired or just a single fastq.'
-                                                ' One file sequences in the qza data folder.'},
+                                                ' One file sequences in the qza data folder.',
+                        'position_index': 'An ITS position index made by build-position-index. '
+                                          'Sequences found in it are not searched with HMMSearch.'},
     parameter_descriptions={
         'region': ('\nThe regions ITS2, ITS1, and ALL that can be selected from.'),
         'taxa': ('\nThe selected taxonomic group sequenced that can be selected from.'),
         'threads': ('\nThe number of processor threads to use in the run.'),
-        'cluster_id': ('\nThe percent identity for clustering reads, set to 1 for exact dereplication.')
+        'cluster_id': ('\nThe percent identity for clustering reads, set to 1 for exact dereplication.'),
+        **trim_parameter_descriptions
     },
-    output_descriptions={'trimmed': 'The trimmed sequences from ITSxpress.'},
+    output_descriptions={'trimmed': 'The trimmed sequences from ITSxpress.',
+                         'stats': 'The read counts of each sample after merging, dereplication, the ITS '
+                                  'search and trimming, with the time and reads per second of each stage.'},
     name='Trim single-end reads',
     description='ITSxpress trimSingle is used for qza types with\n'
                 'SquencesWithQuality or JoinedSequencesWithQuality.'
@@ -89,24 +209,34 @@ plugin.methods.register_function(
 
 plugin.methods.register_function(
     function=trim_pair,
-    inputs={'per_sample_sequences': SampleData[PairedEndSequencesWithQuality]},
+    inputs={'per_sample_sequences': SampleData[PairedEndSequencesWithQuality],
+            'position_index': ITSPositionIndex},
     parameters={'region': Str % Choices(['ITS2', 'ITS1', 'ALL']),
                 'taxa': Str % Choices(taxaList),
                 'threads': Int,
                 'reversed_primers': Bool,
-                'cluster_id': Float % Range(0.97, 1.0, inclusive_start=True, inclusive_end=True)},
-    outputs=[('trimmed', SampleData[JoinedSequencesWithQuality])],
+                'cluster_id': Float % Range(0.97, 1.0, inclusive_start=True, inclusive_end=True),
+                **trim_parameters,
+                **merge_parameters},
+    outputs=[('trimmed', SampleData[JoinedSequencesWithQuality]),
+             ('stats', SampleData[ITSxpressStats])],
     input_descriptions={'per_sample_sequences': 'The artifact that contains the sequence file(s). '
                                                 'Only Paired can be used. '
-                                                'Two files sequences in the qza data folder'},
+                                                'Two files sequences in the qza data folder',
+                        'position_index': 'An ITS position index made by build-position-index. '
+                                          'Sequences found in it are not searched with HMMSearch.'},
     parameter_descriptions={
         'region': ('\nThe regions ITS2, ITS1, and ALL that can be selected from.'),
         'taxa': ('\nThe selected taxonomic group sequenced that can be selected from.'),
         'threads': ('\nThe number of processor threads to use in the run.'),
         'cluster_id': ('\nThe percent identity for clustering reads, set to 1 for exact dereplication.'),
-        'reversed_primers': ('\n Primers are in reverse orientation as in Taylor et al. 2016, DOI:10.1128/AEM.02576-16.')
+        'reversed_primers': ('\n Primers are in reverse orientation as in Taylor et al. 2016, DOI:10.1128/AEM.02576-16.'),
+        **trim_parameter_descriptions,
+        **merge_parameter_descriptions
     },
-    output_descriptions={'trimmed': 'The resulting trimmed sequences from ITSxpress'},
+    output_descriptions={'trimmed': 'The resulting trimmed sequences from ITSxpress',
+                         'stats': 'The read counts of each sample after merging, dereplication, the ITS '
+                                  'search and trimming, with the time and reads per second of each stage.'},
     name='Trim paired-end reads, output merged reads for use with Deblur',
     description='ITSxpress trimPair takes the qza type \n'
                 'PairedEndSquencesWithQuality. The qza\n'
@@ -138,24 +268,39 @@ plugin.methods.register_function(
 
 plugin.methods.register_function(
     function=trim_pair_output_unmerged,
-    inputs={'per_sample_sequences': SampleData[PairedEndSequencesWithQuality]},
+    inputs={'per_sample_sequences': SampleData[PairedEndSequencesWithQuality],
+            'position_index': ITSPositionIndex},
     parameters={'region': Str % Choices(['ITS2', 'ITS1', 'ALL']),
                 'taxa': Str % Choices(taxaList),
                 'threads': Int,
                 'reversed_primers': Bool,
-                'cluster_id': Float % Range(0.97, 1.0, inclusive_start=True, inclusive_end=True)},
-    outputs=[('trimmed', SampleData[PairedEndSequencesWithQuality])],
+                'cluster_id': Float % Range(0.97, 1.0, inclusive_start=True, inclusive_end=True),
+                'index_reads': Bool,
+                **trim_parameters,
+                **merge_parameters},
+    outputs=[('trimmed', SampleData[PairedEndSequencesWithQuality]),
+             ('stats', SampleData[ITSxpressStats])],
     input_descriptions={'per_sample_sequences': 'The artifact that contains the sequence file(s). '
                                                 'Only Paired can be used. '
-                                                'Two files sequences in the qza data folder'},
+                                                'Two files sequences in the qza data folder',
+                        'position_index': 'An ITS position index made by build-position-index. '
+                                          'Sequences found in it are not searched with HMMSearch.'},
     parameter_descriptions={
         'region': ('\nThe regions ITS2, ITS1, and ALL that can be selected from.'),
         'taxa': ('\nThe selected taxonomic group sequenced that can be selected from.'),
         'threads': ('\nThe number of processor threads to use in the run.'),
         'cluster_id': ('\nThe percent identity for clustering reads, set to 1 for exact dereplication.'),
-        'reversed_primers': ('\n Primers are in reverse orientation as in Taylor et al. 2016, DOI:10.1128/AEM.02576-16.')
+        'reversed_primers': ('\n Primers are in reverse orientation as in Taylor et al. 2016, DOI:10.1128/AEM.02576-16.'),
+        'index_reads': ('\nDecompress and index the read files of each sample in the scratch directory '
+                        'while its pairs are merged. The unmerged reads are then written from the index, '
+                        'reading only the pairs whose ITS was found instead of decompressing both files '
+                        'again. Takes scratch space of several times the size of the read files.'),
+        **trim_parameter_descriptions,
+        **merge_parameter_descriptions
     },
-    output_descriptions={'trimmed': 'The resulting trimmed sequences from ITSxpress'},
+    output_descriptions={'trimmed': 'The resulting trimmed sequences from ITSxpress',
+                         'stats': 'The read counts of each sample after merging, dereplication, the ITS '
+                                  'search and trimming, with the time and reads per second of each stage.'},
     name='Trim paired-end reads, output unmerged reads for use with Dada2',
     description='ITSxpress trimPairUnmerged takes the qza type \n'
                 'PairedEndSquencesWithQuality. The qza\n'
@@ -184,3 +329,35 @@ plugin.methods.register_function(
                 '\nALL = All'
 
 )
+
+plugin.methods.register_function(
+    function=build_position_index,
+    inputs={'reference_sequences': FeatureData[Sequence],
+            'previous_index': ITSPositionIndex},
+    parameters={'taxa': Str % Choices(taxaList),
+                'threads': Int,
+                'cache_dir': Str,
+                'scratch_dir': Str},
+    outputs=[('position_index', ITSPositionIndex)],
+    input_descriptions={'reference_sequences': 'Sequences, such as the ITS variants of a reference '
+                                               'database, searched with HMMSearch for each region.',
+                        'previous_index': 'An index whose positions are kept in the new index.'},
+    parameter_descriptions={
+        'taxa': ('\nThe taxonomic group the reference sequences are searched with.'),
+        'threads': ('\nThe number of processor threads to use in the search.'),
+        'cache_dir': ('\nAn ITS position cache directory, as used by the trim commands, whose '
+                      'positions are added to the index.'),
+        'scratch_dir': ('\nThe directory for the search\'s temporary files, such as a local disk. They are '
+                        'made in one directory there, removed when the search ends or fails. Defaults to the '
+                        'system temporary directory.')
+    },
+    output_descriptions={'position_index': 'The ITS start and stop sites of each sequence for each '
+                                           'taxa, region and HMM file.'},
+    name='Build an ITS position index',
+    description='Builds an index of ITS positions that the trim commands use before searching with '
+                'HMMSearch, so the positions of known sequences are found once and shared between '
+                'studies. Positions come from a search of reference sequences, an ITS position cache '
+                'and an earlier index, at least one of which must be given.'
+)
+
+importlib.import_module('q2_itsxpress._transformer')
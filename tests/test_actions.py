@@ -0,0 +1,24 @@
+import inspect
+import subprocess
+import sys
+import unittest
+
+
+class LazyImportTests(unittest.TestCase):
+    def test_plugin_setup_defers_trimming_imports(self):
+        modules = ('itsxpress', 'Bio', 'q2_itsxpress._itsxpress', 'q2_itsxpress._pairmerge',
+                   'q2_itsxpress._chunk', 'q2_itsxpress._trim', 'q2_itsxpress._gzip', 'q2_itsxpress._cache')
+        code = ("import sys, q2_itsxpress.plugin_setup; "
+                "print([m for m in {!r} if m in sys.modules])".format(modules))
+        p = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True)
+        self.assertEqual(p.stdout.decode('utf-8').strip(), "[]")
+
+
+class ForwardedParametersTests(unittest.TestCase):
+    def test_main_accepts_every_action_parameter(self):
+        from q2_itsxpress._actions import trim_single, trim_pair, trim_pair_output_unmerged
+        from q2_itsxpress._itsxpress import main
+        accepted = inspect.signature(main).parameters
+        for action in (trim_single, trim_pair, trim_pair_output_unmerged):
+            with self.subTest(action=action.__name__):
+                self.assertEqual([p for p in inspect.signature(action).parameters if p not in accepted], [])
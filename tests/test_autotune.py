@@ -0,0 +1,75 @@
+import unittest
+
+from q2_itsxpress._autotune import (calibrate,
+                                    plan_stages,
+                                    stage_time,
+                                    ThreadPlan,
+                                    default_parallel_fractions)
+
+
+def _record(stage, threads, wall_time, cpu_time=0.0):
+    return {"sample_id": "s1", "stage": stage, "threads": threads, "wall_time": wall_time,
+            "cpu_time": 0.0, "child_cpu_time": cpu_time}
+
+
+class CalibrateTests(unittest.TestCase):
+    def test_parallel_fraction_from_speedup(self):
+        # On 4 threads a stage with a parallel fraction of 0.8 runs 2.5 times faster.
+        model = calibrate([_record("dereplicate", 4, 4.0, cpu_time=10.0)])
+        single, fraction = model["dereplicate"]
+        self.assertAlmostEqual(fraction, 0.8)
+        self.assertAlmostEqual(single, 10.0)
+        self.assertAlmostEqual(stage_time(single, fraction, 4), 4.0)
+
+    def test_single_thread_uses_default(self):
+        model = calibrate([_record("search", 1, 3.0, cpu_time=3.0), _record("write", None, 1.0)])
+        self.assertEqual(model["search"], (3.0, default_parallel_fractions["search"]))
+        self.assertEqual(model["write"], (1.0, 0.0))
+
+    def test_other_stages_ignored(self):
+        self.assertEqual(calibrate([_record("validate", None, 1.0)]), {})
+
+    def test_pipelined_records_skipped(self):
+        # Their CPU time includes the other samples in flight, so they would give too high a speedup.
+        pipelined = dict(_record("dereplicate", 4, 1.0, cpu_time=40.0), pipelined=True)
+        model = calibrate([_record("dereplicate", 4, 4.0, cpu_time=10.0), pipelined])
+        self.assertEqual(model, calibrate([_record("dereplicate", 4, 4.0, cpu_time=10.0)]))
+
+
+class PlanStagesTests(unittest.TestCase):
+    def test_serial_stages_favour_samples(self):
+        model = {"search": (10.0, 0.0), "write": (1.0, 0.0)}
+        plan = plan_stages(model, threads=8, n_samples=20)
+        self.assertEqual(plan.workers, 8)
+        self.assertEqual(plan.stage_threads, {"search": 1})
+
+    def test_scaling_stage_gets_threads(self):
+        # One sample, so threads only help through the stages.
+        model = {"dereplicate": (10.0, 1.0), "search": (10.0, 0.0)}
+        plan = plan_stages(model, threads=4, n_samples=1)
+        self.assertEqual(plan.workers, 1)
+        self.assertEqual(plan.stage_threads["search"], 1)
+        self.assertGreater(plan.stage_threads["dereplicate"], 1)
+
+    def test_held_threads_within_budget(self):
+        model = {"merge": (5.0, 0.8), "dereplicate": (10.0, 0.95), "search": (20.0, 0.4),
+                 "write": (3.0, 0.0)}
+        plan = plan_stages(model, threads=16, n_samples=100)
+        self.assertGreaterEqual(plan.workers, 1)
+        for threads in plan.stage_threads.values():
+            self.assertLessEqual(threads, 2 * (16 // plan.workers))
+
+    def test_no_records(self):
+        plan = plan_stages({}, threads=4, n_samples=2)
+        self.assertEqual((plan.workers, plan.stage_threads), (2, {}))
+
+
+class ThreadPlanTests(unittest.TestCase):
+    def test_for_job_scales_with_job_threads(self):
+        plan = ThreadPlan(threads=8, workers=4, stage_threads={"dereplicate": 2, "search": 1})
+        self.assertEqual(plan.for_job(2), {"dereplicate": 2, "search": 1})
+        self.assertEqual(plan.for_job(8), {"dereplicate": 8, "search": 4})
+
+    def test_describe(self):
+        plan = ThreadPlan(threads=8, workers=4, stage_threads={"search": 1, "dereplicate": 2})
+        self.assertEqual(plan.describe(), "4 samples at once, threads per stage: dereplicate 2, search 1")
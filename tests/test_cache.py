@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from q2_itsxpress._cache import PositionCache, hmm_checksum, read_cache
+from q2_itsxpress._pool import sequence_digest
+
+
+class PositionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.hmmfile = os.path.join(self.tempdir, "F.hmm")
+        with open(self.hmmfile, 'w') as f:
+            f.write("HMMER3/f\n")
+        self.cache_dir = os.path.join(self.tempdir, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _cache(self, region="ITS2", max_entries=100):
+        return PositionCache(self.cache_dir, taxa="Fungi", region=region,
+                             hmmfile=self.hmmfile, max_entries=max_entries)
+
+    def test_store_and_lookup(self):
+        d1, d2, d3 = (sequence_digest(s) for s in ("ACGT", "GGCC", "TTAA"))
+        cache = self._cache()
+        self.assertEqual(cache.lookup({d1, d2}), {})
+        cache.store({d1: (10, 120, 200), d2: None})
+        cache.close()
+        cache = self._cache()
+        self.assertEqual(cache.lookup({d1, d2, d3}), {d1: (10, 120, 200), d2: None})
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        cache.close()
+
+    def test_region_is_part_of_key(self):
+        d1 = sequence_digest("ACGT")
+        cache = self._cache(region="ITS2")
+        cache.store({d1: (10, 120, 200)})
+        cache.close()
+        cache = self._cache(region="ITS1")
+        self.assertEqual(cache.lookup({d1}), {})
+        cache.close()
+
+    def test_least_recently_used_evicted(self):
+        digests = [sequence_digest(s) for s in ("AAAA", "CCCC", "GGGG")]
+        cache = self._cache(max_entries=2)
+        cache.store({digests[0]: (1, 2, 3)})
+        cache.store({digests[1]: (1, 2, 3)})
+        cache.lookup({digests[0]})
+        cache.store({digests[2]: (1, 2, 3)})
+        self.assertEqual(set(cache.lookup(set(digests))), {digests[0], digests[2]})
+        cache.close()
+
+    def test_hmm_checksum(self):
+        self.assertEqual(len(hmm_checksum(self.hmmfile)), 40)
+
+    def test_read_cache(self):
+        self.assertEqual(read_cache(self.cache_dir), {})
+        d1, d2 = (sequence_digest(s) for s in ("ACGT", "GGCC"))
+        cache = self._cache()
+        cache.store({d1: (10, 120, 200), d2: None})
+        cache.close()
+        hmm = hmm_checksum(self.hmmfile)
+        self.assertEqual(read_cache(self.cache_dir), {(d1, "Fungi", "ITS2", hmm): (10, 120, 200),
+                                                      (d2, "Fungi", "ITS2", hmm): None})
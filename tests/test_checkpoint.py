@@ -0,0 +1,69 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._checkpoint import CheckpointStore
+
+
+class CheckpointStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        root = self.tempdir.name
+        self.checkpoint_dir = os.path.join(root, "checkpoints")
+        self.inputs = os.path.join(root, "inputs")
+        self.results = os.path.join(root, "results")
+        os.makedirs(self.inputs)
+        os.makedirs(self.results)
+        self.sample = ("sample1",
+                       self._write(os.path.join(self.inputs, "s1_0_L001_R1_001.fastq.gz"), "@r1\nACGT\n+\nIIII\n"),
+                       self._write(os.path.join(self.inputs, "s1_1_L001_R2_001.fastq.gz"), "@r1\nTTGG\n+\nIIII\n"))
+        self.params = {"taxa": "Fungi", "region": "ITS2"}
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _write(self, path, text):
+        with gzip.open(path, 'wt') as f:
+            f.write(text)
+        return path
+
+    def _save(self, store):
+        key, done = store.restore(self.sample, self.results, paired_out=True)
+        self.assertFalse(done)
+        store.keys = {"sample1": key}
+        outputs = [self._write(os.path.join(self.results, os.path.basename(path)), "@r1\nCG\n+\nII\n")
+                   for path in self.sample[1:]]
+        store.save("sample1", outputs, metadata={"reads_out": 1})
+        return outputs
+
+    def test_restore(self):
+        outputs = self._save(CheckpointStore(self.checkpoint_dir, self.params))
+        for output in outputs:
+            os.remove(output)
+        key, done = CheckpointStore(self.checkpoint_dir, self.params).restore(
+            self.sample, self.results, paired_out=True)
+        self.assertTrue(done)
+        for output in outputs:
+            with gzip.open(output, 'rt') as f:
+                self.assertEqual(f.read(), "@r1\nCG\n+\nII\n")
+        with open(os.path.join(self.checkpoint_dir, key, "checkpoint.json")) as f:
+            self.assertEqual(json.load(f), {"sample_id": "sample1", "reads_out": 1})
+        store = CheckpointStore(self.checkpoint_dir, self.params)
+        store.keys = {"sample1": key}
+        self.assertEqual(store.metadata("sample1"), {"sample_id": "sample1", "reads_out": 1})
+        self.assertEqual(store.metadata("sample2"), {})
+        # Only finished checkpoints are left in the directory.
+        self.assertEqual(os.listdir(self.checkpoint_dir), [key])
+
+    def test_parameters_change_key(self):
+        self._save(CheckpointStore(self.checkpoint_dir, self.params))
+        other = CheckpointStore(self.checkpoint_dir, dict(self.params, region="ITS1"))
+        self.assertFalse(other.restore(self.sample, self.results, paired_out=True)[1])
+
+    def test_inputs_change_key(self):
+        store = CheckpointStore(self.checkpoint_dir, self.params)
+        key = store.key(self.sample)
+        self._write(self.sample[1], "@r1\nACGA\n+\nIIII\n")
+        self.assertNotEqual(store.key(self.sample), key)
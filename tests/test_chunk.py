@@ -0,0 +1,73 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._chunk import split_sample, join_files, combine_counts
+from q2_itsxpress._fastq import open_fastq, read_fastq
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FASTQ_R2 = os.path.join(TEST_DIR,
+                             "test_data",
+                             "paired",
+                             "445cf54a-bf06-4852-8010-13a60fa1598c",
+                             "data",
+                             "4774-1-MSITS3_1_L001_R2_001.fastq.gz")
+TEST_FASTQ_R1 = os.path.join(os.path.dirname(TEST_FASTQ_R2), "4774-1-MSITS3_0_L001_R1_001.fastq.gz")
+
+
+def _records(path):
+    with open_fastq(path) as f:
+        return list(read_fastq(f))
+
+
+class ChunkTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_split_paired(self):
+        chunks = split_sample(("s1", TEST_FASTQ_R1, TEST_FASTQ_R2), self.tempdir.name, chunk_reads=100)
+        forward = _records(TEST_FASTQ_R1)
+        reverse = _records(TEST_FASTQ_R2)
+        self.assertEqual(len(chunks), (len(forward) + 99) // 100)
+        self.assertEqual([chunk[0] for chunk in chunks[:2]], ["s1.chunk0", "s1.chunk1"])
+        self.assertEqual([record for chunk in chunks for record in _records(chunk[1])], forward)
+        self.assertEqual([record for chunk in chunks for record in _records(chunk[2])], reverse)
+        self.assertEqual(len(_records(chunks[0][2])), 100)
+
+    def test_split_single(self):
+        chunks = split_sample(("s1", TEST_FASTQ_R1, None), self.tempdir.name, chunk_reads=10 ** 6)
+        self.assertEqual(len(chunks), 1)
+        self.assertIsNone(chunks[0][2])
+        self.assertEqual(_records(chunks[0][1]), _records(TEST_FASTQ_R1))
+
+    def test_split_empty(self):
+        path = os.path.join(self.tempdir.name, "empty.fastq")
+        open(path, 'w').close()
+        chunks = split_sample(("s1", path, None), self.tempdir.name, chunk_reads=10)
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(_records(chunks[0][1]), [])
+
+    def test_join_files(self):
+        paths = []
+        for index in range(3):
+            path = os.path.join(self.tempdir.name, "part{}.fastq.gz".format(index))
+            with gzip.open(path, 'wt') as f:
+                f.write("@r{}\nACGT\n+\nIIII\n".format(index))
+            paths.append(path)
+        output = os.path.join(self.tempdir.name, "joined.fastq.gz")
+        join_files(paths, output)
+        self.assertEqual([title for title, _, _ in _records(output)], ["r0", "r1", "r2"])
+
+    def test_combine_counts(self):
+        combined = combine_counts([{"reads_in": 3, "merged": 2, "reads_out": None},
+                                   {"reads_in": 4, "merged": 1, "reads_out": 1}])
+        self.assertEqual(combined, {"reads_in": 7, "merged": 3, "reads_out": None})
+        self.assertEqual(combine_counts([]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
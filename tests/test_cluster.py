@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._cluster import collapse_duplicates, read_centroids, compose_uc
+from q2_itsxpress._pool import read_fasta
+
+
+class TwoTierTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.tempdir.name, name)
+
+    def test_collapse_duplicates(self):
+        with open(self._path("seq.fq"), 'w') as f:
+            for n, seq in enumerate(["ACGT", "TTTT", "TTTT", "acgt", "TTTT"]):
+                f.write("@r{} 1:N\n{}\n+\n{}\n".format(n, seq, "I" * len(seq)))
+        n_uniques = collapse_duplicates(self._path("seq.fq"), self._path("uniques.fa"),
+                                        self._path("uniques.tsv"))
+        self.assertEqual(n_uniques, 2)
+        # Most abundant first, with the abundance for Vsearch.
+        self.assertEqual(list(read_fasta(self._path("uniques.fa"))),
+                         [("r1;size=3", "TTTT"), ("r0;size=2", "ACGT")])
+        with open(self._path("uniques.tsv")) as f:
+            self.assertEqual(f.read().split(), ["r0", "r0", "r1", "r1", "r2", "r1",
+                                                "r3", "r0", "r4", "r1"])
+
+    def test_compose_uc(self):
+        with open(self._path("uniques.uc"), 'w') as f:
+            f.write("S\t0\t4\t*\t*\t*\t*\t*\tr1;size=3\t*\n")
+            f.write("H\t0\t4\t99.5\t+\t0\t0\t4M\tr0;size=2\tr1;size=3\n")
+            f.write("C\t0\t5\t*\t*\t*\t*\t*\tr1;size=3\t*\n")
+        centroids = read_centroids(self._path("uniques.uc"))
+        self.assertEqual(centroids, {"r1": "r1", "r0": "r1"})
+        with open(self._path("uniques.tsv"), 'w') as f:
+            f.write("r0\tr0\nr1\tr1\nr2\tr1\nr3\tr0\n")
+        compose_uc(self._path("uniques.tsv"), centroids, self._path("uc.txt"))
+        with open(self._path("uc.txt")) as f:
+            rows = [line.split() for line in f]
+        self.assertEqual([(row[0], row[8], row[9]) for row in rows],
+                         [("H", "r0", "r1"), ("S", "r1", "*"), ("H", "r2", "r1"), ("H", "r3", "r1")])
@@ -0,0 +1,81 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+import q2_itsxpress._derep as _derep
+from q2_itsxpress._derep import ReadMap, BoundedDedup
+from q2_itsxpress._fastq import open_fastq, read_fastq, read_id
+from q2_itsxpress._pool import PositionTable
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FASTQ = os.path.join(TEST_DIR,
+                          "test_data",
+                          "singleIn",
+                          "cfd0e65b-05fb-4329-9618-15ecd0aec9b3",
+                          "data",
+                          "4774-1-MSITS3_0_L001_R1_001.fastq.gz")
+
+
+class ReadMapTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        # Small chunks so that a few hundred reads spill several runs.
+        self.chunk_size = _derep.chunk_size
+        _derep.chunk_size = 16
+
+    def tearDown(self):
+        _derep.chunk_size = self.chunk_size
+        self.tempdir.cleanup()
+
+    def _check(self, memory_limit):
+        readmap = ReadMap(memory_limit=memory_limit, tempdir=self.tempdir.name)
+        expected = {}
+        for i in range(500):
+            # Every tenth read id is added again later with another representative.
+            read = "read{}".format(i % 450)
+            rep = "rep{}".format(i % 7)
+            readmap.add(read, rep)
+            expected[read] = rep
+        readmap.close()
+        reads = sorted(expected) + ["unknown"]
+        found = [readmap.rep_names[i] if i >= 0 else None for i in readmap.lookup(reads)]
+        self.assertEqual(found, [expected.get(read) for read in reads])
+        self.assertEqual(len(readmap), 500)
+        return readmap
+
+    def test_in_memory(self):
+        self._check(None)
+
+    def test_spilled(self):
+        readmap = self._check(1)
+        self.assertGreater(readmap.spilled, 5)
+        # The spilled runs are merged into one run on disk once all reads are added.
+        self.assertEqual(len(readmap._runs), 1)
+        self.assertEqual(len(readmap._runs[0][0]), 450)
+        self.assertEqual(sorted(os.listdir(self.tempdir.name)),
+                         ["readmap_merged_keys.bin", "readmap_merged_values.bin"])
+
+
+class BoundedDedupTests(unittest.TestCase):
+    def test_create_trimmed_seqs(self):
+        with tempfile.TemporaryDirectory() as tempdir, open_fastq(TEST_FASTQ) as f:
+            ids = [read_id(title) for title, _, _ in read_fastq(f)]
+            uc_file = os.path.join(tempdir, "uc.txt")
+            # Reads alternate between two representatives, the first and the second read.
+            with open(uc_file, 'w') as uc:
+                for n, seq_id in enumerate(ids):
+                    if n < 2:
+                        uc.write("S\t{}\t0\t*\t*\t*\t*\t*\t{}\t*\n".format(n, seq_id))
+                    else:
+                        uc.write("H\t{}\t0\t*\t*\t*\t*\t*\t{}\t{}\n".format(n % 2, seq_id, ids[n % 2]))
+            dedup = BoundedDedup(uc_file, seq_file=TEST_FASTQ, memory_limit=1, tempdir=tempdir)
+            outfile = os.path.join(tempdir, "out.fastq.gz")
+            written = dedup.create_trimmed_seqs(outfile, gzipped=True,
+                                                itspos=PositionTable({ids[0]: (5, 50, 250)}))
+            with gzip.open(outfile, 'rt') as f:
+                records = list(read_fastq(f))
+            self.assertEqual(written, len(records))
+            self.assertTrue(records)
+            for title, seq, qual in records:
+                self.assertEqual(len(seq), 45)
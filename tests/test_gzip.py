@@ -0,0 +1,33 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._gzip import open_gzip, block_size
+
+
+class OpenGzipTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "out.fastq.gz")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _roundtrip(self, text, **kwargs):
+        with open_gzip(self.path, **kwargs) as f:
+            f.write(text)
+        with gzip.open(self.path, 'rt') as f:
+            return f.read()
+
+    def test_parallel(self):
+        text = "".join("@read{}\nACGTACGTTGCA\n+\nIIIIIIIIIIII\n".format(i)
+                       for i in range(3 * block_size // 40))
+        self.assertGreater(len(text), 2 * block_size)
+        self.assertEqual(self._roundtrip(text, level=1, threads=4), text)
+
+    def test_single_thread(self):
+        self.assertEqual(self._roundtrip("@r\nA\n+\nI\n", level=9, threads=1), "@r\nA\n+\nI\n")
+
+    def test_empty(self):
+        self.assertEqual(self._roundtrip("", threads=4), "")
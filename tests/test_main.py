@@ -128,7 +128,7 @@ def test_trim_single_no_cluster():
     region = "ITS2"
     cluster_id = 1
 
-    exp1 = _itsxpress.trim_single(per_sample_sequences=TEST_DATA_SINGLEIN,
+    exp1, stats = _itsxpress.trim_single(per_sample_sequences=TEST_DATA_SINGLEIN,
                                 threads=threads,
                                 taxa=taxa,
                                 region=region,
@@ -167,9 +167,13 @@ class TrimTests(unittest.TestCase):
 
     def test_trim_single_success(self):
         with redirected_stdio(stderr=os.devnull):
-            obs_artifact, = self.trim_single_fn(self.se_seqs, 'ITS2')
+            obs_artifact, obs_stats = self.trim_single_fn(self.se_seqs, 'ITS2')
         self.assertEqual(str(obs_artifact.type),
                          'SampleData[SequencesWithQuality]')
+        self.assertEqual(str(obs_stats.type), 'SampleData[ITSxpressStats]')
+        stats = obs_stats.view(pd.DataFrame)
+        self.assertEqual(list(stats.index), ['4774-1-MSITS3'])
+        self.assertGreater(stats.loc['4774-1-MSITS3', 'trimmed-reads'], 0)
 
         obs_dir = obs_artifact.view(SingleLanePerSampleSingleEndFastqDirFmt)
         self.assertEqual(getsizeof(obs_dir), getsizeof(TEST_DATA_SINGLEOUT))
@@ -183,7 +187,7 @@ class TrimTests(unittest.TestCase):
 
     def test_trim_pair_success(self):
         with redirected_stdio(stderr=os.devnull):
-            obs_artifact, = self.trim_paired_fn(self.pe_seqs, 'ITS2')
+            obs_artifact, obs_stats = self.trim_paired_fn(self.pe_seqs, 'ITS2')
         self.assertEqual(str(obs_artifact.type),
                          'SampleData[JoinedSequencesWithQuality]')
 
@@ -199,7 +203,7 @@ class TrimTests(unittest.TestCase):
 
     def test_trim_pair_output_unmerged_success(self):
         with redirected_stdio(stderr=os.devnull):
-            obs_artifact, = self.trim_paired_unmerged_fn(self.pe_seqs, 'ITS2')
+            obs_artifact, obs_stats = self.trim_paired_unmerged_fn(self.pe_seqs, 'ITS2')
         self.assertEqual(str(obs_artifact.type),
                          'SampleData[PairedEndSequencesWithQuality]')
         obs = obs_artifact.view(SingleLanePerSamplePairedEndFastqDirFmt)
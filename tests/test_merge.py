@@ -0,0 +1,70 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._merge import tag_title, untag_title, bbmerge_counts, tag_reads, demultiplex
+
+
+class BatchMergeTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.tempdir.name, name)
+
+    def _fastq(self, name, titles):
+        with open(self._path(name), 'w') as f:
+            for title in titles:
+                f.write("@{}\nACGT\n+\nIIII\n".format(title))
+        return self._path(name)
+
+    def test_tag_round_trip(self):
+        title = "M01:1:2 1:N:0:ACGT_TTGA"
+        self.assertEqual(untag_title(tag_title(12, title)), (12, title))
+
+    def test_tag_reads(self):
+        pairs = [(self._fastq("a1.fq", ["a1 1:N"]), self._fastq("a2.fq", ["a1 2:N"])),
+                 (self._fastq("b1.fq", ["b1 1:N", "b2 1:N"]), self._fastq("b2.fq", ["b1 2:N", "b2 2:N"]))]
+        self.assertEqual(tag_reads(pairs, self._path("r1.fq"), self._path("r2.fq")), [1, 2])
+        with open(self._path("r1.fq")) as f:
+            self.assertEqual([line for line in f if line.startswith("@")],
+                             ["@s0_a1 1:N\n", "@s1_b1 1:N\n", "@s1_b2 1:N\n"])
+        with open(self._path("r2.fq")) as f:
+            self.assertEqual([line for line in f if line.startswith("@")],
+                             ["@s0_a1 2:N\n", "@s1_b1 2:N\n", "@s1_b2 2:N\n"])
+
+    def test_tag_reads_short_reverse(self):
+        # A short reverse file would pair the reads of the next sample with the wrong mates.
+        pairs = [(self._fastq("a1.fq", ["a1 1:N", "a2 1:N"]), self._fastq("a2.fq", ["a1 2:N"])),
+                 (self._fastq("b1.fq", ["b1 1:N"]), self._fastq("b2.fq", ["b1 2:N"]))]
+        with self.assertRaisesRegex(ValueError, "a2.fq has 1"):
+            tag_reads(pairs, self._path("r1.fq"), self._path("r2.fq"))
+
+    def test_bbmerge_counts(self):
+        stderr = ("Executing jgi.BBMerge [in=r1.fq, in2=r2.fq]\n\n"
+                  "Pairs:               \t1000\n"
+                  "Joined:              \t874       \t87.400%\n"
+                  "Ambiguous:           \t126       \t12.600%\n")
+        self.assertEqual(bbmerge_counts(stderr), (1000, 874))
+        self.assertEqual(bbmerge_counts("Exception in thread"), (None, None))
+
+    def test_demultiplex(self):
+        merged = self._fastq("merged.fq", ["s1_b2 1:N", "s0_a1 1:N", "s1_b1 1:N"])
+        outputs = [self._path("a.fq"), self._path("b.fq"), self._path("c.fq")]
+        self.assertEqual(demultiplex(merged, outputs), [1, 2, 0])
+        with open(outputs[1]) as f:
+            self.assertEqual(f.read(), "@b2 1:N\nACGT\n+\nIIII\n@b1 1:N\nACGT\n+\nIIII\n")
+        with open(outputs[2]) as f:
+            self.assertEqual(f.read(), "")
+
+    def test_gzipped_input(self):
+        path = self._path("a1.fq.gz")
+        with gzip.open(path, 'wt') as f:
+            f.write("@a1 1:N\nACGT\n+\nIIII\n")
+        tag_reads([(path, path)], self._path("r1.fq"), self._path("r2.fq"))
+        with open(self._path("r1.fq")) as f:
+            self.assertEqual(f.read(), "@s0_a1 1:N\nACGT\n+\nIIII\n")
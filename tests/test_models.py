@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._models import filter_models, prepare_models
+
+
+def _model(name):
+    return "HMMER3/f [3.1b2 | February 2015]\nNAME  {}\nLENG  2\n//\n".format(name)
+
+
+class ModelsTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.hmmfile = os.path.join(self.tempdir.name, "F.hmm")
+        with open(self.hmmfile, 'w') as f:
+            for name in ("1_SSU_end", "2_58S_start", "3_58S_end", "4_LSU_start", "3_58S_end_two"):
+                f.write(_model(name))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _names(self, hmmfile):
+        with open(hmmfile) as f:
+            return [line.split()[1] for line in f if line.startswith("NAME")]
+
+    def test_filter_models(self):
+        outfile = os.path.join(self.tempdir.name, "out.hmm")
+        self.assertEqual(filter_models(self.hmmfile, outfile, ("3_", "4_")), 3)
+        self.assertEqual(self._names(outfile), ["3_58S_end", "4_LSU_start", "3_58S_end_two"])
+
+    def test_prepare_models_reused(self):
+        model_dir = os.path.join(self.tempdir.name, "models")
+        first = prepare_models(self.hmmfile, region="ITS1", model_dir=model_dir)
+        if first.endswith(".hmm"):
+            self.assertEqual(self._names(first), ["1_SSU_end", "2_58S_start"])
+        mtime = os.path.getmtime(first)
+        second = prepare_models(self.hmmfile, region="ITS1", model_dir=model_dir)
+        self.assertEqual(first, second)
+        self.assertEqual(os.path.getmtime(second), mtime)
+        self.assertNotEqual(prepare_models(self.hmmfile, region="ALL", model_dir=model_dir), first)
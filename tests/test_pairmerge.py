@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._pairmerge import merge_batch, PairMerger
+
+_COMPLEMENT = str.maketrans("ACGT", "TGCA")
+INSERT = ("TCCGTAGGTGAACCTGCGGAAGGATCATTACAGAGTTGCAAAACTCCCTAAACCATTGTGAACGTTACCTAAACCGTTGCTTCGGCGGGCGGC"
+          "CCCGGGTCTCGCCGCGGAAGCCAAGCCGGAGCCTCTC")
+
+
+def _pair(insert, length, name="r1", qual1="I", qual2="I"):
+    rev = insert[-length:].translate(_COMPLEMENT)[::-1]
+    return ((name + " 1:N", insert[:length], qual1 * length),
+            (name + " 2:N", rev, qual2 * length))
+
+
+class MergeBatchTests(unittest.TestCase):
+    def test_merges_overlapping_pair(self):
+        merged = merge_batch([_pair(INSERT, 80)])
+        self.assertEqual(len(merged), 1)
+        title, seq, qual = merged[0]
+        self.assertEqual(title, "r1 1:N")
+        self.assertEqual(seq, INSERT)
+        self.assertEqual(len(qual), len(INSERT))
+        # Both reads support the overlap.
+        overlap = 160 - len(INSERT)
+        self.assertEqual(qual[80 - overlap:80], "J" * overlap)
+
+    def test_pairs_keep_their_order(self):
+        pairs = [_pair(INSERT[i:], 75, name="r{}".format(i)) for i in range(5)]
+        merged = merge_batch(pairs)
+        self.assertEqual([title for title, _, _ in merged], ["r{} 1:N".format(i) for i in range(5)])
+        self.assertEqual([seq for _, seq, _ in merged], [INSERT[i:] for i in range(5)])
+
+    def test_short_overlap_is_not_merged(self):
+        self.assertEqual(merge_batch([_pair(INSERT, 70)], min_overlap=20), [])
+        self.assertEqual(len(merge_batch([_pair(INSERT, 70)], min_overlap=10)), 1)
+
+    def test_mismatch_takes_better_base(self):
+        (t1, s1, q1), (t2, s2, q2) = _pair(INSERT, 80, qual1="5", qual2="I")
+        # A low quality error in the forward read, inside the overlap.
+        s1 = s1[:75] + ("A" if s1[75] != "A" else "C") + s1[76:]
+        seq = merge_batch([((t1, s1, q1), (t2, s2, q2))])[0][1]
+        self.assertEqual(seq, INSERT)
+
+    def test_too_many_mismatches(self):
+        (t1, s1, q1), rec2 = _pair(INSERT, 80)
+        s1 = s1[:60] + s1[60:].translate(_COMPLEMENT)
+        self.assertEqual(merge_batch([((t1, s1, q1), rec2)], max_mismatch_rate=0.1), [])
+
+
+class PairMergerTests(unittest.TestCase):
+    def test_merge_files(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            paths = [os.path.join(tempdir, name) for name in ("r1.fq", "r2.fq", "merged.fq")]
+            pairs = [_pair(INSERT[i:], 75, name="r{}".format(i)) for i in range(3)]
+            for path, records in zip(paths, zip(*pairs)):
+                with open(path, 'w') as f:
+                    for title, seq, qual in records:
+                        f.write("@{}\n{}\n+\n{}\n".format(title, seq, qual))
+            merger = PairMerger()
+            self.assertEqual(merger.merge_files(paths[0], paths[1], paths[2]), (3, 3))
+            with open(paths[2]) as f:
+                self.assertEqual(f.readline(), "@r0 1:N\n")
+                self.assertEqual(f.readline(), INSERT + "\n")
+
+    def test_unequal_read_counts(self):
+        pairs = [_pair(INSERT[i:], 75, name="r{}".format(i)) for i in range(2)]
+        forward = [rec1 for rec1, _ in pairs]
+        reverse = [rec2 for _, rec2 in pairs]
+        with self.assertRaisesRegex(ValueError, "reverse reads end at read 1"):
+            list(PairMerger().merge(forward, reverse[:1]))
+        with self.assertRaisesRegex(ValueError, "forward reads end at read 1"):
+            list(PairMerger().merge(forward[:1], reverse))
+
+    def test_mismatched_pair_names(self):
+        rec1, _ = _pair(INSERT, 80, name="r1")
+        _, rec2 = _pair(INSERT, 80, name="r2")
+        with self.assertRaisesRegex(ValueError, "Read 1 is named r1"):
+            list(PairMerger().merge([rec1], [rec2]))
+
+    def test_counter(self):
+        pairs = [_pair(INSERT[i:], 75, name="r{}".format(i)) for i in range(3)]
+        pairs.append(_pair(INSERT, 70, name="short"))
+        counter = [0]
+        merged = list(PairMerger(min_overlap=20).merge([p[0] for p in pairs], [p[1] for p in pairs],
+                                                       counter=counter))
+        self.assertEqual((counter[0], len(merged)), (4, 3))
@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+
+from q2_itsxpress._pipeline import Budget, Pipeline, Stage, parse_stage_workers, sample_memory, memory_factor
+
+
+class Tracker:
+    """Counts the items inside a set of stages at once."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def wrap(self, func, delay=0.01):
+        def run(value):
+            with self.lock:
+                self.current += 1
+                self.peak = max(self.peak, self.current)
+            try:
+                time.sleep(delay)
+                return func(value)
+            finally:
+                with self.lock:
+                    self.current -= 1
+        return run
+
+
+class PipelineTests(unittest.TestCase):
+    def test_order_kept(self):
+        # Later items are quicker, so they would finish first without reordering.
+        stages = [Stage("a", lambda x: (time.sleep(0.002 * (10 - x)), x + 1)[1], workers=3),
+                  Stage("b", lambda x: x * 10, workers=2)]
+        self.assertEqual(Pipeline(stages).run(list(range(10))), [(x + 1) * 10 for x in range(10)])
+
+    def test_empty(self):
+        self.assertEqual(Pipeline([Stage("a", lambda x: x)]).run([]), [])
+
+    def test_stages_overlap(self):
+        tracker = Tracker()
+        stages = [Stage(name, tracker.wrap(lambda x: x)) for name in ("a", "b", "c")]
+        self.assertEqual(Pipeline(stages).run(list(range(6))), list(range(6)))
+        self.assertGreater(tracker.peak, 1)
+
+    def test_budget_limits_items_in_flight(self):
+        tracker = Tracker()
+        stages = [Stage("a", tracker.wrap(lambda x: x), workers=4),
+                  Stage("b", tracker.wrap(lambda x: x), workers=4)]
+        budget = Budget(2)
+        pipeline = Pipeline(stages, budgets=[(budget, lambda x: 1)])
+        self.assertEqual(pipeline.run(list(range(8))), list(range(8)))
+        self.assertLessEqual(tracker.peak, 2)
+        self.assertEqual(budget.used, 0)
+
+    def test_oversized_item_runs_alone(self):
+        tracker = Tracker()
+        budget = Budget(10)
+        pipeline = Pipeline([Stage("a", tracker.wrap(lambda x: x), workers=3)],
+                            budgets=[(budget, lambda x: 100 if x == 1 else 4)])
+        self.assertEqual(pipeline.run([0, 1, 2]), [0, 1, 2])
+        self.assertEqual(tracker.peak, 1)
+
+    def test_error_raised_and_rest_dropped(self):
+        seen = []
+
+        def fail(x):
+            if x == 2:
+                raise ValueError("bad item")
+            return x
+
+        def record(x):
+            seen.append(x)
+            return x
+        budget = Budget(3)
+        pipeline = Pipeline([Stage("a", fail), Stage("b", record)], budgets=[(budget, lambda x: 1)])
+        with self.assertRaisesRegex(ValueError, "bad item"):
+            pipeline.run(list(range(50)))
+        self.assertNotIn(2, seen)
+        self.assertLess(len(seen), 49)
+        self.assertEqual(budget.used, 0)
+
+    def test_parse_stage_workers(self):
+        self.assertEqual(parse_stage_workers(None), {"merge": 1, "dereplicate": 1, "search": 1, "write": 1})
+        self.assertEqual(parse_stage_workers("merge=2, search=3"),
+                         {"merge": 2, "dereplicate": 1, "search": 3, "write": 1})
+        for spec in ("gzip=2", "merge=two", "merge=0"):
+            with self.assertRaises(ValueError):
+                parse_stage_workers(spec)
+
+    def test_sample_memory(self):
+        self.assertEqual(sample_memory(100), memory_factor * 100)
+        self.assertEqual(sample_memory(100, memory_limit=50), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
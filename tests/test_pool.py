@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from q2_itsxpress._pool import (read_fasta,
+                                pool_representatives,
+                                split_positions,
+                                count_usable,
+                                PositionTable)
+
+
+class _Positions:
+    """A minimal stand-in for itsxpress.ItsPosition."""
+    def __init__(self, ddict):
+        self.ddict = ddict
+
+    def get_position(self, sequence):
+        return self.ddict[sequence]
+
+
+class PoolRepresentativesTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.rep1 = os.path.join(self.tempdir, "rep1.fa")
+        self.rep2 = os.path.join(self.tempdir, "rep2.fa")
+        with open(self.rep1, 'w') as f:
+            f.write(">read1;size=3\nACGTACGT\nAAAA\n>read2\nTTTTGGGG\n")
+        with open(self.rep2, 'w') as f:
+            f.write(">readA\nttttgggg\n>readB\nCCCCCCCC\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_read_fasta_wrapped(self):
+        obs = list(read_fasta(self.rep1))
+        self.assertEqual(obs, [("read1;size=3", "ACGTACGTAAAA"), ("read2", "TTTTGGGG")])
+
+    def test_pool_shared_sequences(self):
+        pooled = os.path.join(self.tempdir, "pooled.fa")
+        idmaps = pool_representatives([self.rep1, self.rep2], pooled)
+        self.assertEqual(len(list(read_fasta(pooled))), 3)
+        self.assertEqual(idmaps[0]["read2"], idmaps[1]["readA"])
+        self.assertNotEqual(idmaps[1]["readB"], idmaps[0]["read1;size=3"])
+
+    def test_split_positions(self):
+        pooled = os.path.join(self.tempdir, "pooled.fa")
+        idmaps = pool_representatives([self.rep1, self.rep2], pooled)
+        its_pos = _Positions({idmaps[0]["read2"]: (2, 6, 8)})
+        tables = split_positions(its_pos, idmaps)
+        self.assertEqual(tables[1].get_position("readA"), (2, 6, 8))
+        with self.assertRaises(KeyError):
+            tables[1].get_position("readB")
+
+    def test_split_cached_positions(self):
+        # Pooled searches through the position cache return a PositionTable.
+        pooled = os.path.join(self.tempdir, "pooled.fa")
+        idmaps = pool_representatives([self.rep1, self.rep2], pooled)
+        tables = split_positions(PositionTable({idmaps[0]["read2"]: (2, 6, 8)}), idmaps)
+        self.assertEqual(tables[0].get_position("read2"), (2, 6, 8))
+        self.assertEqual(tables[1].get_position("readA"), (2, 6, 8))
+        with self.assertRaises(KeyError):
+            tables[1].get_position("readB")
+
+    def test_count_usable(self):
+        positions = {"a": (5, 90, 120), "b": (None, 90, 120), "c": (5, None, 120), "d": (90, 5, 120)}
+        self.assertEqual(count_usable(PositionTable(positions)), 1)
+        self.assertEqual(count_usable(_Positions(positions)), 1)
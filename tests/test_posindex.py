@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import q2_itsxpress._posindex as _posindex
+from q2_itsxpress._posindex import INDEX_COLUMNS, index_positions, parse_row, read_index, write_index
+from q2_itsxpress._pool import sequence_digest
+
+
+class PositionIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "positions.tsv")
+        self.d1, self.d2, self.d3 = (sequence_digest(s) for s in ("ACGT", "GGCC", "TTAA"))
+        self.rows = {(self.d1, "F", "ITS2", "abc"): (10, 120, 200),
+                     (self.d2, "F", "ITS2", "abc"): None,
+                     (self.d3, "F", "ITS1", "abc"): (None, 90, 150),
+                     (self.d1, "F", "ITS2", "def"): (12, 122, 200)}
+
+    def tearDown(self):
+        _posindex._loaded.clear()
+        self.tempdir.cleanup()
+
+    def test_round_trip(self):
+        self.assertEqual(write_index(self.rows, self.path), 4)
+        self.assertEqual(read_index(self.path), self.rows)
+        with open(self.path) as f:
+            self.assertEqual(f.readline().rstrip("\n").split("\t"), list(INDEX_COLUMNS))
+
+    def test_empty_index(self):
+        write_index({}, self.path)
+        self.assertEqual(read_index(self.path), {})
+
+    def test_bad_header(self):
+        with open(self.path, 'w') as f:
+            f.write("digest\tstart\n")
+        with self.assertRaises(ValueError):
+            read_index(self.path)
+
+    def test_parse_row_errors(self):
+        digest = self.d1.hex()
+        self.assertEqual(parse_row([digest, "F", "ALL", "abc", "0", "", "", ""]), ((self.d1, "F", "ALL", "abc"), None))
+        for row in ([digest, "F", "ITS2", "abc", "1", "1", "2"],
+                    ["abc", "F", "ITS2", "abc", "1", "1", "2", "3"],
+                    [digest, "F", "ITS3", "abc", "1", "1", "2", "3"],
+                    [digest, "F", "ITS2", "abc", "yes", "1", "2", "3"],
+                    [digest, "F", "ITS2", "abc", "1", "x", "2", "3"]):
+            with self.assertRaises(ValueError):
+                parse_row(row)
+
+    def test_index_positions(self):
+        write_index(self.rows, self.path)
+        self.assertEqual(index_positions(self.path, taxa="F", region="ITS2", hmm="abc"),
+                         {self.d1: (10, 120, 200), self.d2: None})
+        self.assertEqual(index_positions(self.path, taxa="F", region="ITS1", hmm="abc"),
+                         {self.d3: (None, 90, 150)})
+        self.assertEqual(index_positions(self.path, taxa="B", region="ITS2", hmm="abc"), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._profile import Profiler, write_profile, read_profile, PROFILE_FIELDS
+
+
+class ProfilerTests(unittest.TestCase):
+    def test_stage_record(self):
+        profiler = Profiler("sample1")
+        with profiler.stage("dereplicate") as record:
+            record["reads_in"] = 10
+            record["reads_out"] = 4
+        self.assertEqual(len(profiler.records), 1)
+        record = profiler.records[0]
+        self.assertEqual(set(record), set(PROFILE_FIELDS))
+        self.assertEqual(record["sample_id"], "sample1")
+        self.assertEqual(record["stage"], "dereplicate")
+        self.assertEqual((record["reads_in"], record["reads_out"]), (10, 4))
+        self.assertGreaterEqual(record["wall_time"], 0)
+
+    def test_stage_recorded_on_error(self):
+        profiler = Profiler("sample1")
+        with self.assertRaises(ValueError):
+            with profiler.stage("search"):
+                raise ValueError
+        self.assertEqual(profiler.records[0]["stage"], "search")
+
+
+class WriteProfileTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        profiler = Profiler("sample1")
+        for stage in ("check", "write"):
+            with profiler.stage(stage):
+                pass
+        self.records = profiler.records
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_json(self):
+        path = os.path.join(self.tempdir.name, "profile.json")
+        write_profile(self.records, path)
+        with open(path) as f:
+            self.assertEqual(json.load(f), self.records)
+
+    def test_tsv(self):
+        path = os.path.join(self.tempdir.name, "profile.tsv")
+        write_profile(self.records, path)
+        with open(path) as f:
+            rows = list(csv.DictReader(f, delimiter="\t"))
+        self.assertEqual([row["stage"] for row in rows], ["check", "write"])
+        self.assertEqual(list(rows[0]), PROFILE_FIELDS)
+
+    def test_read_back(self):
+        for name in ("profile.json", "profile.tsv"):
+            path = os.path.join(self.tempdir.name, name)
+            write_profile(self.records, path)
+            records = read_profile(path)
+            self.assertEqual([record["stage"] for record in records], ["check", "write"])
+            self.assertEqual(records[0]["threads"], None)
+            self.assertAlmostEqual(records[1]["wall_time"], self.records[1]["wall_time"])
+
+    def test_read_back_pipelined(self):
+        self.records[1]["pipelined"] = True
+        for name in ("profile.json", "profile.tsv"):
+            path = os.path.join(self.tempdir.name, name)
+            write_profile(self.records, path)
+            self.assertEqual([record["pipelined"] for record in read_profile(path)], [False, True])
@@ -0,0 +1,78 @@
+import io
+import os
+import pickle
+import tempfile
+import unittest
+
+import q2_itsxpress._readindex as _readindex
+from q2_itsxpress._fastq import open_fastq, read_fastq, read_id
+from q2_itsxpress._readindex import PairIndexer, index_fastq, trim_indexed_pairs
+from q2_itsxpress._trim import DictLookup, RepPositions, trim_fastq_pairs
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FASTQ_R2 = os.path.join(TEST_DIR,
+                             "test_data",
+                             "paired",
+                             "445cf54a-bf06-4852-8010-13a60fa1598c",
+                             "data",
+                             "4774-1-MSITS3_1_L001_R2_001.fastq.gz")
+TEST_FASTQ_R1 = os.path.join(os.path.dirname(TEST_FASTQ_R2), "4774-1-MSITS3_0_L001_R1_001.fastq.gz")
+
+
+class Positions:
+    """ITS positions by representative id, with the get_position of ItsPosition."""
+    def __init__(self, positions):
+        self.positions = positions
+
+    def get_position(self, name):
+        return self.positions[name]
+
+
+class ReadIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.index_chunk = _readindex.index_chunk
+
+    def tearDown(self):
+        _readindex.index_chunk = self.index_chunk
+        self.tempdir.cleanup()
+
+    def test_index_fastq(self):
+        index = index_fastq(TEST_FASTQ_R1, self.tempdir.name, "r1")
+        with open_fastq(TEST_FASTQ_R1) as f:
+            records = list(read_fastq(f))
+        self.assertEqual(len(index), len(records))
+        self.assertEqual(index.read_ids(0, len(index)), [read_id(title) for title, _, _ in records])
+        self.assertEqual(index.read_ids(3, 5), [read_id(title) for title, _, _ in records[3:5]])
+        # Only the paths are pickled, the copies are mapped again when used.
+        copy = pickle.loads(pickle.dumps(index))
+        self.assertEqual(copy.read_ids(7, 8), index.read_ids(7, 8))
+
+    def test_empty_file(self):
+        path = os.path.join(self.tempdir.name, "empty.fq")
+        open(path, 'w').close()
+        index = index_fastq(path, self.tempdir.name, "empty")
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.read_ids(0, 0), [])
+
+    def test_trim_matches_files(self):
+        with open_fastq(TEST_FASTQ_R1) as f:
+            ids = [read_id(title) for title, _, _ in read_fastq(f)]
+        # Reads cycle through four representatives, one without an ITS, and the last reads have none.
+        lookup = DictLookup({name: "rep{}".format(i % 4) for i, name in enumerate(ids[:-9])})
+        positions = RepPositions(lookup.rep_names, Positions({"rep0": (20, 150, 300), "rep1": (5, 400, 300),
+                                                              "rep2": (None, 90, 300), "rep3": (30, 210, 250)}))
+        expected1, expected2 = io.BytesIO(), io.BytesIO()
+        expected = trim_fastq_pairs(TEST_FASTQ_R1, TEST_FASTQ_R2, lookup, positions, expected1, expected2)
+        with PairIndexer(TEST_FASTQ_R1, TEST_FASTQ_R2, self.tempdir.name) as indexer:
+            pass
+        _readindex.index_chunk = 17
+        out1, out2 = io.BytesIO(), io.BytesIO()
+        written = trim_indexed_pairs(*indexer.indexes, lookup, positions, out1, out2)
+        self.assertEqual(written, expected)
+        self.assertEqual(out1.getvalue(), expected1.getvalue())
+        self.assertEqual(out2.getvalue(), expected2.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import itertools
+import unittest
+
+from q2_itsxpress._scheduler import plan_threads, run_samples, plan_jobs
+
+
+def _square(x):
+    return x * x
+
+
+class PlanThreadsTests(unittest.TestCase):
+    def test_auto_one_thread_per_sample(self):
+        self.assertEqual(plan_threads(threads=8, n_samples=96), (8, 1))
+
+    def test_auto_few_samples(self):
+        self.assertEqual(plan_threads(threads=8, n_samples=2), (2, 4))
+
+    def test_fixed_parallelism(self):
+        self.assertEqual(plan_threads(threads=8, n_samples=96, sample_parallelism=2), (2, 4))
+
+    def test_parallelism_capped_by_threads(self):
+        self.assertEqual(plan_threads(threads=2, n_samples=96, sample_parallelism=8), (2, 1))
+
+
+class RunSamplesTests(unittest.TestCase):
+    def test_order_is_kept(self):
+        samples = list(range(10))
+        self.assertEqual(run_samples(_square, samples, workers=3),
+                         [x * x for x in samples])
+
+
+class PlanJobsTests(unittest.TestCase):
+    def test_largest_first(self):
+        jobs = plan_jobs([10, 1000, 100], threads=3, workers=3)
+        self.assertEqual([indices for indices, _ in jobs], [[1], [2], [0]])
+
+    def test_large_sample_gets_more_threads(self):
+        jobs = plan_jobs([1000, 100], threads=8, workers=4)
+        self.assertEqual(jobs, [([0], 6), ([1], 2)])
+
+    def test_running_jobs_stay_within_threads(self):
+        for sizes, threads, workers in (([90, 5, 5], 8, 2),
+                                        ([1000, 100, 100, 100], 8, 4),
+                                        ([1000, 100, 100], 8, 4),
+                                        ([45, 45, 10], 10, 3),
+                                        ([500, 400, 300, 20, 10], 16, 3)):
+            with self.subTest(sizes=sizes, threads=threads, workers=workers):
+                job_threads = [n for _, n in plan_jobs(sizes, threads=threads, workers=workers)]
+                running = min(workers, len(job_threads))
+                self.assertLessEqual(max(sum(c) for c in itertools.combinations(job_threads, running)), threads)
+
+    def test_small_samples_are_batched(self):
+        sizes = [1000] + [1] * 20
+        jobs = plan_jobs(sizes, threads=2, workers=2)
+        self.assertEqual(jobs[0], ([0], 1))
+        batched = sorted(index for indices, _ in jobs[1:] for index in indices)
+        self.assertEqual(batched, list(range(1, 21)))
+        self.assertLess(len(jobs), 21)
+
+    def test_equal_samples_run_alone(self):
+        jobs = plan_jobs([100] * 4, threads=4, workers=4)
+        self.assertEqual(jobs, [([0], 1), ([1], 1), ([2], 1), ([3], 1)])
+
+    def test_no_samples(self):
+        self.assertEqual(plan_jobs([], threads=4, workers=2), [])
@@ -0,0 +1,119 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from q2_itsxpress._fastq import open_fastq, read_fastq
+from q2_itsxpress._pool import read_fasta
+from q2_itsxpress._shard import (plan_shards,
+                                 split_fasta,
+                                 merge_domtables,
+                                 hmmsearch_parameters,
+                                 sharded_search,
+                                 min_shard_size)
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FASTQ = os.path.join(TEST_DIR,
+                          "test_data",
+                          "paired",
+                          "445cf54a-bf06-4852-8010-13a60fa1598c",
+                          "data",
+                          "4774-1-MSITS3_0_L001_R1_001.fastq.gz")
+
+
+def _domline(target, model, c_evalue, score):
+    # The independent E-value already uses -Z, and is left small so it never filters.
+    return " ".join([target, "-", "300", model, "-", "60", "1e-20", str(score), "0.1",
+                     "1", "1", str(c_evalue), "1e-20", str(score), "0.1",
+                     "1", "60", "10", "70", "8", "72", "0.99", "-"]) + "\n"
+
+
+def _domains(dom_file):
+    """Returns the target, model, coordinates and score of each domain, which do not depend on the database size."""
+    with open(dom_file) as f:
+        return sorted((ll[0], ll[3], ll[13]) + tuple(ll[15:21])
+                      for ll in (line.split() for line in f if not line.startswith("#")))
+
+
+class PlanShardsTests(unittest.TestCase):
+    def test_few_sequences(self):
+        self.assertEqual(plan_shards(threads=32, n_seqs=10), (1, 32))
+
+    def test_many_sequences(self):
+        self.assertEqual(plan_shards(threads=32, n_seqs=100 * min_shard_size), (16, 2))
+
+    def test_one_thread(self):
+        self.assertEqual(plan_shards(threads=1, n_seqs=100 * min_shard_size), (1, 1))
+
+
+class SplitFastaTests(unittest.TestCase):
+    def test_balanced(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            fasta = os.path.join(tempdir, "rep.fa")
+            seqs = {"seq{}".format(i): "A" * (100 + i % 7 * 50) for i in range(100)}
+            with open(fasta, 'w') as f:
+                for seq_id, seq in seqs.items():
+                    f.write(">{}\n{}\n".format(seq_id, seq))
+            shards = split_fasta(fasta, tempdir, 4)
+            sizes = []
+            found = {}
+            for shard in shards:
+                records = dict(read_fasta(shard))
+                sizes.append(sum(len(seq) for seq in records.values()))
+                found.update(records)
+            self.assertEqual(found, seqs)
+            self.assertLessEqual(max(sizes) - min(sizes), 400)
+
+
+class MergeDomtablesTests(unittest.TestCase):
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            shard1 = os.path.join(tempdir, "shard0.domtbl")
+            shard2 = os.path.join(tempdir, "shard1.domtbl")
+            with open(shard1, 'w') as f:
+                f.write("# comment\n")
+                f.write(_domline("seq1", "F.ITS2.3_start", 1e-10, 40.0))
+                # Passes in its shard, but not once rescaled to both shards.
+                f.write(_domline("seq1", "F.ITS2.4_end", 6.0, 5.0))
+            with open(shard2, 'w') as f:
+                f.write(_domline("seq2", "F.ITS2.3_start", 1e-10, 38.0))
+                f.write(_domline("seq2", "F.ITS2.4_end", 1e-8, 30.0))
+            merged = os.path.join(tempdir, "domtbl.txt")
+            merge_domtables([shard1, shard2], merged)
+            with open(merged) as f:
+                lines = [line.split() for line in f]
+            self.assertEqual([(ll[0], ll[3]) for ll in lines],
+                             [("seq1", "F.ITS2.3_start"),
+                              ("seq2", "F.ITS2.3_start"),
+                              ("seq2", "F.ITS2.4_end")])
+            # The independent E-value is not rescaled again.
+            self.assertEqual([ll[12] for ll in lines], ["1e-20"] * 3)
+
+
+@unittest.skipUnless(shutil.which("hmmsearch"), "hmmsearch is not installed")
+class ShardedSearchTests(unittest.TestCase):
+    def test_same_domains_as_single_search(self):
+        from itsxpress.definitions import ROOT_DIR, taxa_dict
+        hmmfile = os.path.join(ROOT_DIR, "ITSx_db", "HMMs", taxa_dict["F"])
+        with tempfile.TemporaryDirectory() as tempdir:
+            fasta = os.path.join(tempdir, "rep.fa")
+            with open_fastq(TEST_FASTQ) as f, open(fasta, 'w') as out:
+                n_seqs = 0
+                for title, seq, _ in read_fastq(f):
+                    out.write(">seq{}\n{}\n".format(n_seqs, seq))
+                    n_seqs += 1
+            single = os.path.join(tempdir, "single.domtbl")
+            subprocess.run(hmmsearch_parameters(hmmfile, fasta, single, threads=1),
+                           stdout=subprocess.DEVNULL, check=True)
+            sharded = os.path.join(tempdir, "sharded.domtbl")
+            sharded_search(fasta, hmmfile=hmmfile, dom_file=sharded, n_seqs=n_seqs, n_shards=3, threads=1)
+            self.assertEqual(_domains(sharded), _domains(single))
+
+
+class HmmsearchParametersTests(unittest.TestCase):
+    def test_database_size(self):
+        parameters = hmmsearch_parameters("F.hmm", "rep.fa", "domtbl.txt", 2, n_targets=1000)
+        self.assertEqual(parameters[-2:], ["F.hmm", "rep.fa"])
+        self.assertIn("-Z", parameters)
+        self.assertEqual(parameters[parameters.index("-Z") + 1], "1000")
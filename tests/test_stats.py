@@ -0,0 +1,46 @@
+import math
+import unittest
+
+from q2_itsxpress._stats import stats_table
+
+
+def _record(stage, wall_time, reads_in=None):
+    return {"sample_id": "s1", "stage": stage, "wall_time": wall_time,
+            "reads_in": reads_in, "reads_out": None}
+
+
+class StatsTableTests(unittest.TestCase):
+    def test_counts_and_throughput(self):
+        reports = [{"sample_id": "s1",
+                    "profile": [_record("merge", 2.0, reads_in=1000), _record("search", 0.5)],
+                    "stats": {"reads_in": 1000, "merged": 900, "unique": 40, "its_found": 35,
+                              "reads_out": 850}},
+                   {"sample_id": None, "profile": [_record("pool", 1.0)]}]
+        table = stats_table(reports)
+        self.assertEqual(table.index.name, "sample-id")
+        self.assertEqual(list(table.index), ["s1"])
+        row = table.loc["s1"]
+        self.assertEqual(row["merged-reads"], 900)
+        self.assertEqual(row["dropped-reads"], 150)
+        self.assertEqual(row["merge-reads-per-second"], 500)
+        self.assertEqual(row["search-seconds"], 0.5)
+        self.assertNotIn("search-reads-per-second", table.columns)
+        self.assertNotIn("pool-seconds", table.columns)
+        self.assertEqual(row["restored"], "no")
+
+    def test_missing_counts(self):
+        reports = [{"sample_id": "s1", "profile": [_record("write", 1.0, reads_in=10)],
+                    "stats": {"reads_in": 10, "unique": 4, "its_found": 3, "reads_out": 8}},
+                   {"sample_id": "s2", "profile": [], "restored": True}]
+        table = stats_table(reports)
+        self.assertEqual(list(table.index), ["s1", "s2"])
+        self.assertTrue(math.isnan(table.loc["s1", "merged-reads"]))
+        self.assertTrue(math.isnan(table.loc["s2", "trimmed-reads"]))
+        self.assertTrue(math.isnan(table.loc["s2", "write-seconds"]))
+        self.assertEqual(table.loc["s2", "restored"], "yes")
+        self.assertEqual(str(table["input-reads"].dtype), "float64")
+
+    def test_no_samples(self):
+        table = stats_table([])
+        self.assertEqual(len(table), 0)
+        self.assertIn("trimmed-reads", table.columns)
@@ -0,0 +1,97 @@
+import gzip
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from q2_itsxpress._pool import read_fasta, strand_digest, PositionTable
+from q2_itsxpress._stream import StreamSample, open_fastq, read_fastq
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FASTQ = os.path.join(TEST_DIR,
+                          "test_data",
+                          "singleIn",
+                          "cfd0e65b-05fb-4329-9618-15ecd0aec9b3",
+                          "data",
+                          "4774-1-MSITS3_0_L001_R1_001.fastq.gz")
+_COMPLEMENT = str.maketrans("ACGTN", "TGCAN")
+
+
+def _revcomp(seq):
+    return seq.translate(_COMPLEMENT)[::-1]
+
+
+def _write_reverse_complements(path):
+    """Writes the test reads with every third read reverse complemented, returns the reads."""
+    with open_fastq(TEST_FASTQ) as f:
+        # The test reads repeat their ids, so each is renamed.
+        reads = [("r{}".format(n), _revcomp(seq) if n % 3 == 0 else seq, qual[::-1] if n % 3 == 0 else qual)
+                 for n, (title, seq, qual) in enumerate(read_fastq(f))]
+    with open(path, 'w') as out:
+        for title, seq, qual in reads:
+            out.write("@{}\n{}\n+\n{}\n".format(title, seq, qual))
+    return reads
+
+
+class StreamSampleTests(unittest.TestCase):
+    def setUp(self):
+        self.sobj = StreamSample(fastq=TEST_FASTQ)
+        self.sobj.dereplicate()
+
+    def tearDown(self):
+        shutil.rmtree(self.sobj.tempdir)
+
+    def test_dereplicate(self):
+        with open_fastq(TEST_FASTQ) as f:
+            seqs = {seq for _, seq, _ in read_fastq(f)}
+        reps = list(read_fasta(self.sobj.rep_file))
+        self.assertEqual(len(reps), len(seqs))
+        self.assertEqual({seq for _, seq in reps}, seqs)
+
+    def test_create_trimmed_seqs(self):
+        rep_ids = [seq_id for seq_id, _ in read_fasta(self.sobj.rep_file)]
+        # Trim the first representative only, all other reads are dropped.
+        itspos = PositionTable({rep_ids[0]: (5, 50, 250)})
+        outfile = os.path.join(self.sobj.tempdir, "out.fastq.gz")
+        self.sobj.create_trimmed_seqs(outfile, gzipped=True, itspos=itspos)
+        with gzip.open(outfile, 'rt') as f:
+            records = list(read_fastq(f))
+        self.assertTrue(records)
+        for title, seq, qual in records:
+            self.assertEqual(len(seq), 45)
+            self.assertEqual(len(qual), 45)
+
+
+class StrandTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fastq = os.path.join(self.tempdir, "reads.fastq")
+        self.reads = _write_reverse_complements(self.fastq)
+        self.sobj = StreamSample(fastq=self.fastq, tempdir=self.tempdir)
+        self.sobj.dereplicate()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_strand_digest(self):
+        self.assertEqual(strand_digest("AACGTTG"), strand_digest("caacgtt"))
+        self.assertNotEqual(strand_digest("AACGTTG"), strand_digest("AACGTTC"))
+
+    def test_reverse_complements_share_a_representative(self):
+        keys = {strand_digest(seq) for _, seq, _ in self.reads}
+        reps = list(read_fasta(self.sobj.rep_file))
+        self.assertEqual(len(reps), len(keys))
+        self.assertLess(len(reps), len({seq for _, seq, _ in self.reads}))
+        self.assertEqual(sum(self.sobj.sizes.values()), len(self.reads))
+
+    @unittest.skipUnless(shutil.which("vsearch"), "vsearch is not installed")
+    def test_matches_file_dereplication(self):
+        # The file based workflow dereplicates with itsxpress' Vsearch parameters.
+        rep_file = os.path.join(self.tempdir, "vsearch.fa")
+        subprocess.run(["vsearch", "--derep_fulllength", self.fastq, "--output", rep_file,
+                        "--uc", os.path.join(self.tempdir, "vsearch.uc"), "--strand", "both",
+                        "--threads", "1"], stderr=subprocess.DEVNULL, check=True)
+        stream_reps = {seq_id: seq.upper() for seq_id, seq in read_fasta(self.sobj.rep_file)}
+        file_reps = {seq_id: seq.upper() for seq_id, seq in read_fasta(rep_file)}
+        self.assertEqual(stream_reps, file_reps)
@@ -0,0 +1,139 @@
+import io
+import os
+import tempfile
+import unittest
+
+from Bio import SeqIO
+
+import q2_itsxpress._trim as _trim
+from q2_itsxpress._fastq import open_fastq
+from q2_itsxpress._trim import DictLookup, RepPositions, read_blocks, trim_fastq, trim_fastq_pairs
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FASTQ = os.path.join(TEST_DIR,
+                          "test_data",
+                          "singleIn",
+                          "cfd0e65b-05fb-4329-9618-15ecd0aec9b3",
+                          "data",
+                          "4774-1-MSITS3_0_L001_R1_001.fastq.gz")
+TEST_FASTQ_R2 = os.path.join(TEST_DIR,
+                             "test_data",
+                             "paired",
+                             "445cf54a-bf06-4852-8010-13a60fa1598c",
+                             "data",
+                             "4774-1-MSITS3_1_L001_R2_001.fastq.gz")
+TEST_FASTQ_R1 = os.path.join(os.path.dirname(TEST_FASTQ_R2), "4774-1-MSITS3_0_L001_R1_001.fastq.gz")
+
+
+class Positions:
+    """ITS positions by representative id, with the get_position of ItsPosition."""
+    def __init__(self, positions):
+        self.positions = positions
+
+    def get_position(self, name):
+        return self.positions[name]
+
+
+def _parse(path):
+    with open_fastq(path) as f:
+        return list(SeqIO.parse(f, 'fastq'))
+
+
+def _write(records):
+    handle = io.StringIO()
+    SeqIO.write(records, handle, 'fastq')
+    return handle.getvalue().encode('utf-8')
+
+
+class TrimTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.block_bytes = _trim.block_bytes
+
+    def tearDown(self):
+        _trim.block_bytes = self.block_bytes
+        self.tempdir.cleanup()
+
+    def _matchdict(self, records):
+        # Reads cycle through five representatives, one without an ITS and one with its start after its stop.
+        return {record.id: "rep{}".format(i % 5) for i, record in enumerate(records[:-7])}
+
+    def _positions(self):
+        return Positions({"rep0": (20, 150, 300), "rep1": (5, 400, 300), "rep2": (None, 90, 300),
+                          "rep3": (120, 60, 300), "rep4": (-40, -2, 300)})
+
+    def _trim(self, path, matchdict, positions):
+        out = io.BytesIO()
+        lookup = DictLookup(matchdict)
+        written = trim_fastq(path, lookup, RepPositions(lookup.rep_names, positions), out)
+        return written, out.getvalue()
+
+    def test_merged_matches_biopython(self):
+        records = _parse(TEST_FASTQ)
+        matchdict = self._matchdict(records)
+        positions = self._positions()
+        expected = []
+        for record in records:
+            if record.id in matchdict:
+                start, stop, _ = positions.get_position(matchdict[record.id])
+                if start and stop and start < stop:
+                    expected.append(record[start:stop])
+        for size in (1 << 22, 1000, 1):
+            _trim.block_bytes = size
+            written, data = self._trim(TEST_FASTQ, matchdict, positions)
+            self.assertEqual(written, len(expected))
+            self.assertEqual(data, _write(expected))
+
+    def test_paired_matches_biopython(self):
+        records1 = _parse(TEST_FASTQ_R1)
+        records2 = _parse(TEST_FASTQ_R2)
+        matchdict = self._matchdict(records1)
+        positions = self._positions()
+        expected1, expected2 = [], []
+        for record1, record2 in zip(records1, records2):
+            if record1.id in matchdict:
+                start, stop, tlen = positions.get_position(matchdict[record1.id])
+                if start and stop and start < stop:
+                    expected1.append(record1[start:])
+                    expected2.append(record2[tlen - stop:])
+        lookup = DictLookup(matchdict)
+        out1, out2 = io.BytesIO(), io.BytesIO()
+        written = trim_fastq_pairs(TEST_FASTQ_R1, TEST_FASTQ_R2, lookup,
+                                   RepPositions(lookup.rep_names, positions), out1, out2)
+        self.assertEqual(written, len(expected1))
+        self.assertEqual(out1.getvalue(), _write(expected1))
+        self.assertEqual(out2.getvalue(), _write(expected2))
+
+    def test_unpaired_tail_dropped(self):
+        path1 = os.path.join(self.tempdir.name, "r1.fq")
+        path2 = os.path.join(self.tempdir.name, "r2.fq")
+        with open(path1, 'w') as f:
+            f.write("@a 1\nACGTACGT\n+\nIIIIIIII\n@b 1\nTTTTGGGG\n+\nJJJJJJJJ\n")
+        with open(path2, 'w') as f:
+            f.write("@a 2\nCCCCAAAA\n+\nHHHHHHHH\n")
+        lookup = DictLookup({"a": "rep", "b": "rep"})
+        out1, out2 = io.BytesIO(), io.BytesIO()
+        written = trim_fastq_pairs(path1, path2, lookup, RepPositions(["rep"], Positions({"rep": (2, 6, 10)})),
+                                   out1, out2)
+        self.assertEqual(written, 1)
+        self.assertEqual(out1.getvalue(), b"@a 1\nGTACGT\n+\nIIIIII\n")
+        self.assertEqual(out2.getvalue(), b"@a 2\nAAAA\n+\nHHHH\n")
+
+    def test_line_endings(self):
+        path = os.path.join(self.tempdir.name, "reads.fq")
+        # CRLF line ends, trailing spaces, a blank line between records and no final newline.
+        with open(path, 'wb') as f:
+            f.write(b"@a x\r\nACGTAC \r\n+a\r\nIIIIII\r\n\r\n@b\r\nGGGCCC\r\n+\r\nJJJJJJ")
+        _trim.block_bytes = 7
+        written, data = self._trim(path, {"a": "rep", "b": "rep"}, Positions({"rep": (1, 4, 6)}))
+        self.assertEqual(written, 2)
+        self.assertEqual(data, b"@a x\nCGT\n+\nIII\n@b\nGGC\n+\nJJJ\n")
+
+    def test_read_blocks(self):
+        with open_fastq(TEST_FASTQ, 'rb') as f:
+            ids = [read_id for block in read_blocks(f, 997) for read_id in block.read_ids()]
+        self.assertEqual(ids, [record.id for record in _parse(TEST_FASTQ)])
+
+
+if __name__ == '__main__':
+    unittest.main()
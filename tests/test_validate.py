@@ -0,0 +1,78 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._validate import pair_name, validate_sample, check_sample, ValidationCache
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "paired",
+                        "445cf54a-bf06-4852-8010-13a60fa1598c", "data")
+FORWARD = os.path.join(TEST_DIR, "4774-1-MSITS3_0_L001_R1_001.fastq.gz")
+REVERSE = os.path.join(TEST_DIR, "4774-1-MSITS3_1_L001_R2_001.fastq.gz")
+
+
+class ValidateTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _fastq(self, name, records):
+        path = os.path.join(self.tempdir.name, name)
+        with open(path, 'w') as f:
+            for title, seq, qual in records:
+                f.write("@{}\n{}\n+\n{}\n".format(title, seq, qual))
+        return path
+
+    def test_pair_name(self):
+        self.assertEqual(pair_name("M01:1:2 1:N:0:108"), "M01:1:2")
+        self.assertEqual(pair_name("read7/2"), "read7")
+
+    def test_valid_pair(self):
+        self.assertEqual(validate_sample(("s1", FORWARD, REVERSE)), [])
+        self.assertEqual(validate_sample(("s1", FORWARD, REVERSE), limit=10), [])
+
+    def test_mismatched_names(self):
+        fwd = self._fastq("r1.fq", [("a 1:N", "ACGT", "IIII"), ("b 1:N", "ACGT", "IIII")])
+        rev = self._fastq("r2.fq", [("a 2:N", "ACGT", "IIII"), ("c 2:N", "ACGT", "IIII")])
+        errors = validate_sample(("s1", fwd, rev))
+        self.assertEqual(len(errors), 1)
+        self.assertIn("read 2", errors[0])
+
+    def test_different_counts(self):
+        fwd = self._fastq("r1.fq", [("a", "ACGT", "IIII"), ("b", "ACGT", "IIII")])
+        rev = self._fastq("r2.fq", [("a", "ACGT", "IIII")])
+        self.assertIn("different numbers", validate_sample(("s1", fwd, rev))[0])
+
+    def test_malformed_record(self):
+        fwd = self._fastq("r1.fq", [("a", "ACGT", "III")])
+        self.assertIn("4 bases and 3 qualities", validate_sample(("s1", fwd, None))[0])
+
+    def test_interleaved(self):
+        fwd = self._fastq("r1.fq", [("a/1", "ACGT", "IIII"), ("a/2", "ACGT", "IIII"),
+                                    ("b/1", "ACGT", "IIII"), ("b/2", "ACGT", "IIII")])
+        self.assertIn("interleaved", validate_sample(("s1", fwd, None))[0])
+
+    def test_truncated_gzip(self):
+        path = os.path.join(self.tempdir.name, "r1.fq.gz")
+        with open(FORWARD, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        self.assertIn("could not be read", validate_sample(("s1", path, None))[0])
+
+    def test_missing_file(self):
+        path = os.path.join(self.tempdir.name, "missing.fq")
+        self.assertIn("could not be found", validate_sample(("s1", path, None))[0])
+
+    def test_cache_skips_passed_samples(self):
+        cache_dir = os.path.join(self.tempdir.name, "cache")
+        fwd = self._fastq("r1.fq", [("a", "ACGT", "IIII")])
+        self.assertEqual(check_sample(("s1", fwd, None), cache_dir=cache_dir), [])
+        cache = ValidationCache(cache_dir)
+        self.assertTrue(cache.passed(cache.key(("s1", fwd, None))))
+        # A changed file is checked again.
+        self._fastq("r1.fq", [("a", "ACGT", "III")])
+        self.assertFalse(cache.passed(cache.key(("s1", fwd, None))))
+        self.assertNotEqual(check_sample(("s1", fwd, None), cache_dir=cache_dir), [])
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from q2_itsxpress._workspace import Workspace, scratch_needed, space_factor, chunk_space_factor
+
+
+class WorkspaceTests(unittest.TestCase):
+    def setUp(self):
+        self.scratch = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.scratch.cleanup()
+
+    def test_created_under_scratch_dir(self):
+        with Workspace(self.scratch.name) as workspace:
+            self.assertEqual(os.path.dirname(workspace.root), self.scratch.name)
+            sample_dir = workspace.mkdtemp()
+            self.assertEqual(os.path.dirname(sample_dir), workspace.root)
+        self.assertFalse(os.path.exists(workspace.root))
+
+    def test_removed_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with Workspace(self.scratch.name) as workspace:
+                with open(os.path.join(workspace.mkdtemp(), "seq.fq"), 'w') as f:
+                    f.write("@r1\nACGT\n+\nIIII\n")
+                raise RuntimeError("hmmsearch failed")
+        self.assertEqual(os.listdir(self.scratch.name), [])
+
+    def test_creates_scratch_dir(self):
+        scratch_dir = os.path.join(self.scratch.name, "nvme", "scratch")
+        with Workspace(scratch_dir) as workspace:
+            self.assertTrue(os.path.isdir(workspace.root))
+
+    def test_check_space(self):
+        with Workspace(self.scratch.name) as workspace:
+            self.assertTrue(workspace.check_space(0))
+            with self.assertLogs(level='WARNING'):
+                self.assertFalse(workspace.check_space(workspace.free_space() + 2 ** 40))
+
+    def test_scratch_needed(self):
+        self.assertEqual(scratch_needed([10, 300, 20, 100], workers=2), space_factor * 400)
+        self.assertEqual(scratch_needed([], workers=2), 0)
+
+    def test_scratch_needed_chunked(self):
+        # The split sample runs alone, with its uncompressed chunks.
+        self.assertEqual(scratch_needed([10, 300, 20, 100], workers=2, chunk_threshold=200),
+                         (space_factor + chunk_space_factor) * 300)
+        self.assertEqual(scratch_needed([10, 300, 20, 100], workers=2, chunk_threshold=1000),
+                         space_factor * 400)